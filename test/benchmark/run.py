@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+'''Benchmarks for the feed, version and manifest hot paths.
+
+Everything runs against synthetic feeds and archives, so no network access
+is needed. Results are written as JSON, so that runs can be compared
+across commits:
+
+	python -m test.benchmark.run --sizes=10,1000,50000 --output=before.json
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import subprocess
+from StringIO import StringIO
+
+from zeroinstall_downstream import archive, composite_version, feed as feed_module
+from zeroinstall_downstream.feed import Feed
+from zeroinstall_downstream.project import SOURCES
+from zeroinstall_downstream.project.common import BaseProject, Implementation, cached_property
+
+DEFAULT_SIZES = '10,1000,10000'
+ALGORITHMS = ('sha1new', 'sha256', 'sha256new')
+
+class SyntheticProject(BaseProject):
+	'''A project with `count` releases (versions 1.0.0, 1.0.1, ...),
+	of which the feed has published all but the newest `unpublished`'''
+	upstream_type = 'benchmark'
+	summary = 'a synthetic project'
+	description = 'a synthetic project, for benchmarking'
+	homepage = url = 'http://example.com/synthetic'
+
+	def __init__(self, id, count='0'):
+		super(SyntheticProject, self).__init__(id)
+		self.count = int(count)
+
+	@cached_property
+	def version_strings(self):
+		return [version_string(i) for i in range(self.count)]
+
+	def implementation_for(self, version):
+		return Implementation(version=version, url='http://example.com/synthetic-%s.tgz' % (version.upstream,), released='2013-01-01')
+
+class StubArchive(object):
+	def __init__(self, url, type=None, extract=None, **k):
+		self.url = url
+		self.type = type
+		self.extract = extract
+		self.size = 1234
+		self.manifests = {'sha1new': 'a' * 40, 'sha256': 'b' * 64}
+
+def version_string(i):
+	return '%s.%s.%s' % (i // 10000 + 1, (i // 100) % 100, i % 100)
+
+def synthetic_feed(count, unpublished=1):
+	'''Returns the XML of a feed with `count - unpublished` implementations'''
+	project = SyntheticProject('synthetic', count=count)
+	feed = Feed.from_project(project, 'http://example.com/synthetic.xml')
+	next(feed.doc.iter(feed_module.GFXMONK, 'upstream')).set('count', str(count))
+	group = feed._groups[-1]
+	for i in range(count - unpublished):
+		impl = feed._mknode('implementation')
+		impl.set('id', 'sha1new=%040x' % (i,))
+		impl.set('version', version_string(i))
+		impl.set('released', '2013-01-01')
+		digest = feed._mknode('manifest-digest')
+		digest.set('sha256', '%064x' % (i,))
+		impl.append(digest)
+		tarball = feed._mknode('archive')
+		tarball.set('href', 'http://example.com/synthetic-%s.tgz' % (version_string(i),))
+		tarball.set('size', '1234')
+		impl.append(tarball)
+		group.append(impl)
+	buf = StringIO()
+	feed.save(buf)
+	return buf.getvalue()
+
+def synthetic_tree(base, files, file_size):
+	'''Creates `files` files of `file_size` bytes under `base`, 100 per directory'''
+	chunk = os.urandom(min(file_size, 1024 * 1024))
+	for i in range(files):
+		directory = os.path.join(base, 'd%d' % (i // 100,))
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+		with open(os.path.join(directory, 'f%d' % (i,)), 'wb') as f:
+			remaining = file_size
+			while remaining > 0:
+				f.write(chunk[:remaining])
+				remaining -= len(chunk)
+
+class Runner(object):
+	def __init__(self, repeat):
+		self.repeat = repeat
+		self.results = []
+
+	def time(self, name, fn, size=None, setup=None):
+		'''Record the timings of `fn()`, best of `repeat` runs. `setup` (if
+		given) is called before each run, and its result passed to `fn`.'''
+		timings = []
+		for _ in range(self.repeat):
+			arg = setup() if setup is not None else None
+			start = time.time()
+			fn(arg) if setup is not None else fn()
+			timings.append(time.time() - start)
+		result = {'name': name, 'size': size, 'seconds': min(timings), 'timings': timings}
+		print >> sys.stderr, "%-40s %8s %10.4fs" % (name, '' if size is None else size, result['seconds'])
+		self.results.append(result)
+
+def bench_feeds(runner, sizes):
+	SOURCES['benchmark'] = SyntheticProject
+	feed_module.Archive = StubArchive
+	for size in sizes:
+		xml = synthetic_feed(size)
+		load = lambda: Feed.from_file(StringIO(xml))
+		runner.time('feed.from_file', load, size)
+		runner.time('feed.published_versions', lambda feed: feed.published_versions, size, setup=load)
+		runner.time('feed.unpublished_versions', lambda feed: feed.unpublished_versions(), size, setup=load)
+		runner.time('feed.unpublished_versions(newest_only)', lambda feed: feed.unpublished_versions(newest_only=True), size, setup=load)
+		runner.time('feed.add_implementation', lambda feed: feed.add_implementation(), size, setup=load)
+		runner.time('feed.xml', lambda feed: feed.xml, size, setup=load)
+		runner.time('feed.save', lambda feed: feed.save(StringIO()), size, setup=load)
+
+def bench_versions(runner, sizes):
+	for size in sizes:
+		strings = [version_string(i) for i in range(size)]
+		runner.time('version.parse', lambda: [composite_version.CompositeVersion(s) for s in strings], size)
+		runner.time('version.parse(cached)', lambda: [composite_version.parse(s) for s in strings], size)
+		versions = [composite_version.try_parse(s) for s in reversed(strings)]
+		runner.time('version.sort', lambda: sorted(versions), size)
+		runner.time('version.max', lambda: max(versions), size)
+		runner.time('version.index', lambda: composite_version.VersionIndex(versions), size)
+
+def bench_manifests(runner, small_files, huge_files, huge_size):
+	base = tempfile.mkdtemp()
+	try:
+		trees = [
+			('small-files', os.path.join(base, 'small'), small_files, 4 * 1024),
+			('huge-files', os.path.join(base, 'huge'), huge_files, huge_size * 1024 * 1024),
+		]
+		for name, root, files, file_size in trees:
+			synthetic_tree(root, files, file_size)
+			size = '%sx%s' % (files, file_size)
+			for algname in ALGORITHMS:
+				runner.time('manifest.%s.%s' % (name, algname), lambda: archive.get_manifest(root, None, algname), size)
+			runner.time('manifest.%s.all' % (name,), lambda: archive.get_manifests(root, None, ALGORITHMS), size)
+	finally:
+		shutil.rmtree(base)
+
+def git_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=open(os.devnull, 'w')).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def main():
+	parser = argparse.ArgumentParser(description='benchmark 0downstream\'s hot paths (without network access)')
+	parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma-separated feed / version list sizes (default %(default)s)')
+	parser.add_argument('--small-files', type=int, default=5000, help='number of small files in the synthetic archive (default %(default)s)')
+	parser.add_argument('--huge-files', type=int, default=2, help='number of huge files in the synthetic archive (default %(default)s)')
+	parser.add_argument('--huge-size', type=int, default=64, help='size of each huge file, in MB (default %(default)s)')
+	parser.add_argument('--repeat', type=int, default=3, help='number of runs of each benchmark (default %(default)s)')
+	parser.add_argument('--only', choices=['feeds', 'versions', 'manifests'], action='append', help='run just these benchmarks')
+	parser.add_argument('--output', '-o', help='write JSON results to this file (default: stdout)')
+	opts = parser.parse_args()
+
+	sizes = [int(size) for size in opts.sizes.split(',')]
+	only = opts.only or ['feeds', 'versions', 'manifests']
+	runner = Runner(opts.repeat)
+	if 'versions' in only:
+		bench_versions(runner, sizes)
+	if 'feeds' in only:
+		bench_feeds(runner, sizes)
+	if 'manifests' in only:
+		bench_manifests(runner, opts.small_files, opts.huge_files, opts.huge_size)
+
+	report = {
+		'commit': git_commit(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'results': runner.results,
+	}
+	if opts.output:
+		with open(opts.output, 'w') as output:
+			json.dump(report, output, indent=2)
+	else:
+		json.dump(report, sys.stdout, indent=2)
+		print
+
+if __name__ == '__main__':
+	sys.exit(main())
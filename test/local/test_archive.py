@@ -1,7 +1,12 @@
 import os
+import tarfile
+import tempfile
+import shutil
+from StringIO import StringIO
 from mocktest import *
 
-from zeroinstall_downstream.archive import Archive, urllib2
+from zeroinstall_downstream.archive import Archive, session, can_stream
+from zeroinstall_downstream import archive
 
 mandy = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'mandy-0.1.4.tar.gz')
 mandy_extracted = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'mandy-extracted.tar.gz')
@@ -9,7 +14,7 @@ mandy_extracted = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'man
 class MockDownloadedArchiveTest(TestCase):
 	def setUp(self):
 		self.data = None
-		when(urllib2).urlopen.then_call(self.get_data)
+		when(session).urlopen.then_call(self.get_data)
 	
 	def get_data(self, *a):
 		if self.data is None:
@@ -29,7 +34,7 @@ class MockDownloadedArchiveTest(TestCase):
 
 class LocalArchiveTest(TestCase):
 	def test_archive_will_use_local_file(self):
-		expect(urllib2).urlopen.never()
+		expect(session).urlopen.never()
 		archive = Archive(url='http://example.com/mandy.tar.gz', local_file = mandy)
 		self.assertEqual(archive.url, 'http://example.com/mandy.tar.gz')
 		self.assertEqual(archive.manifests, {'sha1new':'887dab86294802388fa1382c268185afff7c47a8', 'sha256':'6f1d3c8ed295c16dc9a4eae37587f5cd38c875aa37489f0db7eef212589505ca'})
@@ -50,11 +55,123 @@ class LocalArchiveTest(TestCase):
 		self.assertEqual(archive.extract, None)
 
 	def test_archive_will_use_supplied_extract(self):
-		expect(urllib2).urlopen.never()
+		expect(session).urlopen.never()
 		archive = Archive(url='http://example.com/mandy.tar.gz', local_file = mandy_extracted, extract='mandy.egg-info')
 		self.assertEqual(archive.manifests, {'sha1new':'813d2b89d98d8ac693a67297f4834ba13af04120', 'sha256':'4aa6aacde9dfcdd7c1a7c6fa76a7d244250cb17aacd96b674ce79fbdf1444577'})
 		self.assertEqual(archive.size, 6794)
 		self.assertEqual(archive.extract, 'mandy.egg-info')
 
+	def test_archive_computes_all_requested_algorithms(self):
+		archive = Archive(url='http://example.com/mandy.tar.gz', local_file = mandy, algorithms=('sha1new', 'sha256', 'sha256new'))
+		self.assertEqual(archive.manifests, {
+			'sha1new':'887dab86294802388fa1382c268185afff7c47a8',
+			'sha256':'6f1d3c8ed295c16dc9a4eae37587f5cd38c875aa37489f0db7eef212589505ca',
+			'sha256new':'N4OTZDWSSXAW3SNE5LRXLB7VZU4MQ5NKG5EJ6DNX53ZBEWEVAXFA'})
 
+	def test_archive_rejects_unknown_algorithms(self):
+		self.assertRaises(ValueError, lambda: Archive(url='http://example.com/mandy.tar.gz', local_file = mandy, algorithms=('md5',)))
 
+	def test_archive_digests_match_when_extracted_to_disk(self):
+		archive = Archive(url='http://example.com/mandy.tar.gz', local_file = mandy_extracted, extract='mandy.egg-info', streaming=False)
+		self.assertEqual(archive.manifests, {'sha1new':'813d2b89d98d8ac693a67297f4834ba13af04120', 'sha256':'4aa6aacde9dfcdd7c1a7c6fa76a7d244250cb17aacd96b674ce79fbdf1444577'})
+		self.assertEqual(archive.size, 6794)
+		self.assertEqual(archive.extract, 'mandy.egg-info')
+
+	def test_archive_rejects_missing_extract_dir(self):
+		self.assertRaises(ValueError, lambda: Archive(url='http://example.com/mandy.tar.gz', local_file = mandy, extract='nonexistent'))
+
+class StreamingArchiveTest(TestCase):
+	def setUp(self):
+		self.base = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	def test_only_tar_types_are_streamed(self):
+		self.assertTrue(can_stream('http://example.com/mandy.tar.gz'))
+		self.assertTrue(can_stream('http://example.com/mandy.gem'))
+		self.assertTrue(can_stream('http://example.com/tarball/0.1', type='application/x-compressed-tar'))
+		self.assertFalse(can_stream('http://example.com/mandy.zip'))
+
+	def test_gem_contents_are_streamed(self):
+		gem = os.path.join(self.base, 'mandy-0.1.4.gem')
+		with tarfile.open(gem, 'w') as tar:
+			tar.add(mandy, arcname='data.tar.gz')
+		archive = Archive(url='http://example.com/mandy-0.1.4.gem', local_file = gem, type='application/x-ruby-gem')
+		self.assertEqual(archive.manifests, {'sha1new':'887dab86294802388fa1382c268185afff7c47a8', 'sha256':'6f1d3c8ed295c16dc9a4eae37587f5cd38c875aa37489f0db7eef212589505ca'})
+		self.assertEqual(archive.size, os.stat(gem).st_size)
+		self.assertEqual(archive.extract, 'mandy-0.1.4')
+
+	def test_uncompressed_and_bzip2_archives_are_streamed(self):
+		import gzip, bz2
+		data = gzip.open(mandy).read()
+		for filename, compress in (('mandy.tar', lambda data: data), ('mandy.tar.bz2', bz2.compress)):
+			path = os.path.join(self.base, filename)
+			with open(path, 'wb') as f:
+				f.write(compress(data))
+			archive = Archive(url='http://example.com/' + filename, local_file = path)
+			self.assertEqual(archive.manifests, {'sha1new':'887dab86294802388fa1382c268185afff7c47a8', 'sha256':'6f1d3c8ed295c16dc9a4eae37587f5cd38c875aa37489f0db7eef212589505ca'})
+			self.assertEqual(archive.size, os.stat(path).st_size)
+
+	def test_toplevel_contents_are_listed_from_the_archive_index(self):
+		import zipfile
+		self.assertEqual(archive.list_toplevel('http://example.com/mandy.tar.gz', local_file=mandy), ['mandy-0.1.4'])
+		self.assertEqual(archive.list_toplevel('http://example.com/mandy.tar.gz', local_file=mandy_extracted), ['PKG-INFO', 'README', 'mandy', 'mandy.egg-info', 'setup.cfg', 'setup.py'])
+		path = os.path.join(self.base, 'mandy.zip')
+		with zipfile.ZipFile(path, 'w') as zip:
+			zip.writestr('mandy/a.py', '')
+			zip.writestr('mandy/b/c.py', '')
+		self.assertEqual(archive.list_toplevel('http://example.com/mandy.zip', local_file=path), ['mandy'])
+		self.assertEqual(archive.list_toplevel('http://example.com/mandy.dmg', local_file=path), None)
+
+	def test_truncated_archives_are_rejected(self):
+		path = os.path.join(self.base, 'mandy.tar.gz')
+		with open(path, 'wb') as f:
+			f.write(open(mandy, 'rb').read()[:3000])
+		self.assertRaises(tarfile.ReadError, lambda: Archive(url='http://example.com/mandy.tar.gz', local_file = path))
+
+	def test_hard_links_out_of_extract_are_followed(self):
+		def make_tar(name, hard_link):
+			path = os.path.join(self.base, name)
+			with tarfile.open(path, 'w') as tar:
+				for member_name in ('shared/setup.py', 'mandy/setup.py'):
+					member = tarfile.TarInfo(member_name)
+					if hard_link and member_name.startswith('mandy/'):
+						member.type = tarfile.LNKTYPE
+						member.linkname = 'shared/setup.py'
+						tar.addfile(member)
+					else:
+						member.size = len('setup()')
+						tar.addfile(member, StringIO('setup()'))
+			return Archive(url='http://example.com/mandy.tar', local_file=path, extract='mandy')
+		self.assertEqual(make_tar('linked.tar', hard_link=True).manifests, make_tar('copied.tar', hard_link=False).manifests)
+
+class ParallelManifestTest(TestCase):
+	def setUp(self):
+		self.base = tempfile.mkdtemp()
+		with tarfile.open(mandy) as tar:
+			tar.extractall(self.base)
+		os.symlink('setup.py', os.path.join(self.base, 'mandy-0.1.4', 'link'))
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	def test_parallel_manifests_match_serial_manifests(self):
+		algorithms = ('sha1new', 'sha256', 'sha256new')
+		serial = archive.get_manifests(self.base, 'mandy-0.1.4', algorithms)
+		self.assertEqual(archive.get_manifests(self.base, 'mandy-0.1.4', algorithms, jobs=2), serial)
+		# treat every file as large, so it's mmap()ed and hashed one function per job
+		modify(archive).MMAP_THRESHOLD = 1
+		self.assertEqual(archive.get_manifests(self.base, 'mandy-0.1.4', algorithms), serial)
+		self.assertEqual(archive.get_manifests(self.base, 'mandy-0.1.4', algorithms, jobs=2), serial)
+
+	def test_worker_threads_dont_start_hashing_processes(self):
+		import threading
+		modify(archive)._hash_pools = {}
+		serial = archive.get_manifests(self.base, 'mandy-0.1.4')
+		results = []
+		thread = threading.Thread(target=lambda: results.append(archive.get_manifests(self.base, 'mandy-0.1.4', jobs=3)))
+		thread.start()
+		thread.join()
+		self.assertEqual(results, [serial])
+		self.assertEqual(archive._hash_pools, {})
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from mocktest import *
+
+from zeroinstall_downstream.archive import Archive, session
+from zeroinstall_downstream.archive_cache import ArchiveCache
+
+mandy = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'mandy-0.1.4.tar.gz')
+mandy_extracted = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'mandy-extracted.tar.gz')
+mandy_manifests = {'sha1new':'887dab86294802388fa1382c268185afff7c47a8', 'sha256':'6f1d3c8ed295c16dc9a4eae37587f5cd38c875aa37489f0db7eef212589505ca'}
+
+class Response(StringIO):
+	status_code = 200
+	def __init__(self, path, headers):
+		with open(path) as f:
+			StringIO.__init__(self, f.read())
+		self.headers = headers
+
+	def info(self):
+		return self.headers
+
+class ArchiveCacheTest(TestCase):
+	def setUp(self):
+		self.base = tempfile.mkdtemp()
+		self.cache = ArchiveCache(self.base)
+		self.downloads = []
+		when(session).urlopen.then_call(self.download)
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	def download(self, url, headers=None):
+		self.downloads.append(url)
+		path = mandy_extracted if 'extracted' in url else mandy
+		return Response(path, {'etag': '"1234"'})
+
+	def test_second_archive_uses_cached_manifests(self):
+		first = Archive(url='http://example.com/mandy.tar.gz', cache=self.cache)
+		second = Archive(url='http://example.com/mandy.tar.gz', cache=self.cache)
+		for archive in (first, second):
+			self.assertEqual(archive.manifests, mandy_manifests)
+			self.assertEqual(archive.size, 6795)
+			self.assertEqual(archive.extract, 'mandy-0.1.4')
+		self.assertEqual(self.downloads, ['http://example.com/mandy.tar.gz'])
+
+	def test_cached_blob_is_rehashed_for_a_different_extract(self):
+		Archive(url='http://example.com/mandy.tar.gz', cache=self.cache)
+		archive = Archive(url='http://example.com/mandy.tar.gz', cache=self.cache, extract=False)
+		self.assertEqual(len(self.downloads), 1)
+		self.assertEqual(archive.manifests, {'sha1new':'55388d828dff5ed41dcad47308e2773b30971380', 'sha256':'b7eb422cf2eab00eb7b2ab925ff4ea5c0155c3b39757809bcd34a3283c44e85a'})
+		self.assertEqual(archive.extract, None)
+
+	def test_identical_content_is_stored_once(self):
+		self.cache.fetch('http://example.com/mandy.tar.gz')
+		self.cache.fetch('http://mirror.example.com/mandy.tar.gz')
+		self.assertEqual(self.cache.size, 6795)
+		self.assertEqual(
+			self.cache.lookup('http://example.com/mandy.tar.gz').path,
+			self.cache.lookup('http://mirror.example.com/mandy.tar.gz').path)
+
+	def test_least_recently_used_blobs_are_evicted(self):
+		self.cache.max_size = 10000
+		self.cache.fetch('http://example.com/mandy.tar.gz')
+		self.cache.fetch('http://example.com/mandy-extracted.tar.gz')
+		self.assertEqual(self.cache.lookup('http://example.com/mandy.tar.gz'), None)
+		self.assertNotEqual(self.cache.lookup('http://example.com/mandy-extracted.tar.gz'), None)
+		self.assertEqual(self.cache.size, 6794)
+
+	def test_aborted_downloads_ignore_late_writes(self):
+		download = self.cache.download('http://example.com/mandy.tar.gz', {})
+		download.write('partial')
+		download.abort()
+		download.write('more')
+		self.assertFalse(os.path.exists(download.partial))
+		self.assertEqual(download.size, len('partial'))
+
+	def test_revalidation_uses_etag(self):
+		self.cache.fetch('http://example.com/mandy.tar.gz')
+		self.cache.revalidate = True
+		self.assertNotEqual(self.cache.lookup('http://example.com/mandy.tar.gz'), None)
+		when(session).urlopen.then_return(Response(mandy, {'etag': '"5678"'}))
+		self.assertEqual(self.cache.lookup('http://example.com/mandy.tar.gz'), None)
@@ -0,0 +1,64 @@
+import os
+import threading
+from mocktest import *
+
+from zeroinstall_downstream import archive
+from zeroinstall_downstream.archive import Archive, session
+from zeroinstall_downstream.archive_registry import ArchiveRegistry
+
+mandy_extracted = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'mandy-extracted.tar.gz')
+
+class ArchiveRegistryTest(TestCase):
+	def setUp(self):
+		self.downloads = []
+		self.registry = ArchiveRegistry(max_entries=2)
+		when(session).urlopen.then_call(self.download)
+
+	def tearDown(self):
+		self.registry.close()
+
+	def download(self, url, headers=None):
+		self.downloads.append(url)
+		return open(mandy_extracted, 'rb')
+
+	def archive(self, url='http://example.com/mandy.tar.gz', **k):
+		return Archive(url=url, registry=self.registry, **k)
+
+	def test_each_extract_is_computed_from_one_download(self):
+		for _ in range(2):
+			subdir = self.archive(extract='mandy.egg-info')
+			self.assertEqual(subdir.manifests, {'sha1new':'813d2b89d98d8ac693a67297f4834ba13af04120', 'sha256':'4aa6aacde9dfcdd7c1a7c6fa76a7d244250cb17aacd96b674ce79fbdf1444577'})
+		self.assertEqual(len(self.downloads), 1)
+		# a second extract means reading the whole archive, once
+		whole = self.archive()
+		self.assertEqual(whole.manifests, {'sha1new':'887dab86294802388fa1382c268185afff7c47a8', 'sha256':'6f1d3c8ed295c16dc9a4eae37587f5cd38c875aa37489f0db7eef212589505ca'})
+		self.assertEqual(whole.size, 6794)
+		mandy = self.archive(extract='mandy')
+		self.assertEqual(mandy.manifests, Archive(url='http://example.com/mandy.tar.gz', local_file=mandy_extracted, extract='mandy').manifests)
+		self.assertEqual(self.archive(extract='mandy.egg-info').manifests, subdir.manifests)
+		self.assertEqual(self.downloads, ['http://example.com/mandy.tar.gz'] * 2)
+
+	def test_only_the_first_extract_is_scanned(self):
+		self.archive(extract='mandy.egg-info')
+		(entry,) = self.registry._entries.values()
+		self.assertEqual(entry.tree.listdir(), ['mandy.egg-info'])
+
+	def test_concurrent_requests_share_one_download(self):
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(self.archive(extract='mandy.egg-info').manifests['sha256'])) for i in range(4)]
+		for thread in threads: thread.start()
+		for thread in threads: thread.join()
+		self.assertEqual(results, ['4aa6aacde9dfcdd7c1a7c6fa76a7d244250cb17aacd96b674ce79fbdf1444577'] * 4)
+		self.assertEqual(len(self.downloads), 1)
+
+	def test_least_recently_used_archives_are_dropped(self):
+		for name in ('a', 'b', 'c', 'a'):
+			self.archive(url='http://example.com/%s.tar.gz' % (name,))
+		self.assertEqual(self.downloads, ['http://example.com/%s.tar.gz' % (name,) for name in ('a', 'b', 'c', 'a')])
+
+	def test_unpacked_archives_are_shared(self):
+		self.archive(extract='mandy.egg-info', streaming=False)
+		self.assertEqual(self.archive(streaming=False).manifests['sha256'], '6f1d3c8ed295c16dc9a4eae37587f5cd38c875aa37489f0db7eef212589505ca')
+		self.assertEqual(self.archive(extract='mandy.egg-info', streaming=False).manifests['sha256'], '4aa6aacde9dfcdd7c1a7c6fa76a7d244250cb17aacd96b674ce79fbdf1444577')
+		self.archive(extract='mandy', streaming=False)
+		self.assertEqual(len(self.downloads), 2)
@@ -0,0 +1,62 @@
+from mocktest import *
+from zeroinstall_downstream import composite_version
+from zeroinstall_downstream.composite_version import CompositeVersion, VersionIndex
+
+class CompositeVersionTest(TestCase):
+	def test_parsed_versions_are_shared(self):
+		self.assertTrue(composite_version.try_parse('1.2.3') is composite_version.try_parse('1.2.3'))
+		self.assertEqual(composite_version.try_parse('1.2.3'), CompositeVersion('1.2.3'))
+
+	def test_unparseable_versions(self):
+		self.assertEqual(composite_version.try_parse('latest'), None)
+		self.assertRaises(ValueError, lambda: composite_version.parse('latest'))
+
+	def test_ordering(self):
+		versions = [CompositeVersion(v) for v in ('1.10', '1.2', '1.2.0', '0.9')]
+		self.assertEqual([v.upstream for v in sorted(versions)], ['0.9', '1.2', '1.2.0', '1.10'])
+		self.assertEqual(max(versions).upstream, '1.10')
+		self.assertTrue(CompositeVersion('1.2') < CompositeVersion('v1.2'))
+		self.assertNotEqual(CompositeVersion('1.2'), CompositeVersion('v1.2'))
+
+	def test_versions_which_zeroinstall_rejects_are_ordered_by_their_derived_version(self):
+		parse_version = composite_version.parse_version
+		def strict_parse_version(version_string):
+			if version_string == '1.5':
+				raise composite_version.SafeException("Invalid version format in '1.5'")
+			return parse_version(version_string)
+		modify(composite_version).parse_version = strict_parse_version
+		versions = [CompositeVersion(v) for v in ('1.10', '1.5', '1.2')]
+		self.assertEqual(versions[1].sort_key, None)
+		self.assertEqual([v.upstream for v in sorted(versions)], ['1.2', '1.5', '1.10'])
+		self.assertEqual(CompositeVersion('1.5'), versions[1])
+		index = VersionIndex(versions)
+		self.assertTrue(CompositeVersion('1.5') in index)
+		self.assertEqual([v.upstream for v in index.newer_than(CompositeVersion('1.2'))], ['1.5', '1.10'])
+
+	def test_only_versions_can_be_compared(self):
+		self.assertRaises(AssertionError, lambda: CompositeVersion('1.2') < '1.3')
+
+class VersionIndexTest(TestCase):
+	def setUp(self):
+		self.index = VersionIndex([CompositeVersion(v) for v in ('1.10', 'v1.2', '1.2.1', '0.9', '2.0-rc1')])
+
+	def upstream(self, versions):
+		return [v.upstream for v in versions]
+
+	def test_versions_are_sorted(self):
+		self.assertEqual(self.upstream(self.index), ['0.9', 'v1.2', '1.2.1', '1.10', '2.0-rc1'])
+		self.assertEqual(self.index.latest().upstream, '2.0-rc1')
+		self.assertEqual(self.upstream(self.index.latest(2)), ['1.10', '2.0-rc1'])
+		self.assertEqual(VersionIndex([]).latest(), None)
+
+	def test_lookup_by_upstream_or_derived_version(self):
+		self.assertEqual(self.index.find('v1.2').upstream, 'v1.2')
+		self.assertEqual(self.index.find('1.2').upstream, 'v1.2')
+		self.assertEqual(self.index.find('1.3'), None)
+		self.assertTrue(CompositeVersion('1.10') in self.index)
+		self.assertFalse(CompositeVersion('1.11') in self.index)
+
+	def test_range_queries(self):
+		self.assertEqual(self.upstream(self.index.newer_than(CompositeVersion('1.2.1'))), ['1.10', '2.0-rc1'])
+		self.assertEqual(self.upstream(self.index.newer_than(CompositeVersion('1.3'))), ['1.10', '2.0-rc1'])
+		self.assertEqual(self.upstream(self.index.matching('1.')), ['v1.2', '1.2.1', '1.10'])
@@ -7,7 +7,7 @@ from zeroinstall_downstream.feed import Feed
 import zeroinstall_downstream.feed as feed_module
 from zeroinstall_downstream.project import SOURCES
 from zeroinstall_downstream import archive
-from zeroinstall_downstream.composite_version import CompositeVersion
+from zeroinstall_downstream.composite_version import CompositeVersion, VersionIndex
 
 def dumpxml(xml):
 	xml = str(xml)
@@ -31,6 +31,7 @@ class TestFeed(TestCase):
 			upstream_type='upstream_mock',
 			latest_version=CompositeVersion('2.5.1'),
 			versions=[CompositeVersion('0.1'), CompositeVersion('2.5.1')],
+			version_index=VersionIndex([CompositeVersion('0.1'), CompositeVersion('2.5.1')]),
 			summary='the BEST project',
 			description='use it for all your projecty needs!',
 			implementation_for = lambda v: mock('release ' + v.upstream).with_children(
@@ -169,6 +170,69 @@ class TestFeed(TestCase):
 		feed.add_implementation('0.1')
 		self.assertEquals(feed.unpublished_versions(), set([]))
 
+	def test_adds_all_missing_versions_in_order(self):
+		self.write_initial_feed(self.proj)
+		modify(SOURCES)['upstream_mock'] = lambda **kw: self.proj
+
+		feed = Feed.from_file(self.buffer)
+		self.assertEquals(feed.missing_versions(since='2.5.1'), [CompositeVersion('2.5.1')])
+		self.assertEquals(feed.missing_versions(since='1.0'), [CompositeVersion('2.5.1')])
+		missing = feed.missing_versions()
+		self.assertEquals(missing, [CompositeVersion('0.1'), CompositeVersion('2.5.1')])
+		self.assertEquals(feed.add_implementations(list(reversed(missing))), [])
+		self.assertEquals(feed.published_versions, missing)
+		self.assertEquals(feed.missing_versions(), [])
+
+	def test_adding_missing_versions_skips_failures(self):
+		self.write_initial_feed(self.proj)
+		modify(SOURCES)['upstream_mock'] = lambda **kw: self.proj
+		mkarchive = feed_module.Archive
+		def archive(url, **k):
+			if url.endswith('0.1'):
+				raise IOError("not found")
+			return mkarchive(url, **k)
+		modify(feed_module).Archive = archive
+
+		feed = Feed.from_file(self.buffer)
+		failed = feed.add_implementations(feed.missing_versions())
+		self.assertEquals([(version, type(error)) for version, error in failed], [(CompositeVersion('0.1'), IOError)])
+		self.assertEquals(feed.published_versions, [CompositeVersion('2.5.1')])
+
+	def test_adding_missing_versions_looks_them_up_together(self):
+		self.write_initial_feed(self.proj)
+		modify(SOURCES)['upstream_mock'] = lambda **kw: self.proj
+		looked_up = []
+		def implementations_for(versions):
+			looked_up.append(versions)
+			return [self.proj.implementation_for(version) for version in versions]
+		self.proj.with_children(implementations_for=implementations_for)
+
+		feed = Feed.from_file(self.buffer)
+		self.assertEquals(feed.add_implementations(feed.missing_versions()), [])
+		self.assertEquals(looked_up, [[CompositeVersion('0.1'), CompositeVersion('2.5.1')]])
+
+	def test_refuses_to_publish_a_version_twice(self):
+		self.write_initial_feed(self.proj, add_impl = True)
+		modify(SOURCES)['upstream_mock'] = lambda **kw: self.proj
+
+		feed = Feed.from_file(self.buffer)
+		self.assertEquals(feed.published_versions, [CompositeVersion('2.5.1')])
+		feed.add_implementation('0.1')
+		self.assertEquals(feed.published_versions, [CompositeVersion('2.5.1'), CompositeVersion('0.1')])
+		self.assertRaises(AssertionError, lambda: feed.add_implementation('0.1'))
+
+	def test_preserves_comments_and_unknown_elements(self):
+		self.write_initial_feed(self.proj)
+		xml = self.buffer.getvalue().replace('<group/>', '<?hint x?><!-- keep me --><group><requires interface="http://example.com/dep"/></group>')
+		modify(SOURCES)['upstream_mock'] = lambda **kw: self.proj
+		feed = Feed.from_file(StringIO(xml))
+		feed.add_implementation()
+		self.clear_buffer()
+		feed.save(self.buffer)
+
+		saved = self.buffer.getvalue()
+		self.assertTrue('\t<?hint x?>\n\t<!-- keep me -->\n\t<group>\n\t\t<requires interface="http://example.com/dep"/>\n\t\t<implementation ' in saved, saved)
+
 class TestFeedProcessing(TestCase):
 	@ignore
 	def test_constructing_pypi_project_from_feed(self):
@@ -0,0 +1,71 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+from mocktest import *
+
+from zeroinstall_downstream import metrics
+
+class MetricsTest(TestCase):
+	def setUp(self):
+		self.registry = metrics.Registry()
+		self.base = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	def test_counters_are_kept_per_label(self):
+		counter = self.registry.counter('requests_total', 'requests', ['host'])
+		counter.inc(host='a')
+		counter.inc(2, host='a')
+		counter.inc(host='b')
+		self.assertEqual(counter.value(host='a'), 3)
+		self.assertEqual(counter.value(host='c'), 0)
+		self.assertRaises(ValueError, lambda: counter.inc(backend='a'))
+
+	def test_metrics_are_registered_once(self):
+		counter = self.registry.counter('requests_total', 'requests')
+		self.assertTrue(self.registry.counter('requests_total', 'requests') is counter)
+		self.assertRaises(AssertionError, lambda: self.registry.histogram('requests_total', 'requests'))
+
+	def test_prometheus_format(self):
+		self.registry.counter('requests_total', 'HTTP requests', ['host']).inc(host='example.com')
+		latency = self.registry.histogram('request_seconds', 'request latency', buckets=(0.5, 1))
+		latency.observe(0.25)
+		latency.observe(0.5)
+		latency.observe(3)
+		self.assertEqual(self.registry.prometheus().splitlines(), [
+			'# HELP zeroinstall_downstream_request_seconds request latency',
+			'# TYPE zeroinstall_downstream_request_seconds histogram',
+			'zeroinstall_downstream_request_seconds_bucket{le="0.5"} 2',
+			'zeroinstall_downstream_request_seconds_bucket{le="1"} 2',
+			'zeroinstall_downstream_request_seconds_bucket{le="+Inf"} 3',
+			'zeroinstall_downstream_request_seconds_sum 3.75',
+			'zeroinstall_downstream_request_seconds_count 3',
+			'# HELP zeroinstall_downstream_requests_total HTTP requests',
+			'# TYPE zeroinstall_downstream_requests_total counter',
+			'zeroinstall_downstream_requests_total{host="example.com"} 1',
+		])
+
+	def test_json_snapshot(self):
+		self.registry.counter('requests_total', 'HTTP requests', ['host']).inc(host='example.com')
+		path = os.path.join(self.base, 'metrics.json')
+		self.registry.write(path)
+		with open(path) as f:
+			snapshot = json.load(f)
+		self.assertEqual(snapshot['metrics']['requests_total']['values'], [{'labels': {'host': 'example.com'}, 'value': 1}])
+		self.assertEqual(os.listdir(self.base), ['metrics.json'])
+
+	def test_writer_writes_periodically_and_when_closed(self):
+		counter = self.registry.counter('requests_total', 'HTTP requests')
+		path = os.path.join(self.base, 'metrics.prom')
+		writer = metrics.Writer(self.registry, path, interval=0.01)
+		for _ in range(100):
+			if os.path.exists(path): break
+			time.sleep(0.01)
+		self.assertTrue(os.path.exists(path))
+		counter.inc()
+		writer.close()
+		with open(path) as f:
+			self.assertTrue('zeroinstall_downstream_requests_total 1\n' in f.read())
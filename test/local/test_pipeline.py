@@ -0,0 +1,31 @@
+from mocktest import *
+from zeroinstall_downstream import pipeline
+
+class StageTest(TestCase):
+	def test_reads_across_chunks(self):
+		stage = pipeline.Stage(['abc', 'de', '', 'fghij'], depth=1)
+		self.assertEqual(stage.read(4), 'abcd')
+		self.assertEqual(stage.read(2), 'ef')
+		self.assertEqual(list(stage), ['ghij'])
+		self.assertEqual(stage.read(), '')
+
+	def test_errors_are_raised_in_the_reader(self):
+		def chunks():
+			yield 'abc'
+			raise IOError("connection reset")
+		stage = pipeline.Stage(chunks())
+		self.assertEqual(stage.read(3), 'abc')
+		self.assertRaises(IOError, lambda: stage.read(1))
+
+	def test_producer_stops_when_closed(self):
+		produced = []
+		def chunks():
+			for i in range(100):
+				produced.append(i)
+				yield 'x'
+		stage = pipeline.Stage(chunks(), depth=2)
+		stage.read(1)
+		stage.close()
+		stage._thread.join(5)
+		self.assertFalse(stage._thread.is_alive())
+		self.assertTrue(len(produced) < 10, produced)
@@ -1,6 +1,8 @@
 import sys
+import json
 from mocktest import *
 from zeroinstall_downstream.project import guess_project_info
+from zeroinstall_downstream.composite_version import CompositeVersion
 
 class ParsePypiTest(TestCase):
 	def test_parse_pypi(self):
@@ -26,3 +28,157 @@ class ParsePypiTest(TestCase):
 
 	def test_parse_fail(self):
 		self.assertRaises(ValueError, lambda: guess_project_info('http://gfxmonk.net/whatever'))
+
+class GithubTagsTest(TestCase):
+	def setUp(self):
+		from zeroinstall_downstream.project import github, common
+		self.github = github
+		self.requested = []
+		modify(common).response_cache = None
+		when(common.session).get.then_call(self.respond)
+
+	def respond(self, url, **kw):
+		self.requested.append(url)
+		base = 'https://api.github.com/repos/gfxmonk/project/'
+		pages = {
+			base + 'tags': ([{'name': 'v0.1', 'tarball_url': base + 'tarball/v0.1', 'commit': {'url': base + 'commits/1'}}], base + 'tags?page=2'),
+			base + 'tags?page=2': ([{'name': '0.2', 'tarball_url': base + 'tarball/0.2', 'commit': {'url': base + 'commits/2'}}], None),
+			base + 'commits/1': ({'commit': {'author': {'date': '2012-01-01T00:00:00Z'}}}, None),
+			base + 'commits/2': ({'commit': {'author': {'date': '2012-02-02T00:00:00Z'}}}, None),
+		}
+		body, next_page = pages[url]
+		headers = {'link': '<%s>; rel="next"' % (next_page,)} if next_page else {}
+		return mock('response').with_children(ok=True, content=json.dumps(body), headers=headers)
+
+	def test_follows_tag_pages(self):
+		project = self.github.Github('gfxmonk/project')
+		self.assertEqual(sorted([v.upstream for v in project.versions]), ['0.1', '0.2'])
+		self.assertEqual(len(self.requested), 2)
+
+	def test_release_dates_are_fetched_only_for_requested_versions(self):
+		project = self.github.Github('gfxmonk/project')
+		latest = project.latest_version
+		self.assertEqual([impl.released for impl in project.implementations_for([latest])], ['2012-02-02'])
+		self.assertFalse(any(['commits/1' in url for url in self.requested]))
+		self.assertEqual([impl.released for impl in project.implementations_for(sorted(project.versions))], ['2012-01-01', '2012-02-02'])
+
+class PypiReleasesTest(TestCase):
+	def setUp(self):
+		from zeroinstall_downstream.project import pypi, common
+		self.pypi = pypi
+		self.requested = []
+		modify(common).response_cache = None
+		when(common.session).get.then_call(self.respond)
+
+	def respond(self, url, **kw):
+		self.requested.append(url)
+		sdist = lambda version: {
+			'packagetype': 'sdist',
+			'url': 'http://example.com/mandy-%s.tar.gz' % (version,),
+			'upload_time': '2009-06-24T10:00:00'}
+		body = {
+			'info': {'home_page': 'http://example.com/mandy', 'summary': 'mandy', 'description': 'mandy!'},
+			'releases': {
+				'0.1.3': [sdist('0.1.3')],
+				'0.1.4': [{'packagetype': 'bdist_egg', 'url': 'http://example.com/mandy-0.1.4.egg', 'upload_time': '2009-06-25T10:00:00'}, sdist('0.1.4')],
+				'0.2': [],
+				'0.2.1': [dict(sdist('0.2.1'), yanked=True)],
+				'0.3': [{'packagetype': 'bdist_wheel', 'url': 'http://example.com/mandy-0.3-py2-none-any.whl', 'upload_time': '2009-06-26T10:00:00'}],
+			}
+		}
+		return mock('response').with_children(ok=True, content=json.dumps(body), headers={})
+
+	def test_all_releases_come_from_one_request(self):
+		project = self.pypi.Pypi('mandy')
+		self.assertEqual(project.summary, 'mandy')
+		impls = project.implementations_for([CompositeVersion('0.1.3'), CompositeVersion('0.1.4')])
+		self.assertEqual([impl.url for impl in impls], ['http://example.com/mandy-0.1.3.tar.gz', 'http://example.com/mandy-0.1.4.tar.gz'])
+		self.assertEqual([impl.released for impl in impls], ['2009-06-24', '2009-06-24'])
+		self.assertEqual(self.requested, ['http://pypi.python.org/pypi/mandy/json'])
+
+	def test_releases_without_sdist_cannot_be_published(self):
+		project = self.pypi.Pypi('mandy')
+		self.assertRaises(ValueError, lambda: project.implementation_for(CompositeVersion('0.2')))
+
+	def test_only_releases_with_an_sdist_are_listed(self):
+		project = self.pypi.Pypi('mandy')
+		self.assertEqual(sorted([v.upstream for v in project.versions]), ['0.1.3', '0.1.4'])
+		self.assertEqual(project.latest_version, CompositeVersion('0.1.4'))
+
+class NpmVersionsTest(TestCase):
+	def setUp(self):
+		from zeroinstall_downstream.project import npm, common
+		self.npm = npm
+		self.requested = []
+		self.abbreviated_times = False
+		modify(common).response_cache = None
+		when(common.session).urlopen.then_call(self.respond)
+
+	def respond(self, url, headers=None, **kw):
+		from StringIO import StringIO
+		abbreviated = (headers or {}).get('Accept') == self.npm.ABBREVIATED_DOCUMENT
+		self.requested.append((url, abbreviated))
+		versions = {}
+		for version in ('0.1.0', '0.2.0'):
+			versions[version] = {
+				'version': version,
+				'readme': 'a very long readme',
+				'dist': {'tarball': 'http://example.com/coffee-%s.tgz' % (version,), 'shasum': 'abc'}
+			}
+		body = {'name': 'coffee', 'versions': versions}
+		if not abbreviated:
+			body['description'] = 'coffee!'
+		if not abbreviated or self.abbreviated_times:
+			body['time'] = {'0.1.0': '2012-01-01T10:00:00.000Z', '0.2.0': '2012-02-02T10:00:00.000Z'}
+		return StringIO(json.dumps(body))
+
+	def test_versions_come_from_abbreviated_document(self):
+		project = self.npm.Npm('coffee')
+		self.assertEqual(sorted(project.versions), [CompositeVersion('0.1.0'), CompositeVersion('0.2.0')])
+		self.assertEqual(project._version_info['0.1.0'], {'version': '0.1.0', 'dist': {'tarball': 'http://example.com/coffee-0.1.0.tgz'}})
+		self.assertEqual(self.requested, [('http://registry.npmjs.org/coffee', True)])
+
+	def test_release_dates_come_from_abbreviated_document_when_included(self):
+		self.abbreviated_times = True
+		project = self.npm.Npm('coffee')
+		impl = project.implementation_for(CompositeVersion('0.2.0'))
+		self.assertEqual(impl.url, 'http://example.com/coffee-0.2.0.tgz')
+		self.assertEqual(impl.released, '2012-02-02')
+		self.assertEqual(self.requested, [('http://registry.npmjs.org/coffee', True)])
+
+	def test_release_dates_come_from_full_document_otherwise(self):
+		project = self.npm.Npm('coffee')
+		impl = project.implementation_for(CompositeVersion('0.2.0'))
+		self.assertEqual(impl.released, '2012-02-02')
+		self.assertEqual(self.requested, [('http://registry.npmjs.org/coffee', True), ('http://registry.npmjs.org/coffee', False)])
+
+	def test_description_and_release_dates_share_one_full_document(self):
+		project = self.npm.Npm('coffee')
+		self.assertEqual(project.description, 'coffee!')
+		self.assertEqual(self.requested, [('http://registry.npmjs.org/coffee', False)])
+		self.assertEqual(project.implementation_for(CompositeVersion('0.1.0')).released, '2012-01-01')
+		self.assertEqual(self.requested, [('http://registry.npmjs.org/coffee', False), ('http://registry.npmjs.org/coffee', True)])
+
+class CachedPropertyTest(TestCase):
+	def test_concurrent_lookups_compute_the_value_once(self):
+		import time, threading
+		from zeroinstall_downstream.project.common import cached_property
+		calls = []
+		class Project(object):
+			@cached_property
+			def versions(self):
+				calls.append(None)
+				time.sleep(0.05)
+				return ['1.0']
+		project = Project()
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(project.versions)) for i in range(4)]
+		for thread in threads: thread.start()
+		for thread in threads: thread.join()
+		self.assertEqual(results, [['1.0']] * 4)
+		self.assertEqual(len(calls), 1)
+
+class ParallelMapTest(TestCase):
+	def test_at_least_one_job_is_used(self):
+		from zeroinstall_downstream.project.common import parallel_map
+		self.assertEqual(parallel_map(lambda x: x * 2, [1, 2, 3], jobs=0), [2, 4, 6])
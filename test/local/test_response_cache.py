@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+from mocktest import *
+
+from zeroinstall_downstream.response_cache import ResponseCache, session
+
+class ResponseCacheTest(TestCase):
+	def setUp(self):
+		self.base = tempfile.mkdtemp()
+		self.cache = ResponseCache(self.base)
+		self.requests = []
+		self.body = '{"version": "1.0"}'
+		when(session).get.then_call(self.respond)
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	def respond(self, url, params=None, headers=None, **kw):
+		self.requests.append(headers)
+		if headers.get('If-None-Match') == '"abc"':
+			return mock('response').with_children(status_code=304, ok=True, headers={}, close=lambda: None)
+		return mock('response').with_children(status_code=200, ok=True, headers={'etag':'"abc"'},
+			iter_content=lambda size: [self.body], close=lambda: None)
+
+	def test_revalidates_cached_responses(self):
+		self.assertEqual(self.cache.get('http://example.com/project'), (self.body, {'link': None}))
+		self.assertEqual(self.cache.get('http://example.com/project'), (self.body, {'link': None}))
+		self.assertEqual(self.requests, [{}, {'If-None-Match': '"abc"'}])
+
+	def test_uses_fresh_responses_without_a_request(self):
+		self.cache.max_age = 60
+		self.cache.get('http://example.com/project')
+		self.assertEqual(self.cache.get('http://example.com/project'), (self.body, {'link': None}))
+		self.assertEqual(len(self.requests), 1)
+
+	def test_responses_are_keyed_by_params(self):
+		self.cache.get('http://example.com/project', params={'page': 1})
+		self.cache.get('http://example.com/project', params={'page': 2})
+		self.assertEqual(self.requests, [{}, {}])
+
+	def test_evicts_least_recently_used_responses(self):
+		self.cache.max_size = len(self.body) * 2
+		for i in range(3):
+			url = 'http://example.com/project/%s' % (i,)
+			self.cache.get(url)
+			os.utime(self.cache._path(url, None, None), (i, i))
+		self.cache.get('http://example.com/project/0')
+		self.assertEqual(self.requests[-1], {})
+
+	def test_entries_from_before_headers_were_saved_can_be_used(self):
+		from zeroinstall_downstream.response_cache import load_json, save_json
+		self.cache.max_age = 60
+		self.cache.get('http://example.com/project')
+		info_path = self.cache._path('http://example.com/project', None, None) + '.json'
+		info = load_json(info_path)
+		del info['headers']
+		save_json(info_path, info)
+		self.assertEqual(self.cache.get('http://example.com/project'), (self.body, {}))
+
+	def test_streamed_bytes_are_counted_as_they_are_read(self):
+		before = session._bytes.value(host='example.com')
+		self.cache.get('http://example.com/project')
+		self.assertEqual(session._bytes.value(host='example.com') - before, len(self.body))
+		# chunked responses have no content-length
+		raw = mock('raw').with_children(read=lambda size, decode_content: self.body)
+		stream = session.Stream(mock('response').with_children(status_code=200, raw=raw, headers={}), url='http://example.com/project.tar.gz')
+		stream.read(1024)
+		self.assertEqual(session._bytes.value(host='example.com') - before, 2 * len(self.body))
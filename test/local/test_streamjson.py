@@ -0,0 +1,22 @@
+from StringIO import StringIO
+from mocktest import *
+from zeroinstall_downstream.project import streamjson
+
+class Chunked(object):
+	def __init__(self, data, size):
+		self.data = StringIO(data)
+		self.size = size
+
+	def read(self, size=-1):
+		return self.data.read(self.size)
+
+class SelectTest(TestCase):
+	document = '{"name": "x", "skip": [1, {"a": "\\"}"}], "versions": {"1.0": {"n": -25000000000.0, "x": [1, 2]}, "2.0": {"n": true}}}'
+
+	def test_selects_paths_with_wildcards(self):
+		for size in (1, 3, 100000):
+			result = streamjson.select(Chunked(self.document, size), [('name',), ('versions', '*', 'n')])
+			self.assertEqual(result, {'name': 'x', 'versions': {'1.0': {'n': -25000000000.0}, '2.0': {'n': True}}})
+
+	def test_rejects_truncated_documents(self):
+		self.assertRaises(ValueError, lambda: streamjson.select(StringIO(self.document[:-1]), [('name',)]))
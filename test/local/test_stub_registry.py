@@ -0,0 +1,62 @@
+from mocktest import *
+
+from zeroinstall_downstream.project import github, pypi, npm, rubygems, common
+from zeroinstall_downstream.archive import Archive
+from zeroinstall_downstream import archive
+from zeroinstall_downstream.composite_version import CompositeVersion
+from test.stub_registry import StubRegistry
+
+class StubRegistryTest(TestCase):
+	def setUp(self):
+		self.registry = StubRegistry(versions=150).start()
+		url = self.registry.url
+		modify(common).response_cache = None
+		modify(archive).default_cache = None
+		modify(archive).default_registry = None
+		modify(github.Github).base = url + 'github/'
+		modify(pypi.Pypi).base = url + 'pypi/'
+		modify(npm.Npm).base = url + 'npm/'
+		modify(rubygems.Rubygems).base = url + 'rubygems/api/v1/'
+		modify(rubygems.Rubygems).download_base = url + 'rubygems/gems/'
+
+	def tearDown(self):
+		self.registry.stop()
+
+	def assertLatestRelease(self, project, released):
+		self.assertEqual(len(project.versions), 150)
+		self.assertEqual(project.latest_version, CompositeVersion('1.1.49'))
+		release = project.latest_release
+		self.assertEqual(release.released, released)
+		downloaded = Archive(release.url, type=release.archive_type)
+		self.assertEqual(sorted(downloaded.manifests.keys()), ['sha1new', 'sha256'])
+		return downloaded
+
+	def test_github(self):
+		project = github.Github('owner/repo')
+		self.assertEqual(project.summary, 'the owner/repo project')
+		downloaded = self.assertLatestRelease(project, '2010-05-30')
+		self.assertTrue(downloaded.extract.startswith('owner-repo-'))
+		# tags are listed 100 per page
+		self.assertEqual(self.registry.stats['github']['requests'], 5)
+
+	def test_pypi(self):
+		downloaded = self.assertLatestRelease(pypi.Pypi('mandy'), '2010-05-30')
+		self.assertEqual(downloaded.extract, 'mandy-1.1.49')
+
+	def test_npm(self):
+		downloaded = self.assertLatestRelease(npm.Npm('coffee'), '2010-05-30')
+		self.assertEqual(downloaded.extract, 'package')
+
+	def test_rubygems(self):
+		self.assertLatestRelease(rubygems.Rubygems('xargs'), '2010-05-30')
+
+	def test_github_rate_limit(self):
+		self.registry.rate_limit = 1
+		project = github.Github('owner/repo')
+		self.assertEqual(project.summary, 'the owner/repo project')
+		self.assertRaises(AssertionError, lambda: project.versions)
+
+	def test_injected_failures(self):
+		self.registry.failure_rate = 1
+		self.assertRaises(AssertionError, lambda: pypi.Pypi('mandy').versions)
+		self.assertEqual(self.registry.stats['pypi'], {'requests': 1, 'failures': 1, 'bytes': 31})
@@ -0,0 +1,80 @@
+import os
+import json
+from collections import deque
+import tempfile
+from StringIO import StringIO
+from mocktest import *
+
+from zeroinstall_downstream import timing
+
+class TimingTest(TestCase):
+	def setUp(self):
+		modify(timing).enabled = True
+		modify(timing).tracing = True
+		timing.reset()
+
+	def tearDown(self):
+		timing.reset()
+
+	def test_nothing_is_recorded_unless_enabled(self):
+		timing.enabled = False
+		with timing.span('upstream'):
+			pass
+		timing.count('requests', 'example.com')
+		self.assertEqual(timing.summary()['phases'], {})
+		self.assertEqual(timing.summary()['counters'], {})
+
+	def test_spans_are_totalled_by_phase(self):
+		@timing.timed('upstream')
+		def fetch(): pass
+		fetch()
+		fetch()
+		timing.add('download', 1.5)
+		timing.add('download', 0.5)
+		phases = timing.summary()['phases']
+		self.assertEqual(phases['upstream']['calls'], 2)
+		self.assertEqual(phases['download'], {'calls': 2, 'total': 2.0, 'max': 1.5})
+
+	def test_failed_spans_are_recorded(self):
+		def fail():
+			with timing.span('upstream'):
+				raise ValueError()
+		self.assertRaises(ValueError, fail)
+		self.assertEqual(timing.summary()['phases']['upstream']['calls'], 1)
+
+	def test_summary_table(self):
+		timing.add('download', 2)
+		timing.count('requests', 'example.com')
+		timing.count('bytes', 'example.com', 1234)
+		out = StringIO()
+		timing.print_summary(out)
+		lines = out.getvalue().splitlines()
+		self.assertEqual(lines[1].split(), ['download', '1', '2.000s', '2.000s', '2.000s'])
+		self.assertEqual(lines[-1].split(), ['example.com', '1', '1234'])
+
+	def test_json_trace(self):
+		timing.add('download', 2)
+		timing.count('requests', 'example.com')
+		fd, path = tempfile.mkstemp()
+		os.close(fd)
+		try:
+			timing.write_trace(path)
+			with open(path) as f:
+				trace = json.load(f)
+		finally:
+			os.remove(path)
+		self.assertEqual(trace['counters'], {'requests': {'example.com': 1}})
+		self.assertEqual([(event['name'], event['dur']) for event in trace['traceEvents'] if event['ph'] == 'X'], [('download', 2000000)])
+
+	def test_only_the_latest_spans_are_traced(self):
+		modify(timing)._events = deque(maxlen=2)
+		for name in ('connect', 'download', 'manifest'):
+			timing.add(name, 1)
+		self.assertEqual([event[0] for event in timing._events], ['download', 'manifest'])
+		self.assertEqual(timing.summary()['phases']['connect']['calls'], 1)
+
+	def test_spans_are_only_kept_when_tracing(self):
+		timing.tracing = False
+		timing.add('download', 1)
+		self.assertEqual(len(timing._events), 0)
+		self.assertEqual(timing.summary()['phases']['download']['calls'], 1)
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+from mocktest import *
+
+from zeroinstall_downstream import watch
+from zeroinstall_downstream.feed import Feed
+import zeroinstall_downstream.feed as feed_module
+from zeroinstall_downstream.project import SOURCES
+from zeroinstall_downstream.project.common import BaseProject, Implementation, cached_property
+
+DAY = 24 * 60 * 60
+
+class WatchedProject(BaseProject):
+	upstream_type = 'watched'
+	summary = description = 'a watched project'
+	homepage = url = 'http://example.com/watched'
+	# (version, release date) pairs, which tests can add to
+	releases = []
+	fail = False
+
+	@cached_property
+	def version_strings(self):
+		if self.fail:
+			raise IOError("upstream is down")
+		return [version for version, released in self.releases]
+
+	def implementation_for(self, version):
+		released = dict(self.releases)[version.upstream]
+		return Implementation(version=version, url='http://example.com/watched-%s.tgz' % (version.upstream,), released=released)
+
+class ReleaseIntervalTest(TestCase):
+	def test_projects_without_release_history_get_the_default_interval(self):
+		self.assertEqual(watch.release_interval([]), watch.DEFAULT_INTERVAL)
+		self.assertEqual(watch.release_interval(['2012-01-01']), watch.DEFAULT_INTERVAL)
+
+	def test_interval_is_a_fraction_of_the_typical_release_gap(self):
+		weekly = ['2012-01-01', '2012-01-08', '2012-01-15', '2012-03-01']
+		self.assertEqual(watch.release_interval(weekly), 7 * DAY * watch.RELEASE_GAP_FRACTION)
+
+	def test_interval_is_clamped(self):
+		self.assertEqual(watch.release_interval(['2012-01-01', '2012-01-02'], min_interval=DAY), DAY)
+		self.assertEqual(watch.release_interval(['2010-01-01', '2012-01-01'], max_interval=DAY), DAY)
+
+class WatcherTest(TestCase):
+	def setUp(self):
+		SOURCES['watched'] = WatchedProject
+		modify(WatchedProject).releases = [('1.0', '2012-01-01'), ('1.1', '2012-02-01')]
+		modify(WatchedProject).fail = False
+		modify(feed_module).Archive = lambda *a, **k: mock('archive').with_children(
+			size=1234, extract=None, type=None, manifests={'sha256': 'abcd', 'sha1new': 'deff'})
+		self.base = tempfile.mkdtemp()
+		self.path = os.path.join(self.base, 'watched.xml')
+		feed = Feed.from_project(WatchedProject('watched'), 'http://example.com/watched.xml')
+		feed.add_implementation('1.0')
+		feed.add_implementation('1.1')
+		with open(self.path, 'w') as f:
+			feed.save(f)
+		self.now = 1000000
+		self.reports = []
+
+	def tearDown(self):
+		del SOURCES['watched']
+		shutil.rmtree(self.base)
+
+	def watcher(self, **k):
+		return watch.Watcher([self.path], min_interval=60, max_interval=10 * DAY, jitter=0,
+			report=self.reports.append, clock=lambda: self.now, sleep=self.sleep, **k)
+
+	def sleep(self, seconds):
+		self.now += seconds
+
+	def release(self, version, released):
+		WatchedProject.releases = WatchedProject.releases + [(version, released)]
+
+	def test_up_to_date_feeds_are_checked_based_on_their_release_history(self):
+		watcher = self.watcher()
+		report = watcher.check(watcher.feeds[0])
+		self.assertEqual(report['status'], 'ok')
+		self.assertEqual(watcher.feeds[0].interval, 31 * DAY * watch.RELEASE_GAP_FRACTION)
+
+	def test_new_versions_are_checked_again_soon(self):
+		watcher = self.watcher()
+		watched = watcher.feeds[0]
+		watcher.check(watched)
+		self.release('1.2', '2012-03-01')
+		report = watcher.check(watched)
+		self.assertEqual((report['status'], report['missing']), ('outdated', ['1.2']))
+		self.assertEqual(watched.interval, 60)
+		# it's still outdated, but there's nothing new to look for
+		report = watcher.check(watched)
+		self.assertEqual(report['status'], 'outdated')
+		self.assertTrue(watched.interval > 60)
+
+	def test_new_versions_are_added_when_updating(self):
+		watcher = self.watcher(update=True)
+		self.release('1.2', '2012-03-01')
+		report = watcher.check(watcher.feeds[0])
+		self.assertEqual((report['status'], report['missing']), ('updated', ['1.2']))
+		with open(self.path) as f:
+			self.assertEqual([v.upstream for v in Feed.from_file(f).published_versions], ['1.0', '1.1', '1.2'])
+		self.assertEqual(watcher.check(watcher.feeds[0])['status'], 'ok')
+
+	def test_failures_back_off(self):
+		watcher = self.watcher()
+		watched = watcher.feeds[0]
+		WatchedProject.fail = True
+		intervals = []
+		for _ in range(3):
+			self.assertEqual(watcher.check(watched)['status'], 'error')
+			intervals.append(watched.interval)
+		self.assertEqual(intervals, [60, 120, 240])
+		WatchedProject.fail = False
+		self.assertEqual(watcher.check(watched)['status'], 'ok')
+		self.assertEqual(watched.failures, 0)
+
+	def test_project_info_is_refetched_for_each_check(self):
+		watcher = self.watcher()
+		watched = watcher.feeds[0]
+		watcher.check(watched)
+		feed = watched.feed
+		self.release('1.2', '2012-03-01')
+		# the feed stays loaded, but its project is refreshed
+		self.assertEqual(watcher.check(watched)['missing'], ['1.2'])
+		self.assertTrue(watched.feed is feed)
+
+	def test_feeds_are_checked_when_due(self):
+		watcher = self.watcher()
+		watcher.run(iterations=2)
+		self.assertEqual(len(self.reports), 2)
+		self.assertEqual(self.now, 1000000 + 31 * DAY * watch.RELEASE_GAP_FRACTION)
@@ -0,0 +1,36 @@
+from StringIO import StringIO
+from mocktest import *
+from zeroinstall_downstream import xmlformat, document
+
+def formatted(xml):
+	out = StringIO()
+	xmlformat.write(document.parse(StringIO(xml)), out)
+	return out.getvalue()
+
+class XmlFormatTest(TestCase):
+	def test_indents_elements_and_sorts_attributes(self):
+		self.assertEqual(formatted(
+			'<?xml-stylesheet type="text/xsl" href="interface.xsl"?>'
+			'<interface uri="http://example.com/" xmlns:b="urn:b" xmlns="urn:a">  <name>x &amp; y</name>\n'
+			'<!-- note --><group><implementation version="1" id="a"><archive href="/a?x=&quot;"></archive></implementation></group></interface>'),
+			'<?xml version="1.0"?>\n'
+			'<?xml-stylesheet type="text/xsl" href="interface.xsl"?>\n'
+			'<interface xmlns="urn:a" xmlns:b="urn:b" uri="http://example.com/">\n'
+			'\t<name>x &amp; y</name>\n'
+			'\t<!-- note -->\n'
+			'\t<group>\n'
+			'\t\t<implementation id="a" version="1">\n'
+			'\t\t\t<archive href="/a?x=&quot;"/>\n'
+			'\t\t</implementation>\n'
+			'\t</group>\n'
+			'</interface>\n')
+
+	def test_writes_utf8(self):
+		self.assertEqual(formatted('<summary>caf\xc3\xa9</summary>'), '<?xml version="1.0"?>\n<summary>caf\xc3\xa9</summary>\n')
+
+	def test_finds_elements_by_namespace(self):
+		doc = document.parse(StringIO(
+			'<interface xmlns="urn:a" xmlns:x="urn:b"><x:upstream id="1"/><upstream id="2"/>'
+			'<group xmlns="urn:b"><upstream id="3"/></group></interface>'))
+		self.assertEqual([elem.get('id') for elem in doc.iter('urn:b', 'upstream')], ['1', '3'])
+		self.assertEqual([elem.get('id') for elem in doc.iter('urn:a', 'upstream')], ['2'])
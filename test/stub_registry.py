@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+'''A local stand-in for the upstream registries, for testing (and load
+testing) backends without touching the network.
+
+It speaks enough of each API for every backend to list versions, look up
+release details and download archives:
+
+ - github: repo info, paginated tags (with rate-limit headers), commits, tarballs
+ - pypi: the JSON API, the XML-RPC API and sdist downloads
+ - npm: full and abbreviated package documents, tarballs
+ - rubygems: the gems / versions JSON APIs and .gem downloads
+
+Every project exists, with `versions` synthetic releases. Responses can be
+slowed down (`latency`, `bandwidth`) and made to fail at random
+(`failure_rate`), and each backend's requests and bytes are counted.
+
+To run it standalone and point 0downstream at it:
+
+	python -m test.stub_registry --port=8123 --latency=0.05
+	0downstream $(python -m test.stub_registry --port=8123 --print-args) update feed.xml
+'''
+import re
+import sys
+import json
+import time
+import random
+import tarfile
+import hashlib
+import argparse
+import datetime
+import threading
+import xmlrpclib
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from gzip import GzipFile
+from StringIO import StringIO
+
+DEFAULT_VERSIONS = 20
+DEFAULT_FILES = 5
+DEFAULT_FILE_SIZE = 1024
+DEFAULT_RATE_LIMIT = 5000
+RATE_LIMIT_WINDOW = 3600
+MAX_PER_PAGE = 100
+ABBREVIATED_DOCUMENT = 'application/vnd.npm.install-v1+json'
+_EPOCH = datetime.date(2010, 1, 1)
+
+class StubError(Exception):
+	def __init__(self, status, message, headers=None):
+		super(StubError, self).__init__(message)
+		self.status = status
+		self.headers = headers or {}
+
+def version_string(i):
+	return '%s.%s.%s' % (i // 10000 + 1, (i // 100) % 100, i % 100)
+
+def release_date(i):
+	return (_EPOCH + datetime.timedelta(days=i)).isoformat()
+
+def _tar(members, compress=True):
+	'''Returns the bytes of a tarball containing `members`
+	(a list of (name, content) pairs)'''
+	buf = StringIO()
+	fileobj = GzipFile(fileobj=buf, mode='wb', mtime=0) if compress else buf
+	with tarfile.open(fileobj=fileobj, mode='w') as tar:
+		for name, content in members:
+			info = tarfile.TarInfo(name)
+			info.size = len(content)
+			info.mtime = 0
+			tar.addfile(info, StringIO(content))
+	if compress:
+		fileobj.close()
+	return buf.getvalue()
+
+def base_urls(root):
+	'''Returns the overrides (for project.set_base_url) which point
+	every backend at a stub registry served from `root`'''
+	return [
+		'github=%sgithub/' % (root,),
+		'pypi=%spypi/' % (root,),
+		'npm=%snpm/' % (root,),
+		'rubygems=%srubygems/api/v1/' % (root,),
+		'rubygems.download_base=%srubygems/gems/' % (root,),
+	]
+
+class StubRegistry(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, port=0, host='127.0.0.1', versions=DEFAULT_VERSIONS,
+			latency=0, jitter=0, bandwidth=None, failure_rate=0, failure_status=503,
+			rate_limit=DEFAULT_RATE_LIMIT, files=DEFAULT_FILES, file_size=DEFAULT_FILE_SIZE, seed=None):
+		BaseHTTPServer.HTTPServer.__init__(self, (host, port), _Handler)
+		self.versions = versions
+		self.latency = latency
+		self.jitter = jitter
+		self.bandwidth = bandwidth
+		self.failure_rate = failure_rate
+		self.failure_status = failure_status
+		self.rate_limit = rate_limit
+		self.files = files
+		self.file_size = file_size
+		self.random = random.Random(seed)
+		self.stats = {}
+		self._lock = threading.Lock()
+		self._rate_used = 0
+		self._rate_reset = int(time.time()) + RATE_LIMIT_WINDOW
+		self._archives = {}
+		self._thread = None
+
+	@property
+	def url(self):
+		host, port = self.server_address
+		return 'http://%s:%s/' % (host, port)
+
+	def base_urls(self):
+		return base_urls(self.url)
+
+	def start(self):
+		'''Serve requests in a background thread (until `stop` is called)'''
+		self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, name='stub-registry')
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *a):
+		self.stop()
+
+	def count(self, backend, key, amount=1):
+		with self._lock:
+			counts = self.stats.setdefault(backend, {'requests': 0, 'bytes': 0, 'failures': 0})
+			counts[key] += amount
+
+	def take_rate_limit(self):
+		'''Returns the github rate-limit headers for a request,
+		raising StubError if the limit has been used up'''
+		with self._lock:
+			now = int(time.time())
+			if now >= self._rate_reset:
+				self._rate_used = 0
+				self._rate_reset = now + RATE_LIMIT_WINDOW
+			allowed = self.rate_limit is None or self._rate_used < self.rate_limit
+			if allowed:
+				self._rate_used += 1
+			headers = {
+				'X-RateLimit-Limit': str(self.rate_limit),
+				'X-RateLimit-Remaining': str(max(0, (self.rate_limit or 0) - self._rate_used)),
+				'X-RateLimit-Reset': str(self._rate_reset),
+			}
+		if not allowed:
+			raise StubError(403, 'API rate limit exceeded', headers)
+		return headers
+
+	def archive(self, kind, name, version):
+		'''Returns the (cached) archive bytes for a release'''
+		key = (kind, name, version)
+		with self._lock:
+			data = self._archives.get(key)
+		if data is None:
+			data = self._build_archive(kind, name, version)
+			with self._lock:
+				if len(self._archives) > 100:
+					self._archives.clear()
+				self._archives[key] = data
+		return data
+
+	def _build_archive(self, kind, name, version):
+		short_name = name.rsplit('/', 1)[-1]
+		if kind == 'github':
+			top = '%s-%s' % (name.replace('/', '-'), hashlib.sha1(name + version).hexdigest()[:7])
+		elif kind == 'npm':
+			top = 'package'
+		else:
+			top = '%s-%s' % (short_name, version)
+		content = lambda i: (('%s %s file %d\n' % (name, version, i)) * (self.file_size // 20 + 1))[:self.file_size]
+		members = [('%s/file%d.txt' % (top, i), content(i)) for i in range(self.files)]
+		if kind == 'rubygems':
+			metadata = StringIO()
+			with GzipFile(fileobj=metadata, mode='wb', mtime=0) as gz:
+				gz.write('--- !ruby/object:Gem::Specification\nname: %s\nversion: %s\n' % (name, version))
+			members = [('lib/' + member_name.split('/', 1)[1], data) for member_name, data in members]
+			return _tar([('metadata.gz', metadata.getvalue()), ('data.tar.gz', _tar(members))], compress=False)
+		return _tar(members)
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	routes = []
+
+	def log_message(self, *a):
+		pass
+
+	def do_GET(self):
+		self._handle('GET')
+
+	def do_POST(self):
+		self._handle('POST')
+
+	def _handle(self, method):
+		server = self.server
+		parsed = urlparse.urlparse(self.path)
+		self.query = dict(urlparse.parse_qsl(parsed.query))
+		# (always consume the request body, so the connection can be reused)
+		self.body = self.rfile.read(int(self.headers.getheader('content-length') or 0))
+		backend = parsed.path.strip('/').split('/', 1)[0]
+		server.count(backend, 'requests')
+		delay = server.latency + (server.random.uniform(0, server.jitter) if server.jitter else 0)
+		if delay:
+			time.sleep(delay)
+		try:
+			if server.failure_rate and server.random.random() < server.failure_rate:
+				raise StubError(server.failure_status, 'injected failure')
+			for route_method, pattern, handler in self.routes:
+				match = pattern.match(parsed.path)
+				if route_method == method and match:
+					break
+			else:
+				raise StubError(404, 'not found')
+			body, headers = handler(self, *match.groups())
+		except StubError as e:
+			server.count(backend, 'failures')
+			body, headers = json.dumps({'message': str(e)}), dict(e.headers)
+			status = e.status
+		else:
+			status = 200
+		if not isinstance(body, str):
+			body = json.dumps(body)
+			headers.setdefault('Content-Type', 'application/json')
+		self.send_response(status)
+		headers.setdefault('Content-Type', 'application/octet-stream')
+		headers['Content-Length'] = str(len(body))
+		for key, value in sorted(headers.items()):
+			self.send_header(key, value)
+		self.end_headers()
+		self._write(body)
+		server.count(backend, 'bytes', len(body))
+
+	def _write(self, body):
+		bandwidth = self.server.bandwidth
+		if not bandwidth:
+			self.wfile.write(body)
+			return
+		chunk_size = max(1, bandwidth // 10)
+		for start in range(0, len(body), chunk_size):
+			self.wfile.write(body[start:start + chunk_size])
+			time.sleep(0.1)
+
+	def _link(self, page, rel):
+		query = dict(self.query, page=str(page))
+		return '<%s%s?%s>; rel="%s"' % (self.server.url.rstrip('/'), urlparse.urlparse(self.path).path, '&'.join('%s=%s' % item for item in sorted(query.items())), rel)
+
+	def _versions(self):
+		return [version_string(i) for i in range(self.server.versions)]
+
+	# github
+
+	def github_repo(self, repo):
+		headers = self.server.take_rate_limit()
+		return {
+			'full_name': repo,
+			'html_url': 'https://github.com/' + repo,
+			'description': 'the %s project' % (repo,),
+		}, headers
+
+	def github_tags(self, repo):
+		headers = self.server.take_rate_limit()
+		per_page = min(int(self.query.get('per_page', 30)), MAX_PER_PAGE)
+		page = int(self.query.get('page', 1))
+		tags = list(reversed(self._versions()))
+		pages = max(1, (len(tags) + per_page - 1) // per_page)
+		base = '%sgithub/repos/%s/' % (self.server.url, repo)
+		body = [{
+			'name': 'v' + version,
+			'tarball_url': base + 'tarball/v' + version,
+			'commit': {
+				'sha': hashlib.sha1(repo + version).hexdigest(),
+				'url': base + 'commits/' + hashlib.sha1(repo + version).hexdigest(),
+			},
+		} for version in tags[(page - 1) * per_page:page * per_page]]
+		links = []
+		if page < pages:
+			links.append(self._link(page + 1, 'next'))
+			links.append(self._link(pages, 'last'))
+		if links:
+			headers['Link'] = ', '.join(links)
+		return body, headers
+
+	def github_commit(self, repo, sha):
+		headers = self.server.take_rate_limit()
+		for i, version in enumerate(self._versions()):
+			if hashlib.sha1(repo + version).hexdigest() == sha:
+				date = release_date(i) + 'T12:00:00Z'
+				return {'sha': sha, 'commit': {'author': {'date': date}, 'committer': {'date': date}}}, headers
+		raise StubError(404, 'no such commit', headers)
+
+	def github_tarball(self, repo, tag):
+		return self.server.archive('github', repo, tag.lstrip('v')), {'Content-Type': 'application/x-gzip'}
+
+	# pypi
+
+	def _pypi_releases(self, name):
+		return dict((version, [{
+			'packagetype': 'sdist',
+			'filename': '%s-%s.tar.gz' % (name, version),
+			'url': '%spypi/packages/%s-%s.tar.gz' % (self.server.url, name, version),
+			'upload_time': release_date(i) + 'T12:00:00',
+		}]) for i, version in enumerate(self._versions()))
+
+	def _pypi_info(self, name):
+		return {
+			'name': name,
+			'version': self._versions()[-1],
+			'home_page': 'http://example.com/' + name,
+			'summary': 'the %s package' % (name,),
+			'description': 'the %s package, for testing' % (name,),
+		}
+
+	def pypi_json(self, name):
+		return {'info': self._pypi_info(name), 'releases': self._pypi_releases(name)}, {}
+
+	def pypi_xmlrpc(self):
+		params, method = xmlrpclib.loads(self.body)
+		name = params[0]
+		if method == 'package_releases':
+			result = list(reversed(self._versions()))
+		elif method == 'release_urls':
+			result = self._pypi_releases(name).get(params[1], [])
+		elif method == 'release_data':
+			result = self._pypi_info(name)
+		else:
+			return xmlrpclib.dumps(xmlrpclib.Fault(1, 'no such method: %s' % (method,))), {'Content-Type': 'text/xml'}
+		return xmlrpclib.dumps((result,), methodresponse=True, allow_none=True), {'Content-Type': 'text/xml'}
+
+	def pypi_download(self, name, version):
+		return self.server.archive('pypi', name, version), {'Content-Type': 'application/x-gzip'}
+
+	# npm
+
+	def npm_document(self, name):
+		versions = dict((version, {
+			'name': name,
+			'version': version,
+			'dist': {
+				'tarball': '%snpm/%s/-/%s-%s.tgz' % (self.server.url, name, name, version),
+				'shasum': hashlib.sha1(name + version).hexdigest(),
+			},
+		}) for version in self._versions())
+		if ABBREVIATED_DOCUMENT in (self.headers.getheader('accept') or ''):
+			return {'name': name, 'versions': versions}, {'Content-Type': ABBREVIATED_DOCUMENT}
+		for info in versions.values():
+			info['readme'] = 'the %s package' % (name,)
+		times = dict((version, release_date(i) + 'T12:00:00.000Z') for i, version in enumerate(self._versions()))
+		return {
+			'name': name,
+			'description': 'the %s package' % (name,),
+			'time': times,
+			'versions': versions,
+		}, {}
+
+	def npm_tarball(self, name, filename):
+		version = filename[len(name) + 1:-len('.tgz')]
+		return self.server.archive('npm', name, version), {'Content-Type': 'application/octet-stream'}
+
+	# rubygems
+
+	def rubygems_gem(self, name):
+		return {
+			'name': name,
+			'info': 'the %s gem' % (name,),
+			'project_uri': 'http://rubygems.org/gems/' + name,
+			'version': self._versions()[-1],
+		}, {}
+
+	def rubygems_versions(self, name):
+		return [{
+			'number': version,
+			'built_at': release_date(i) + 'T00:00:00Z',
+		} for i, version in reversed(list(enumerate(self._versions())))], {}
+
+	def rubygems_download(self, filename):
+		name, version = filename.rsplit('-', 1)
+		return self.server.archive('rubygems', name, version), {'Content-Type': 'application/octet-stream'}
+
+_Handler.routes = [(method, re.compile('^' + pattern + '$'), handler) for method, pattern, handler in [
+	('GET', '/github/repos/([^/]+/[^/]+)', _Handler.github_repo),
+	('GET', '/github/repos/([^/]+/[^/]+)/tags', _Handler.github_tags),
+	('GET', '/github/repos/([^/]+/[^/]+)/commits/([0-9a-f]+)', _Handler.github_commit),
+	('GET', '/github/repos/([^/]+/[^/]+)/tarball/([^/]+)', _Handler.github_tarball),
+	('GET', '/pypi/([^/]+)/json', _Handler.pypi_json),
+	('POST', '/pypi/?', _Handler.pypi_xmlrpc),
+	('GET', '/pypi/packages/(.+)-([^-]+)\\.tar\\.gz', _Handler.pypi_download),
+	('GET', '/npm/([^/]+)', _Handler.npm_document),
+	('GET', '/npm/([^/]+)/-/([^/]+\\.tgz)', _Handler.npm_tarball),
+	('GET', '/rubygems/api/v1/gems/([^/]+)\\.json', _Handler.rubygems_gem),
+	('GET', '/rubygems/api/v1/versions/([^/]+)\\.json', _Handler.rubygems_versions),
+	('GET', '/rubygems/gems/([^/]+)\\.gem', _Handler.rubygems_download),
+]]
+
+def main():
+	parser = argparse.ArgumentParser(description='serve stand-in upstream registries for testing')
+	parser.add_argument('--port', type=int, default=8123)
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--versions', type=int, default=DEFAULT_VERSIONS, help='number of releases of every project (default %(default)s)')
+	parser.add_argument('--latency', type=float, default=0, help='seconds to wait before each response')
+	parser.add_argument('--jitter', type=float, default=0, help='up to this many extra (random) seconds of latency')
+	parser.add_argument('--bandwidth', type=int, help='limit each response to this many bytes per second')
+	parser.add_argument('--failure-rate', type=float, default=0, help='proportion of requests which fail (0-1)')
+	parser.add_argument('--failure-status', type=int, default=503, help='HTTP status of injected failures (default %(default)s)')
+	parser.add_argument('--rate-limit', type=int, default=DEFAULT_RATE_LIMIT, help='github API requests allowed per hour (default %(default)s)')
+	parser.add_argument('--files', type=int, default=DEFAULT_FILES, help='number of files in each archive (default %(default)s)')
+	parser.add_argument('--file-size', type=int, default=DEFAULT_FILE_SIZE, help='size of each archived file, in bytes (default %(default)s)')
+	parser.add_argument('--seed', type=int, help='random seed (for reproducible latency and failures)')
+	parser.add_argument('--print-args', action='store_true', help='just print the 0downstream arguments which use this server')
+	opts = parser.parse_args()
+
+	kw = dict(vars(opts))
+	if kw.pop('print_args'):
+		print ' '.join('--upstream-base=' + spec for spec in base_urls('http://%s:%s/' % (opts.host, opts.port)))
+		return
+	server = StubRegistry(**kw)
+	print >> sys.stderr, "serving stub registries on %s" % (server.url,)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		print >> sys.stderr, json.dumps(server.stats, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+	sys.exit(main())
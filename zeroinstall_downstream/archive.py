@@ -1,82 +1,658 @@
 import tempfile
 import shutil
 import os
-import urllib2
+import stat
 
 from zeroinstall.zerostore import manifest, unpack
+from . import session, pipeline, timing, metrics
 import contextlib
+import hashlib
+import tarfile
+import zipfile
+import zlib
+import bz2
+import itertools
+import mmap
+import time
+import threading
+import multiprocessing
 
 import logging
 log = logging.getLogger(__name__)
 
+DEFAULT_ALGORITHMS = ('sha1new', 'sha256')
+CHUNK_SIZE = 64 * 1024
+# the size of each read from the network (or disk) when scanning an archive
+READ_SIZE = 256 * 1024
+# files larger than this are mmap()ed for hashing, rather than read in chunks
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
+TAR_TYPES = set([
+	'application/x-tar',
+	'application/x-compressed-tar',
+	'application/x-bzip-compressed-tar',
+])
+GEM_TYPE = 'application/x-ruby-gem'
+ZIP_TYPE = 'application/zip'
+
+# an archive_cache.ArchiveCache, used by every Archive which isn't given its own
+default_cache = None
+# the number of processes used to hash extracted files (see `_walk_tree`)
+default_hash_jobs = None
+# an archive_registry.ArchiveRegistry, used by every Archive which isn't given its own
+default_registry = None
+
+_cache_requests = metrics.counter('archive_cache_requests_total', 'Archives looked up in the archive cache, by result (hit: manifests reused, archive: download reused, miss)', ['result'])
+_archive_seconds = metrics.histogram('archive_seconds', 'Time taken to compute the manifests of an archive which wasn\'t cached (including fetching and unpacking it)')
+_manifest_bytes = metrics.counter('manifest_bytes_total', 'Bytes of file contents covered by computed manifests')
+
 class Archive(object):
-	def __init__(self, url, type=None, extract=None, local_file=None):
+	def __init__(self, url, type=None, extract=None, local_file=None, algorithms=DEFAULT_ALGORITHMS, streaming=None, cache=None, hash_jobs=None, registry=None):
 		self.url = url
-		base = tempfile.mkdtemp()
+		self.type = type
+		filename = url.rsplit('/', 1)[1]
+		assert filename or local_file
+		algs = _get_algorithms(algorithms)
+		if streaming is None:
+			streaming = can_stream(url, type)
+		if hash_jobs is None:
+			hash_jobs = default_hash_jobs
+
+		if cache is None:
+			cache = default_cache
+		if registry is None:
+			registry = default_registry
+		cache_entry = None
+		if cache is not None and local_file is None:
+			cache_entry = cache.lookup(url)
+			if cache_entry is not None:
+				result = cache_entry.result(extract, algorithms)
+				if result is not None:
+					log.info("using cached manifests for %s" % (url,))
+					_cache_requests.inc(result='hit')
+					_print_toplevel(result['toplevel'])
+					self.extract = result['extract']
+					self.manifests = dict([(algname, result['manifests'][algname]) for algname in algorithms])
+					self.size = cache_entry.size
+					return
+				_cache_requests.inc(result='archive')
+			else:
+				_cache_requests.inc(result='miss')
+				if not streaming:
+					cache_entry = cache.fetch(url)
+			if cache_entry is not None:
+				local_file = cache_entry.path
+
+		start = time.time()
+
+		# when the archive isn't cached yet, it's saved to the cache as it's scanned
+		download_cache = cache if local_file is None else None
+		if registry is not None:
+			with registry.contents(url, _hash_names(algs), extract=extract, type=type, local_file=local_file,
+					streaming=streaming, cache=download_cache, hash_jobs=hash_jobs) as contents:
+				tree, self.size, downloaded = contents
+				cache_entry = cache_entry or downloaded
+				toplevel = self._process(tree, extract, algs)
+		elif streaming:
+			tree, self.size, downloaded = scan(url, type=type, local_file=local_file, hash_names=_hash_names(algs), cache=download_cache, extract=extract)
+			cache_entry = cache_entry or downloaded
+			toplevel = self._process(tree, extract, algs)
+		else:
+			base = tempfile.mkdtemp()
+			try:
+				tree, self.size, unpack_extract = unpack_tree(url, base, type=type, local_file=local_file, extract=extract, hash_jobs=hash_jobs)
+				toplevel = self._process(tree, unpack_extract, algs)
+			finally:
+				if log.isEnabledFor(logging.DEBUG):
+					log.debug("debug mode enabled - NOT cleaning up directory: %s" % (base,))
+				else:
+					shutil.rmtree(base)
+
+		_archive_seconds.observe(time.time() - start)
+
+		if cache_entry is not None:
+			cache_entry.save_result(extract, {
+				'extract': self.extract,
+				'toplevel': toplevel,
+				'manifests': self.manifests,
+			})
+
+	def _process(self, tree, extract, algs):
+		if extract is None:
+			files_extracted = tree.listdir()
+			log.debug("found %s files in archive" % len(files_extracted))
+			if len(files_extracted) == 1:
+				extract = files_extracted[0]
+		if extract is False:
+			extract = None
+		log.debug("extract = %s" % (extract,))
+		if extract is not None:
+			tree = tree.subtree(extract)
+
+		toplevel = sorted(tree.listdir())
+		_print_toplevel(toplevel)
+
+		self.extract = extract
+		with timing.span('manifest'):
+			self.manifests = _digest_entries(_counting_bytes(tree.walk(_hash_names(algs))), algs)
+		log.debug("manifests = %r" % (self.manifests,))
+		return toplevel
+
+def _counting_bytes(entries):
+	size = 0
+	for entry in entries:
+		type, hashes, rest = entry
+		if type in ('F', 'X'):
+			# `rest` is "mtime size [name]"
+			size += int(rest.split(' ', 2)[1])
+		yield entry
+	_manifest_bytes.inc(size)
+
+def _print_toplevel(contents):
+	sep = "\n  "
+	print "NOTE: Toplevel contents of archive are:" + sep + sep.join(contents)
+
+def can_stream(url, type=None):
+	"""Returns whether the archive can be scanned directly from
+	its (decompressed) stream, without extracting it to disk."""
+	if type is None:
+		type = unpack.type_from_url(url)
+	return type in TAR_TYPES or type == GEM_TYPE
+
+@timing.timed('scan')
+def scan(url, hash_names, type=None, local_file=None, cache=None, extract=None):
+	"""Read an archive as a stream, hashing each member as it passes.
+	If `extract` is given, members outside that directory are skipped
+	(unless something inside it is a hard link to one of them, in which
+	case the whole archive is read again).
+
+	Reading, decompressing and hashing run concurrently, as a pipeline.
+	If `cache` (an archive_cache.ArchiveCache) is given, the downloaded
+	file is saved into it along the way.
+
+	Returns a (tree, size, cache_entry) tuple, where `tree` holds the manifest
+	entries for every member of the archive. `cache_entry` is None unless
+	the archive was saved to `cache`."""
+	try:
+		return _scan(url, hash_names, type, local_file, cache, extract)
+	except _LinkOutsideExtract as e:
+		log.info("%s - scanning the whole archive" % (e,))
+		return _scan(url, hash_names, type, local_file, cache, None)
+
+def _scan(url, hash_names, type, local_file, cache, extract):
+	if type is None:
+		type = unpack.type_from_url(url)
+	download = None
+	if local_file is None:
+		log.info("streaming %s" % (url,))
+		with timing.span('connect'):
+			source = session.urlopen(url)
+		if cache is not None:
+			download = cache.download(url, source.info())
+	else:
+		source = open(local_file, 'rb')
+	stages = []
+	try:
+		with contextlib.closing(source):
+			counter = _CountingStream(source)
+			raw = pipeline.Stage(_read_chunks(counter, download), name='read %s' % (url,))
+			stages.append(raw)
+			tree = _MemoryTree()
+			only = _member_path(extract) if extract else None
+			if type == GEM_TYPE:
+				stream = raw
+				_scan_gem(stream, tree, hash_names, only)
+			else:
+				stream = pipeline.Stage(_decompress(raw), name='decompress %s' % (url,))
+				stages.append(stream)
+				_scan_tar(tarfile.open(fileobj=stream, mode='r|'), tree, hash_names, only)
+			# consume any trailing padding, so that `size` covers the whole file
+			for _ in stream: pass
+	except:
+		# stop reading before the partial download is thrown away
+		for stage in stages:
+			stage.close()
+		if download is not None:
+			download.abort()
+		raise
+	finally:
+		for stage in stages:
+			stage.close()
+	cache_entry = None
+	if download is not None:
+		cache_entry = download.commit()
+	return tree, counter.size, cache_entry
+
+def _read_chunks(stream, download=None):
+	waited = 0
+	try:
+		while True:
+			start = time.time()
+			chunk = stream.read(READ_SIZE)
+			waited += time.time() - start
+			if not chunk: break
+			if download is not None:
+				download.write(chunk)
+			yield chunk
+	finally:
+		timing.add('download', waited)
+
+def _decompress(chunks):
+	"""Decompress a stream of chunks, if it's gzip or bzip2-compressed
+	(based on its first few bytes)"""
+	chunks = iter(chunks)
+	head = ''
+	for chunk in chunks:
+		head += chunk
+		if len(head) >= 3: break
+	if head.startswith('\x1f\x8b'):
+		decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+	elif head.startswith('BZh'):
+		decompressor = bz2.BZ2Decompressor()
+	else:
+		decompressor = None
+	finished = False
+	busy = 0
+	for chunk in itertools.chain([head], chunks):
+		if decompressor is None:
+			yield chunk
+			continue
+		if finished:
+			# keep consuming any trailing data, so that it's counted
+			continue
+		start = time.time()
 		try:
-			filename = url.rsplit('/', 1)[1]
-			assert filename or local_file
-			dest='root'
-			fetch(url, base=base, filename=filename, dest=dest, type=type, local_file=local_file)
-			if extract is None:
-				files_extracted = os.listdir(os.path.join(base, dest))
-				log.debug("found %s files in archive" % len(files_extracted))
-				if len(files_extracted) == 1 and extract is None:
-					extract = files_extracted[0]
-			if extract is False:
-				extract = None
-			log.debug("extract = %s" % (extract,))
-
-			def list_toplevel():
-				toplevel_path = os.path.join(base, dest)
-				if extract is not None:
-					toplevel_path = os.path.join(toplevel_path, extract)
-				contents = os.listdir(toplevel_path)
-				sep = "\n  "
-				print "NOTE: Toplevel contents of archive are:" + sep + sep.join(sorted(contents))
-			list_toplevel()
-
-			self.extract = extract
-			self.manifests = {}
-			self.manifests['sha1new'] = get_manifest(os.path.join(base, dest), extract=extract, algname='sha1new')
-			log.debug("sha1new manifest = %s" % (self.manifests['sha1new'],))
-			self.manifests['sha256']  = get_manifest(os.path.join(base, dest), extract=extract, algname='sha256')
-			log.debug("sha256 manifest = %s" % (self.manifests['sha256'],))
-			self.type = type
-			if local_file is None:
-				local_file = os.path.join(base, filename)
-			self.size = os.stat(local_file).st_size
+			output = decompressor.decompress(chunk)
+		except EOFError:
+			# (bz2 complains about data after the end of the stream)
+			finished = True
+			continue
 		finally:
-			if log.isEnabledFor(logging.DEBUG):
-				log.debug("debug mode enabled - NOT cleaning up directory: %s" % (base,))
+			busy += time.time() - start
+		if output:
+			yield output
+	if decompressor is not None:
+		timing.add('decompress', busy)
+	if hasattr(decompressor, 'flush'):
+		yield decompressor.flush()
+
+def _scan_gem(stream, tree, hash_names, only=None):
+	_scan_tar(_gem_data(stream), tree, hash_names, only)
+
+def _gem_data(stream):
+	# a .gem is a plain tar, whose contents are in `data.tar.gz`
+	gem = tarfile.open(fileobj=stream, mode='r|')
+	for member in _members(gem):
+		if member.name == 'data.tar.gz':
+			return tarfile.open(fileobj=gem.extractfile(member), mode='r|gz')
+	raise ValueError("no data.tar.gz found in gem")
+
+def _scan_tar(tar, tree, hash_names, only=None):
+	for member in _members(tar):
+		path = _member_path(member.name)
+		if not path:
+			continue
+		if only is not None and path[:len(only)] != only:
+			# outside the directory we're extracting, so there's no need to hash it
+			continue
+		if member.isdir():
+			tree.mkdir(path)
+		elif member.isreg():
+			hashes = _hash_stream(tar.extractfile(member), hash_names)
+			type = 'X' if member.mode & 0o111 else 'F'
+			tree.add(path, (type, hashes, "%s %s" % (int(member.mtime), member.size)))
+		elif member.issym():
+			target = member.linkname
+			tree.add(path, ('S', _hash_string(target, hash_names), str(len(target))))
+		elif member.islnk():
+			target = _member_path(member.linkname)
+			if only is not None and target[:len(only)] != only:
+				raise _LinkOutsideExtract("%s is a hard link to %s, which is outside %s" % (member.name, member.linkname, '/'.join(only)))
+			tree.add(path, tree.lookup(target))
+		else:
+			raise ValueError("unknown object %s (not a file, directory or symlink)" % (member.name,))
+
+class _LinkOutsideExtract(ValueError):
+	pass
+
+def list_toplevel(url, type=None, local_file=None):
+	"""Returns the (sorted) top-level contents of an archive, read from its
+	index (or its members' headers) without extracting or hashing anything.
+	Returns None for archive types which can't be listed this way."""
+	if type is None:
+		type = unpack.type_from_url(url)
+	if type == ZIP_TYPE:
+		# the index of a zip is at the end, so it must be read from a file
+		if local_file is None:
+			with tempfile.NamedTemporaryFile() as temp:
+				download(url, temp.name)
+				return list_toplevel(url, type=type, local_file=temp.name)
+		with zipfile.ZipFile(local_file) as archive:
+			names = archive.namelist()
+	elif can_stream(url, type):
+		source = session.urlopen(url) if local_file is None else open(local_file, 'rb')
+		with contextlib.closing(source):
+			if type == GEM_TYPE:
+				tar = _gem_data(source)
 			else:
-				shutil.rmtree(base)
+				tar = tarfile.open(fileobj=source, mode='r|*')
+			names = [member.name for member in _members(tar)]
+	else:
+		return None
+	return sorted(set([path[0] for path in map(_member_path, names) if path]))
+
+def _members(tar):
+	# like iterating over `tar`, but without keeping every
+	# member in memory for the lifetime of the archive
+	while True:
+		member = tar.next()
+		if member is None: break
+		yield member
+		tar.members = []
+
+def _member_path(name):
+	path = [part for part in name.split('/') if part not in ('', '.')]
+	if '..' in path:
+		raise ValueError("unsafe path in archive: %s" % (name,))
+	if any(['\n' in part for part in path]):
+		raise ValueError("newline in filename: %r" % (name,))
+	return path
+
+class _CountingStream(object):
+	def __init__(self, stream):
+		self.stream = stream
+		self.size = 0
+
+	def read(self, size=-1):
+		data = self.stream.read(size)
+		self.size += len(data)
+		return data
+
+class _MemoryTree(object):
+	"""Manifest entries for an archive's contents, held in memory.
+	Directories are dicts (keyed by filename), and everything else is
+	a (type, hashes, info) tuple"""
+	def __init__(self, root=None):
+		self.root = {} if root is None else root
+
+	def _dir(self, path):
+		directory = self.root
+		for part in path:
+			child = directory.get(part)
+			if not isinstance(child, dict):
+				child = directory[part] = {}
+			directory = child
+		return directory
+
+	def mkdir(self, path):
+		self._dir(path)
+
+	def add(self, path, entry):
+		self._dir(path[:-1])[path[-1]] = entry
+
+	def lookup(self, path):
+		entry = self.root
+		for part in path:
+			try:
+				entry = entry[part]
+			except (KeyError, TypeError):
+				raise ValueError("no such file in archive: %s" % ('/'.join(path),))
+		return entry
+
+	def listdir(self):
+		return sorted(self.root.keys())
+
+	def subtree(self, extract):
+		subtree = self.lookup(_member_path(extract))
+		if not isinstance(subtree, dict):
+			raise ValueError("not a directory: %s" % (extract,))
+		return _MemoryTree(subtree)
+
+	def walk(self, hash_names):
+		def recurse(sub, directory):
+			if sub != '/':
+				yield ('D', None, sub)
+			dirs = []
+			for leaf in sorted(directory.keys()):
+				entry = directory[leaf]
+				if isinstance(entry, dict):
+					dirs.append(leaf)
+					continue
+				type, hashes, info = entry
+				if type != 'S' and leaf == '.manifest': continue
+				yield (type, hashes, "%s %s" % (info, leaf))
+			if not sub.endswith('/'):
+				sub += '/'
+			for leaf in dirs:
+				for entry in recurse(sub + leaf, directory[leaf]):
+					yield entry
+		return recurse('/', self.root)
+
+class _DiskTree(object):
+	def __init__(self, root, hash_jobs=None):
+		self.root = root
+		self.hash_jobs = hash_jobs
+
+	def listdir(self):
+		return os.listdir(self.root)
+
+	def subtree(self, extract):
+		return _DiskTree(os.path.join(self.root, extract), self.hash_jobs)
+
+	def walk(self, hash_names):
+		return _walk_tree(self.root, hash_names, self.hash_jobs)
+
+@timing.timed('download')
+def download(url, path):
+	log.info("downloading %s -> %s" % (url, path))
+	with open(path, 'wb') as data:
+		with contextlib.closing(session.urlopen(url)) as stream:
+			while True:
+				chunk = stream.read(READ_SIZE)
+				if not chunk: break
+				data.write(chunk)
 
 def fetch(url, base, filename, dest, extract=None, type=None, local_file=None):
-	mode = 'w+' if local_file is None else 'r'
-	with open(local_file or os.path.join(base, filename), mode) as data:
-		if local_file is None:
-			log.info("downloading %s -> %s" % (url, os.path.join(base, filename)))
-			with contextlib.closing(urllib2.urlopen(url)) as stream:
-				while True:
-					chunk = stream.read(1024)
-					if not chunk: break
-					data.write(chunk)
-			data.seek(0)
+	if local_file is None:
+		local_file = os.path.join(base, filename)
+		download(url, local_file)
+	with open(local_file, 'rb') as data, timing.span('unpack'):
 		os.makedirs(os.path.join(base, dest))
 		unpack.unpack_archive(url, data = data, destdir = os.path.join(base, dest), extract=extract, type=type)
 
-def get_manifest(root, extract, algname='sha256'):
+def unpack_tree(url, base, type=None, local_file=None, extract=None, hash_jobs=None):
+	"""Unpack the archive at `url` (downloading it into `base`, unless
+	`local_file` is given) into `base`.
+
+	If `extract` is None and the archive's index shows a single top-level
+	directory, only that directory is unpacked.
+
+	Returns a (tree, size, extract) tuple, where `extract` is what was
+	unpacked (False if the archive has several top-level entries)."""
+	filename = url.rsplit('/', 1)[1]
+	dest = 'root'
+	if local_file is None:
+		local_file = os.path.join(base, filename)
+		download(url, local_file)
+	size = os.stat(local_file).st_size
+	if extract is None:
+		# if the archive's index tells us what `extract` should be,
+		# we only need to unpack that directory
+		toplevel = list_toplevel(url, type=type, local_file=local_file)
+		if toplevel is not None:
+			extract = toplevel[0] if len(toplevel) == 1 else False
+	fetch(url, base=base, filename=filename, dest=dest, type=type, local_file=local_file, extract=extract or None)
+	return _DiskTree(os.path.join(base, dest), hash_jobs), size, extract
+
+def get_manifest(root, extract, algname='sha256', jobs=None):
+	return get_manifests(root, extract, algnames=[algname], jobs=jobs)[algname]
+
+def get_manifests(root, extract, algnames=DEFAULT_ALGORITHMS, jobs=None):
+	"""Generate the manifest digest of `root` for each of `algnames`,
+	walking the tree (and reading each file) only once. If `jobs` is
+	given, files are hashed by that many processes at once."""
 	if extract is not None:
 		root = os.path.join(root, extract)
-	try:
-		alg = manifest.algorithms.get(algname)
-		log.debug("got algorithm for %s: %r" % (algname, alg,))
-	except KeyError:
-		raise ValueError("unknown algorithm: %s" % (algname,))
-	digest = alg.new_digest()
-	for line in alg.generate_manifest(root):
-		digest.update(line + '\n')
-	return digest.hexdigest()
+	algs = _get_algorithms(algnames)
+	with timing.span('manifest'):
+		return _digest_entries(_walk_tree(root, _hash_names(algs), jobs), algs)
 
+def _get_algorithms(algnames):
+	algs = {}
+	for algname in algnames:
+		try:
+			algs[algname] = manifest.algorithms[algname]
+		except KeyError:
+			raise ValueError("unknown algorithm: %s" % (algname,))
+		log.debug("got algorithm for %s: %r" % (algname, algs[algname],))
+	return algs
+
+def _hash_names(algs):
+	# several algorithms share the same underlying hash (e.g sha256 and sha256new),
+	# so file contents only need hashing once per distinct hash function
+	return set([alg.new_digest().name for alg in algs.values()])
+
+def _hash_stream(stream, hash_names):
+	hashes = dict([(name, hashlib.new(name)) for name in hash_names])
+	while True:
+		chunk = stream.read(CHUNK_SIZE)
+		if not chunk: break
+		for h in hashes.values():
+			h.update(chunk)
+	return dict([(name, h.hexdigest()) for name, h in hashes.items()])
+
+def _hash_string(data, hash_names):
+	return dict([(name, hashlib.new(name, data).hexdigest()) for name in hash_names])
+
+def _walk_tree(root, hash_names, jobs=None):
+	"""Yield (type, hashes, rest) for each entry under `root`, in manifest order.
+	`hashes` maps each of `hash_names` to the hex digest of the entry's
+	contents, and is None for directories.
+
+	If `jobs` is more than 1, file contents are hashed by a pool of
+	that many processes (see `start_hash_pool`)."""
+	hash_names = tuple(sorted(hash_names))
+	entries = _tree_entries(root)
+	if jobs is not None and jobs > 1:
+		pool = _hash_pool(jobs)
+		if pool is not None:
+			return _hash_entries_in_parallel(list(entries), hash_names, pool)
+	return _hash_entries(entries, hash_names)
+
+def _tree_entries(root):
+	"""Yield (type, source, rest) for each entry under `root`, in manifest
+	order. `source` is the path of a regular file, the target of a symlink,
+	or None for a directory."""
+	def recurse(sub):
+		full = os.path.join(root, sub[1:])
+		if sub != '/':
+			yield ('D', None, sub)
+		dirs = []
+		for leaf in sorted(os.listdir(full)):
+			if '\n' in leaf:
+				raise ValueError("newline in filename: %r" % (leaf,))
+			path = os.path.join(full, leaf)
+			info = os.lstat(path)
+			mode = info.st_mode
+			if stat.S_ISREG(mode):
+				if leaf == '.manifest': continue
+				yield ('X' if mode & 0o111 else 'F', path, "%s %s %s" % (int(info.st_mtime), info.st_size, leaf))
+			elif stat.S_ISLNK(mode):
+				target = os.readlink(path)
+				yield ('S', target, "%s %s" % (len(target), leaf))
+			elif stat.S_ISDIR(mode):
+				dirs.append(leaf)
+			else:
+				raise ValueError("unknown object %s (not a file, directory or symlink)" % (path,))
+		if not sub.endswith('/'):
+			sub += '/'
+		for leaf in dirs:
+			for entry in recurse(sub + leaf):
+				yield entry
+	return recurse('/')
+
+def _hash_entries(entries, hash_names):
+	for type, source, rest in entries:
+		if type == 'D':
+			hashes = None
+		elif type == 'S':
+			hashes = _hash_string(source, hash_names)
+		else:
+			hashes = _hash_file(source, hash_names)
+		yield (type, hashes, rest)
 
+def _hash_entries_in_parallel(entries, hash_names, pool):
+	# large files are split into one job per hash function, so that
+	# a single huge file doesn't leave the other processes idle
+	file_jobs = []
+	for type, source, rest in entries:
+		if type not in ('F', 'X'):
+			continue
+		if os.path.getsize(source) >= MMAP_THRESHOLD:
+			file_jobs.append([(source, (name,)) for name in hash_names])
+		else:
+			file_jobs.append([(source, hash_names)])
+	results = pool.imap(_hash_file_job, [job for jobs_for_file in file_jobs for job in jobs_for_file], chunksize=8)
+	file_jobs = iter(file_jobs)
+	for type, source, rest in entries:
+		if type in ('F', 'X'):
+			hashes = {}
+			for job in file_jobs.next():
+				hashes.update(results.next())
+			yield (type, hashes, rest)
+		else:
+			for entry in _hash_entries([(type, source, rest)], hash_names):
+				yield entry
+
+_hash_pools = {}
+_hash_pools_lock = threading.Lock()
+
+def start_hash_pool(jobs):
+	"""Start the processes used to hash files when `jobs` are requested.
+	This should be called from the main thread before any other threads
+	are started, since forking a process with several threads is unsafe
+	(the child gets a copy of any locks which other threads held)."""
+	# pools are kept for the life of the process, since starting
+	# worker processes for every archive would be wasteful
+	with _hash_pools_lock:
+		if jobs not in _hash_pools:
+			log.debug("starting %s hashing processes" % (jobs,))
+			_hash_pools[jobs] = multiprocessing.Pool(jobs)
+		return _hash_pools[jobs]
+
+def _hash_pool(jobs):
+	if isinstance(threading.current_thread(), threading._MainThread):
+		return start_hash_pool(jobs)
+	with _hash_pools_lock:
+		pool = _hash_pools.get(jobs)
+	if pool is None:
+		log.debug("no pool of %s hashing processes was started - hashing in this thread" % (jobs,))
+	return pool
+
+def _hash_file_job(args):
+	return _hash_file(*args)
+
+def _hash_file(path, hash_names):
+	with open(path, 'rb') as stream:
+		size = os.fstat(stream.fileno()).st_size
+		if size < MMAP_THRESHOLD:
+			return _hash_stream(stream, hash_names)
+		# large files are hashed straight from the page cache, without copying
+		contents = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			return _hash_string(contents, hash_names)
+		finally:
+			contents.close()
+
+def _digest_entries(entries, algs):
+	hash_names = dict([(algname, alg.new_digest().name) for algname, alg in algs.items()])
+	digests = dict([(algname, alg.new_digest()) for algname, alg in algs.items()])
+	for type, hashes, rest in entries:
+		for algname, digest in digests.items():
+			if hashes is None:
+				line = "%s %s" % (type, rest)
+			else:
+				line = "%s %s %s" % (type, hashes[hash_names[algname]], rest)
+			digest.update(line + '\n')
+	# getID returns e.g "sha1new=<digest>" or "sha256new_<digest>"
+	return dict([(algname, algs[algname].getID(digest)[len(algname)+1:]) for algname, digest in digests.items()])
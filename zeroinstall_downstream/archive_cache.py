@@ -0,0 +1,223 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import contextlib
+
+from . import session
+from .cache import default_path, ensure_dir, load_json, save_json
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+class ArchiveCache(object):
+	"""A persistent cache of downloaded archives (and their manifests).
+
+	Each URL maps to a blob stored by the sha256 of its contents, so the
+	same file served from multiple URLs is only stored (and hashed) once.
+	When the blobs take up more than `max_size` bytes, the least recently
+	used ones are removed.
+
+	Cached URLs are trusted as-is, unless `revalidate` is set - in which
+	case the server is asked whether the file has changed (based on its
+	ETag, Last-Modified and size) before the cached copy is used."""
+	def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE, revalidate=False):
+		if path is None:
+			path = default_path('archives')
+		self.path = path
+		self.max_size = max_size
+		self.revalidate = revalidate
+		self._lock = threading.RLock()
+		for subdir in ('urls', 'blobs'):
+			ensure_dir(os.path.join(path, subdir))
+
+	def _url_path(self, url):
+		return os.path.join(self.path, 'urls', hashlib.sha1(url).hexdigest() + '.json')
+
+	def lookup(self, url):
+		"""Returns the CacheEntry for `url`, or None if it's not cached"""
+		url_path = self._url_path(url)
+		with self._lock:
+			info = load_json(url_path)
+			if info is None:
+				return None
+			entry = CacheEntry(self, info['content'])
+			if not entry.exists():
+				log.debug("cached blob for %s has been evicted" % (url,))
+				os.remove(url_path)
+				return None
+		if self.revalidate and not _is_fresh(url, info):
+			log.info("cached copy of %s is out of date" % (url,))
+			return None
+		entry.touch()
+		return entry
+
+	def fetch(self, url):
+		"""Download `url` into the cache, returning its CacheEntry"""
+		with contextlib.closing(session.urlopen(url)) as stream:
+			download = self.download(url, stream.info())
+			try:
+				while True:
+					chunk = stream.read(CHUNK_SIZE)
+					if not chunk: break
+					download.write(chunk)
+			except:
+				download.abort()
+				raise
+		return download.commit()
+
+	def download(self, url, headers):
+		"""Returns a Download, which stores the contents of `url` (whose
+		response had the given `headers`) as they're written to it"""
+		return Download(self, url, headers)
+
+	@property
+	def size(self):
+		return sum([size for _, _, size in self._blobs()])
+
+	def _blobs(self):
+		blobs = os.path.join(self.path, 'blobs')
+		for filename in os.listdir(blobs):
+			if filename.startswith('.') or not filename.endswith('.json'):
+				continue
+			entry = CacheEntry(self, filename[:-len('.json')])
+			try:
+				yield (os.stat(entry.info_path).st_mtime, entry, os.stat(entry.path).st_size)
+			except OSError:
+				continue
+
+	def _evict(self, keep=None):
+		with self._lock:
+			blobs = sorted(self._blobs())
+			total = sum([size for _, _, size in blobs])
+			for _, entry, size in blobs:
+				if total <= self.max_size:
+					break
+				if entry.content == keep:
+					continue
+				log.debug("evicting cached archive %s (%s bytes)" % (entry.content, size))
+				entry.remove()
+				total -= size
+
+class CacheEntry(object):
+	def __init__(self, cache, content):
+		self.cache = cache
+		self.content = content
+		self.path = os.path.join(cache.path, 'blobs', content)
+		self.info_path = self.path + '.json'
+
+	def exists(self):
+		return os.path.exists(self.path) and os.path.exists(self.info_path)
+
+	@property
+	def size(self):
+		return load_json(self.info_path)['size']
+
+	def touch(self):
+		# the mtime of the info file tracks when this entry was last used
+		os.utime(self.info_path, None)
+
+	def remove(self):
+		for path in (self.path, self.info_path):
+			if os.path.exists(path):
+				os.remove(path)
+
+	def result(self, extract, algorithms):
+		"""Returns the saved result (a dict with `extract`, `toplevel` and
+		`manifests` keys) for the given `extract` argument, or None if
+		this archive hasn't been processed with all of `algorithms`."""
+		info = load_json(self.info_path) or {'results': {}}
+		result = info['results'].get(json.dumps(extract))
+		if result is None or not set(algorithms).issubset(result['manifests']):
+			return None
+		return result
+
+	def save_result(self, extract, result):
+		with self.cache._lock:
+			info = load_json(self.info_path)
+			if info is None:
+				return
+			key = json.dumps(extract)
+			existing = info['results'].get(key)
+			if existing is not None and existing['extract'] == result['extract']:
+				result['manifests'] = dict(existing['manifests'], **result['manifests'])
+			info['results'][key] = result
+			save_json(self.info_path, info)
+
+class Download(object):
+	def __init__(self, cache, url, headers):
+		self.cache = cache
+		self.url = url
+		self.headers = headers
+		self.digest = hashlib.sha256()
+		self.size = 0
+		self.aborted = False
+		self._lock = threading.Lock()
+		fd, self.partial = tempfile.mkstemp(dir=os.path.join(cache.path, 'blobs'), prefix='.partial-')
+		log.info("downloading %s -> %s" % (url, self.partial))
+		self.file = os.fdopen(fd, 'wb')
+
+	def write(self, chunk):
+		with self._lock:
+			# (the thread reading the download may not have noticed it was aborted)
+			if self.aborted:
+				return
+			self.digest.update(chunk)
+			self.file.write(chunk)
+			self.size += len(chunk)
+
+	def abort(self):
+		with self._lock:
+			self.aborted = True
+			self.file.close()
+			if os.path.exists(self.partial):
+				os.remove(self.partial)
+
+	def commit(self):
+		"""Store the downloaded file, returning its CacheEntry"""
+		cache = self.cache
+		try:
+			self.file.close()
+			entry = CacheEntry(cache, self.digest.hexdigest())
+			with cache._lock:
+				if entry.exists():
+					os.remove(self.partial)
+				else:
+					os.rename(self.partial, entry.path)
+					save_json(entry.info_path, {'size': self.size, 'results': {}})
+				save_json(cache._url_path(self.url), {
+					'url': self.url,
+					'content': entry.content,
+					'size': self.size,
+					'etag': self.headers.get('etag'),
+					'last_modified': self.headers.get('last-modified'),
+				})
+				cache._evict(keep=entry.content)
+		except:
+			self.abort()
+			raise
+		return entry
+
+def _is_fresh(url, info):
+	headers = {}
+	if info.get('etag'):
+		headers['If-None-Match'] = info['etag']
+	if info.get('last_modified'):
+		headers['If-Modified-Since'] = info['last_modified']
+	response = session.urlopen(url, headers=headers)
+	with contextlib.closing(response):
+		if response.status_code == 304:
+			return True
+		# the server ignored our conditional request, so compare validators ourselves
+		headers = response.info()
+		validators = [
+			(info.get('etag'), headers.get('etag')),
+			(info.get('last_modified'), headers.get('last-modified')),
+			(str(info['size']), headers.get('content-length')),
+		]
+		validators = [(cached, current) for cached, current in validators if cached and current]
+		return len(validators) > 0 and all([cached == current for cached, current in validators])
@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+import threading
+import contextlib
+
+from . import archive, metrics
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 8
+
+_requests = metrics.counter('archive_registry_requests_total', 'Archive contents requested from the per-run registry, by result (hit or miss)', ['result'])
+
+class ArchiveRegistry(object):
+	"""Shares downloaded archives between Archive objects, for the
+	duration of a command which processes many feeds (typically as
+	archive.default_registry).
+
+	Each distinct URL is downloaded and scanned (or unpacked) once, and
+	the manifest for each requested `extract` directory is computed from
+	that shared copy. While only one `extract` has been asked for, only
+	that directory is hashed or unpacked (just as it would be without a
+	registry). Once a different one is wanted, the whole archive is read
+	again, so that it can serve every `extract` from then on.
+
+	This is safe to use from multiple threads - if several threads ask
+	for the same archive at once, one of them fetches it while the
+	others wait.
+
+	Once more than `max_entries` archives are held, the least recently
+	used ones (which aren't currently in use) are dropped."""
+	def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+		self.max_entries = max_entries
+		self._entries = {}
+		self._lock = threading.Lock()
+		self._clock = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *a):
+		self.close()
+
+	@contextlib.contextmanager
+	def contents(self, url, hash_names, extract=None, type=None, local_file=None, streaming=True, cache=None, hash_jobs=None):
+		"""Provides the (tree, size, cache_entry) for the archive at `url`,
+		fetching it if necessary (see archive.scan). If `extract` is given,
+		`tree` may only hold that directory."""
+		# local files (including cached downloads) are shared by path, so
+		# that identical content from different URLs is only processed once
+		key = local_file or url
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				entry = self._entries[key] = _Entry(url)
+			entry.users += 1
+			self._clock += 1
+			entry.last_used = self._clock
+		try:
+			with entry.lock:
+				if not (entry.serves(extract) and entry.has_hashes(hash_names)):
+					_requests.inc(result='miss')
+					entry.load(extract, hash_names, type, local_file, streaming, cache, hash_jobs)
+				else:
+					_requests.inc(result='hit')
+					log.debug("reusing archive contents for %s" % (url,))
+			yield (entry.tree, entry.size, entry.cache_entry)
+		finally:
+			with self._lock:
+				entry.users -= 1
+				self._evict()
+
+	def _evict(self):
+		idle = sorted([(entry.last_used, key) for key, entry in self._entries.items() if entry.users == 0])
+		while idle and len(self._entries) > self.max_entries:
+			_, key = idle.pop(0)
+			self._entries.pop(key).remove()
+
+	def close(self):
+		with self._lock:
+			for entry in self._entries.values():
+				entry.remove()
+			self._entries = {}
+
+class _Entry(object):
+	def __init__(self, url):
+		self.url = url
+		self.lock = threading.Lock()
+		self.users = 0
+		self.last_used = 0
+		self.tree = None
+		# whether `tree` holds the whole archive, and if not,
+		# which `extract` values it's good for
+		self.whole = False
+		self.extracts = set()
+		self.hash_names = set()
+		self.size = None
+		self.cache_entry = None
+		self.base = None
+
+	def serves(self, extract):
+		return self.tree is not None and (self.whole or extract in self.extracts)
+
+	def has_hashes(self, hash_names):
+		# files on disk are hashed as they're walked, so they have every hash
+		return self.tree is not None and (self.base is not None or set(hash_names).issubset(self.hash_names))
+
+	def load(self, extract, hash_names, type, local_file, streaming, cache, hash_jobs):
+		# the first `extract` is read on its own, but if this archive
+		# has been read before, it's probably wanted for several
+		whole = self.tree is not None and (self.whole or extract not in self.extracts)
+		self.remove()
+		if streaming:
+			scanned = None if whole else extract
+			self.tree, self.size, cache_entry = archive.scan(self.url, hash_names, type=type, local_file=local_file, cache=cache, extract=scanned)
+			self.cache_entry = cache_entry or self.cache_entry
+			self.hash_names = set(hash_names)
+			self.whole = scanned is None
+			self.extracts = set([extract])
+		else:
+			self.base = tempfile.mkdtemp()
+			self.tree, self.size, unpacked = archive.unpack_tree(self.url, self.base, type=type, local_file=local_file, extract=False if whole else extract, hash_jobs=hash_jobs)
+			self.whole = unpacked in (None, False)
+			# (if `extract` was guessed, the tree is also good for that guess)
+			self.extracts = set([extract, unpacked])
+
+	def remove(self):
+		self.tree = None
+		if self.base is not None:
+			shutil.rmtree(self.base, ignore_errors=True)
+			self.base = None
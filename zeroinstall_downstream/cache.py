@@ -0,0 +1,41 @@
+import os
+import json
+import tempfile
+
+def default_path(*resource):
+	from zeroinstall.support import basedir
+	return basedir.save_cache_path('0downstream', *resource)
+
+def ensure_dir(path):
+	if not os.path.exists(path):
+		os.makedirs(path)
+	return path
+
+def load_json(path):
+	try:
+		with open(path) as f:
+			return json.load(f)
+	except IOError:
+		return None
+
+def save_json(path, info):
+	# write to a temporary file first, so that readers never see partial contents
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.partial-')
+	with os.fdopen(fd, 'w') as f:
+		json.dump(info, f)
+	os.rename(tmp, path)
+
+def save_chunks(path, chunks):
+	'''Write each of `chunks` to `path`, returning the total size'''
+	size = 0
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.partial-')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			for chunk in chunks:
+				f.write(chunk)
+				size += len(chunk)
+	except:
+		os.remove(tmp)
+		raise
+	os.rename(tmp, path)
+	return size
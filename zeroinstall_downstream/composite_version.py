@@ -1,9 +1,42 @@
+import bisect
 import functools
+import threading
+from collections import OrderedDict
 from version import Version
+from zeroinstall import SafeException
+from zeroinstall.injector.model import parse_version
 import logging
 LOGGER = logging.getLogger(__name__)
 
-def try_parse(version_string):
+# the number of parsed version strings to remember
+MAX_CACHED = 100000
+
+def _lru_cache(max_size):
+	def decorator(fn):
+		cache = OrderedDict()
+		lock = threading.Lock()
+		@functools.wraps(fn)
+		def cached(arg):
+			with lock:
+				try:
+					result = cache.pop(arg)
+				except KeyError:
+					pass
+				else:
+					# re-insert to mark it as most recently used
+					cache[arg] = result
+					return result
+			result = fn(arg)
+			with lock:
+				cache[arg] = result
+				while len(cache) > max_size:
+					cache.popitem(last=False)
+			return result
+		return cached
+	return decorator
+
+@_lru_cache(MAX_CACHED)
+def _parse(version_string):
 	try:
 		LOGGER.debug("trying to parse: %s", version_string)
 		return CompositeVersion(version_string)
@@ -11,8 +44,32 @@ def try_parse(version_string):
 		LOGGER.debug("ignoring unparseable version: %s", version_string)
 		return None
 
-@functools.total_ordering
+def parse(version_string):
+	'''Like CompositeVersion(version_string), except that parsed versions
+	are remembered (and shared), so parsing the same string is cheap.'''
+	version = _parse(version_string)
+	if version is None:
+		raise ValueError("unparseable version: %s" % (version_string,))
+	return version
+
+def try_parse(version_string):
+	'''Like `parse`, but returns None for unparseable versions'''
+	return _parse(version_string)
+
+def _sort_key(derived):
+	# order derived versions the way zeroinstall will, as nested
+	# tuples of ints (which are much faster to compare than Versions).
+	# Returns None if zeroinstall can't parse it.
+	try:
+		parts = parse_version(str(derived))
+	except SafeException as e:
+		LOGGER.debug("comparing %s as a Version: %s", derived, e)
+		return None
+	return tuple([tuple(part) if isinstance(part, list) else part for part in parts])
+
 class CompositeVersion(object):
+	__slots__ = ('upstream', 'derived', '_key', '_hash')
+
 	def __init__(self, version_string, derived=None):
 		assert isinstance(version_string, basestring), "Expected string, got %s" % (type(version_string))
 		self.upstream = version_string
@@ -20,22 +77,45 @@ class CompositeVersion(object):
 			derived = Version.parse(version_string, coerce=True)
 		assert isinstance(derived, Version)
 		self.derived = derived
-	
-	# note that two versions are equal if their derived version is equal, regardless
-	# of the upstream text.
-	def __eq__(self, other):
+		key = _sort_key(derived)
+		self._key = None if key is None else (key, version_string)
+		self._hash = hash((str(derived), version_string))
+
+	def _keys(self, other):
 		assert isinstance(other, type(self)), "Comparing %s to %s" % (type(self), type(other))
-		return self.derived == other.derived and self.upstream == other.upstream
+		if self._key is None or other._key is None:
+			return (self.derived, self.upstream), (other.derived, other.upstream)
+		return self._key, other._key
+
+	# note that two versions are equal only if both their derived version
+	# and their upstream text are equal.
+	def __eq__(self, other):
+		a, b = self._keys(other)
+		return a == b
 
 	def __hash__(self):
-		return hash(self.derived)
+		return self._hash
 
 	def __ne__(self, other): return not self.__eq__(other)
 	def __lt__(self, other):
-		assert isinstance(other, type(self)), "Comparing %s to %s" % (type(self), type(other))
-		if self.derived == other.derived:
-			return self.upstream < other.upstream
-		return self.derived < other.derived
+		a, b = self._keys(other)
+		return a < b
+	def __le__(self, other):
+		a, b = self._keys(other)
+		return a <= b
+	def __gt__(self, other):
+		a, b = self._keys(other)
+		return a > b
+	def __ge__(self, other):
+		a, b = self._keys(other)
+		return a >= b
+
+	@property
+	def sort_key(self):
+		'''A key which orders versions just like comparing them would, or
+		None if zeroinstall can't parse this version (in which case it can
+		only be ordered by comparing it with other versions)'''
+		return self._key
 
 	def __repr__(self):
 		return "<#CompositeVersion: %s | %s>" % (self.upstream, self.derived)
@@ -50,3 +130,62 @@ class CompositeVersion(object):
 
 	def fuzzy_match(self, version_str):
 		return version_str in (str(self.derived), self.upstream)
+
+class VersionIndex(object):
+	'''An immutable, sorted collection of CompositeVersions, which can be
+	looked up by upstream or derived version string and queried by range
+	without scanning every version.'''
+	def __init__(self, versions):
+		self.versions = sorted(set(versions))
+		self._keys = [version.sort_key for version in self.versions]
+		if None in self._keys:
+			self._keys = None
+		self._by_name = {}
+		# exact upstream matches take priority over derived ones
+		for version in self.versions:
+			self._by_name.setdefault(version.upstream, version)
+		for version in self.versions:
+			self._by_name.setdefault(str(version.derived), version)
+		self._names = sorted(self._by_name.keys())
+
+	def __len__(self):
+		return len(self.versions)
+
+	def __iter__(self):
+		return iter(self.versions)
+
+	def _bisect(self, search, version):
+		if self._keys is None or version.sort_key is None:
+			# (slower, but works for versions without a sort_key)
+			return search(self.versions, version)
+		return search(self._keys, version.sort_key)
+
+	def __contains__(self, version):
+		i = self._bisect(bisect.bisect_left, version)
+		return i < len(self.versions) and self.versions[i] == version
+
+	def find(self, version_string):
+		'''Returns the version with an upstream or derived version
+		of `version_string`, or None'''
+		return self._by_name.get(version_string)
+
+	def latest(self, count=None):
+		'''Returns the newest version (or a list of the newest `count`
+		versions, oldest first), or None if there are no versions'''
+		if count is None:
+			return self.versions[-1] if self.versions else None
+		return self.versions[max(0, len(self.versions) - count):]
+
+	def newer_than(self, version):
+		'''Returns all versions newer than `version`, oldest first'''
+		return self.versions[self._bisect(bisect.bisect_right, version):]
+
+	def matching(self, prefix):
+		'''Returns all versions whose upstream or derived version
+		string starts with `prefix`, oldest first'''
+		matches = set()
+		for name in self._names[bisect.bisect_left(self._names, prefix):]:
+			if not name.startswith(prefix):
+				break
+			matches.add(self._by_name[name])
+		return sorted(matches)
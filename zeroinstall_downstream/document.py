@@ -0,0 +1,113 @@
+'''A lightweight XML document model for feeds, based on ElementTree.
+
+Namespace prefixes are kept exactly as written (e.g. an element's tag is
+"gfxmonk:upstream", and namespaces are declared with ordinary "xmlns:..."
+attributes), so that a document can be saved without disturbing its
+layout. Comments and processing instructions are kept too, but
+whitespace-only text is discarded since it's regenerated by `xmlformat`.'''
+
+import xml.etree.cElementTree as ET
+from xml.etree.ElementTree import Comment, ProcessingInstruction
+from xml.parsers import expat
+
+class Document(object):
+	def __init__(self, root, nodes=None):
+		self.root = root
+		# top-level nodes, including the root element and any
+		# comments or processing instructions around it
+		self.nodes = nodes if nodes is not None else [root]
+
+	@classmethod
+	def create(cls, tag, attrib={}):
+		return cls(ET.Element(tag, attrib))
+
+	def iter(self, namespace, name):
+		'''Yields each element called `name` in `namespace`, in document order'''
+		return _iter(self.root, namespace, name, {})
+
+def is_element(node):
+	return node.tag is not Comment and node.tag is not ProcessingInstruction
+
+def _iter(elem, namespace, name, scope):
+	if not is_element(elem):
+		return
+	declarations = [(attr, value) for attr, value in elem.attrib.items() if is_namespace(attr)]
+	if declarations:
+		scope = scope.copy()
+		for attr, value in declarations:
+			scope[attr[len('xmlns:'):]] = value
+	prefix, _, local = elem.tag.rpartition(':')
+	if local == name and scope.get(prefix) == namespace:
+		yield elem
+	for child in elem:
+		for match in _iter(child, namespace, name, scope):
+			yield match
+
+def is_namespace(attr):
+	return attr == 'xmlns' or attr.startswith('xmlns:')
+
+def parse(infile):
+	'''Parse a Document from the file-like `infile`, which is read incrementally'''
+	builder = _Builder()
+	parser = expat.ParserCreate()
+	parser.buffer_text = True
+	parser.StartElementHandler = builder.start
+	parser.EndElementHandler = builder.end
+	parser.CharacterDataHandler = builder.data
+	parser.CommentHandler = builder.comment
+	parser.ProcessingInstructionHandler = builder.pi
+	parser.ParseFile(infile)
+	return Document(builder.root, builder.nodes)
+
+class _Builder(object):
+	def __init__(self):
+		self.root = None
+		self.nodes = []
+		self._stack = []
+		self._last = None
+		self._tail = False
+		self._text = []
+
+	def _flush(self):
+		if not self._text:
+			return
+		text = ''.join(self._text)
+		self._text = []
+		if self._last is None or not text.strip():
+			return
+		if self._tail:
+			self._last.tail = text
+		else:
+			self._last.text = text
+
+	def _add(self, node):
+		self._flush()
+		if self._stack:
+			self._stack[-1].append(node)
+		else:
+			self.nodes.append(node)
+
+	def start(self, tag, attrib):
+		elem = ET.Element(tag, attrib)
+		self._add(elem)
+		if self.root is None:
+			self.root = elem
+		self._stack.append(elem)
+		self._last, self._tail = elem, False
+
+	def end(self, tag):
+		self._flush()
+		self._last, self._tail = self._stack.pop(), True
+
+	def data(self, text):
+		self._text.append(text)
+
+	def comment(self, text):
+		node = ET.Comment(text)
+		self._add(node)
+		self._last, self._tail = node, True
+
+	def pi(self, target, data):
+		node = ET.PI(target, data)
+		self._add(node)
+		self._last, self._tail = node, True
@@ -1,13 +1,22 @@
 from .project import SOURCES, make
+from .project.common import parallel_map
 from .archive import Archive
-from .composite_version import CompositeVersion
-from xml.dom import minidom
+from . import composite_version
+from . import xmlformat, document, timing, metrics
+from .document import Document
+import xml.etree.cElementTree as ET
 from version import Version
-import subprocess
+from collections import OrderedDict
+from StringIO import StringIO
 import logging
 
 log = logging.getLogger(__name__)
 
+# (for callers which check or update whole feeds)
+results = metrics.counter('feeds_total', 'Feeds checked or updated, by result (ok, outdated, updated, error)', ['result'])
+_added = metrics.counter('implementations_added_total', 'Implementations added to feeds')
+_failed = metrics.counter('implementations_failed_total', 'Implementations which couldn\'t be added to feeds')
+
 ZI = "http://zero-install.sourceforge.net/2004/injector/interface"
 GFXMONK = "http://gfxmonk.net/dist/0install"
 ZEROCOMPILE = "http://zero-install.sourceforge.net/2006/namespaces/0compile"
@@ -17,28 +26,41 @@ class Feed(object):
 		self.doc = doc
 		self.uri = uri
 		self.project = project
-		self.interface = doc.documentElement
-		self.interface.setAttribute("xmlns", ZI)
-		self.interface.setAttribute("xmlns:gfxmonk", GFXMONK)
-		self.interface.setAttribute("xmlns:compile", ZEROCOMPILE)
+		self.interface = doc.root
+		self.interface.set("xmlns", ZI)
+		self.interface.set("xmlns:gfxmonk", GFXMONK)
+		self.interface.set("xmlns:compile", ZEROCOMPILE)
+		self._build_index()
+
+	def _build_index(self):
+		# scanning the document is slow, so we walk it just once and
+		# then keep the index up to date as implementations are added
+		self._groups = list(self.doc.iter(ZI, "group"))
+		self._implementations = OrderedDict()
+		for impl in self.doc.iter(ZI, "implementation"):
+			self._index_implementation(impl)
+
+	def _index_implementation(self, impl):
+		version = composite_version.parse(impl.get("version"))
+		self._implementations.setdefault(version, impl)
 
 	@classmethod
 	def from_project(cls, project, dest_uri):
-		dom = minidom.getDOMImplementation()
-		doc = dom.createDocument(ZI, "interface", None)
+		doc = Document.create("interface")
 		feed = cls(doc, project=project, uri = dest_uri)
 		feed.update_metadata()
 		group = feed._mknode("group")
-		feed.interface.appendChild(group)
+		feed.interface.append(group)
+		feed._groups.append(group)
 		return feed
 
 	@classmethod
 	def from_file(cls, infile):
-		doc = minidom.parse(infile)
-		interface = doc.documentElement
-		uri = interface.getAttribute('uri')
-		project_info = interface.getElementsByTagNameNS(GFXMONK, 'upstream')[0]
-		project_attrs = dict([(attr.name, attr.value) for attr in project_info.attributes.values()])
+		with timing.span('feed.parse'):
+			doc = document.parse(infile)
+		uri = doc.root.get('uri')
+		project_info = next(doc.iter(GFXMONK, 'upstream'))
+		project_attrs = dict(project_info.attrib)
 		update_metadata = project_attrs.pop('update-metadata', 'true') == 'true'
 		try:
 			project = make(**project_attrs)
@@ -50,47 +72,42 @@ class Feed(object):
 		return feed
 
 	def update_metadata(self):
-		self.interface.setAttribute('uri', self.uri)
+		self.interface.set('uri', self.uri)
 		name = self._create_or_update_child_node(self.interface, "name", self.name)
 		summary = self._create_or_update_child_node(self.interface, "summary", self.project.summary)
 		project_info = self._create_or_update_child_node(self.interface, "gfxmonk:upstream", ns=GFXMONK)
-		project_info.setAttribute('type', self.project.upstream_type)
-		project_info.setAttribute('id', self.project.id)
+		project_info.set('type', self.project.upstream_type)
+		project_info.set('id', self.project.id)
 		publish = self._create_or_update_child_node(self.interface, "gfxmonk:publish", "third-party", ns=GFXMONK)
 		homepage = self._create_or_update_child_node(self.interface, "homepage", self.project.homepage)
 		description = self._create_or_update_child_node(self.interface, "description", self.project.description)
 
 	def _create_or_update_child_node(self, elem, node_name, content=None, ns=None):
-		children = elem.childNodes
+		children = list(elem)
 		for child in children:
-			if child.nodeType == child.ELEMENT_NODE and child.tagName == node_name:
+			if child.tag == node_name:
 				log.debug("using existing node %s for node type %s" % (child, node_name))
 				new_node = child
-				while new_node.hasChildNodes():
-					_del = new_node.removeChild(new_node.childNodes[0])
-					_del.unlink()
+				del new_node[:]
+				new_node.text = None
 				break
 		else:
 			new_node = self._mknode(node_name)
-			if elem.hasChildNodes() and elem.getElementsByTagName('group'):
-				first_group = elem.getElementsByTagName('group')[0]
-				elem.insertBefore(new_node, first_group)
+			first_group = [i for i, child in enumerate(children) if self._groups and child is self._groups[0]]
+			if first_group:
+				elem.insert(first_group[0], new_node)
 			else:
-				elem.appendChild(new_node)
+				elem.append(new_node)
 		if content is not None:
 			log.debug("setting %s to %s" %(node_name, content))
-			content = self.doc.createTextNode(content)
-			new_node.appendChild(content)
+			new_node.text = content
 		return new_node
 
 	def _mknode(self, node_name, content=None, ns=None):
-		if ns is None:
-			node = self.doc.createElement(node_name)
-		else:
-			node = self.doc.createElementNS(ns, node_name)
-		if content is not None:
-			content = self.doc.createTextNode(content)
-			node.appendChild(content)
+		# namespaced nodes are named with their prefix (e.g "gfxmonk:upstream"),
+		# which is declared on the root element
+		node = ET.Element(node_name)
+		node.text = content
 		return node
 
 	@property
@@ -99,10 +116,10 @@ class Feed(object):
 		return self.uri.rstrip('/').rsplit('/', 1)[1].rsplit('.', 1)[0]
 
 	def find_version(self, version_string):
-		for version in self.available_versions:
-			if version.fuzzy_match(version_string):
-				return version
-		raise AssertionError("No such version: %s" % (version_string,))
+		version = self.project.version_index.find(version_string)
+		if version is None:
+			raise AssertionError("No such version: %s" % (version_string,))
+		return version
 
 	def add_implementation(self, version_string=None, extract=None):
 		if version_string is None:
@@ -110,18 +127,62 @@ class Feed(object):
 		else:
 			version = self.find_version(version_string)
 
-		assert version in self.available_versions, "no such version: %s" % (version_string,)
-		assert version in self.unpublished_versions(), "version %s already published" % (version_string,)
+		assert version in self.project.version_index, "no such version: %s" % (version_string,)
+		assert version not in self._implementations, "version %s already published" % (version_string,)
 		log.debug("adding version: %s" % (version.pretty(),))
 		release = self.project.implementation_for(version)
-		group = self.interface.getElementsByTagName("group")[-1]
-		impl = self._mknode('implementation')
-		impl.setAttribute('version', str(version.derived))
-		impl.setAttribute('released', release.released)
+		archive = self._archive(release, extract)
+		self._add_implementation(version, release, archive)
+
+	def add_implementations(self, versions, jobs=4, registry=None):
+		'''Add an implementation for each of `versions`, downloading (and
+		hashing) up to `jobs` archives at once. Implementations are added
+		in version order. Returns a list of (version, error) pairs for
+		any versions that couldn't be added.
+
+		`registry` is the archive_registry.ArchiveRegistry to share
+		downloaded archives with (archive.default_registry by default).'''
+		for version in versions:
+			assert version not in self._implementations, "version %s already published" % (version.pretty(),)
+
+		versions = sorted(versions)
+		try:
+			# projects may be able to look these up more efficiently all at once
+			releases = dict(zip(versions, self.project.implementations_for(versions)))
+		except Exception:
+			# (so that whichever versions are available can still be added)
+			log.debug("can't look up versions %s together" % (", ".join([v.pretty() for v in versions]),), exc_info=True)
+			releases = {}
+
+		def prepare(version):
+			try:
+				release = releases.get(version) or self.project.implementation_for(version)
+				return (version, release, self._archive(release, registry=registry), None)
+			except Exception as e:
+				log.debug("can't add version %s" % (version.pretty(),), exc_info=True)
+				return (version, None, None, e)
+
+		failed = []
+		for version, release, archive, error in parallel_map(prepare, versions, jobs):
+			if error is not None:
+				_failed.inc()
+				failed.append((version, error))
+				continue
+			log.debug("adding version: %s" % (version.pretty(),))
+			self._add_implementation(version, release, archive)
+		return failed
 
+	def _archive(self, release, extract=None, registry=None):
 		# release has a default `extract
 		extract = extract or release.extract
-		archive = Archive(release.url, type=release.archive_type, extract=extract)
+		return Archive(release.url, type=release.archive_type, extract=extract, registry=registry)
+
+	def _add_implementation(self, version, release, archive):
+		group = self._groups[-1]
+		impl = self._mknode('implementation')
+		impl.set('version', str(version.derived))
+		impl.set('released', release.released)
+
 		# Archive may guess an `extract` value, if there was only one toplevel
 		# specified and we didn't pass an extract explicitly
 		extract = archive.extract
@@ -129,7 +190,7 @@ class Feed(object):
 		archive_tag = self._mknode('archive')
 		def set_archive_attr(attr, val):
 			log.debug("setting archive %s to %r" %(attr, val))
-			archive_tag.setAttribute(attr, val)
+			archive_tag.set(attr, val)
 
 		set_archive_attr('href', release.url)
 		if extract is not None:
@@ -137,44 +198,59 @@ class Feed(object):
 		if archive.type is not None:
 			set_archive_attr('type', archive.type)
 		set_archive_attr('size', str(archive.size))
-		impl.appendChild(archive_tag)
+		impl.append(archive_tag)
 
 		manifest_tag = self._mknode('manifest-digest')
-		manifest_tag.setAttribute('sha256', archive.manifests['sha256'])
-		impl.appendChild(manifest_tag)
+		manifest_tag.set('sha256', archive.manifests['sha256'])
+		impl.append(manifest_tag)
 
-		impl.setAttribute('id', "sha1new=%s" % (archive.manifests['sha1new']))
-		group.appendChild(impl)
+		impl.set('id', "sha1new=%s" % (archive.manifests['sha1new']))
+		group.append(impl)
+		self._index_implementation(impl)
+		_added.inc()
 	
 	@property
 	def published_versions(self):
-		implementations = self.interface.getElementsByTagName("implementation")
-		return map(lambda x: CompositeVersion(x.getAttribute("version")), implementations)
+		return list(self._implementations.keys())
 	
+	@property
+	def release_dates(self):
+		'''The `released` dates (YYYY-MM-DD) of every published
+		implementation, oldest first'''
+		return sorted(filter(None, [impl.get('released') for impl in self._implementations.values()]))
+
 	@property
 	def available_versions(self):
 		return self.project.versions
 
-	def unpublished_versions(self, newest_only=False):
-		versions = self.published_versions
-		log.debug("published versions: %r" % (versions,))
-		project_versions = self.available_versions
-		log.debug("project versions: %r" % (project_versions,))
+	def missing_versions(self, since=None):
+		'''Returns every unpublished version (oldest first), or just
+		those from version `since` onwards'''
+		index = self.project.version_index
+		if since is None:
+			candidates = index.versions
+		else:
+			start = index.find(since) or composite_version.parse(since)
+			candidates = ([start] if start in index else []) + index.newer_than(start)
+		return [version for version in candidates if version not in self._implementations]
 
+	def unpublished_versions(self, newest_only=False):
 		if newest_only:
-			project_versions = [max(project_versions)]
-		unpublished = set(project_versions).difference(set(versions))
+			project_versions = [self.project.latest_version]
+		else:
+			project_versions = self.available_versions
+		log.debug("project versions: %r" % (project_versions,))
+		unpublished = set(project_versions).difference(self._implementations)
 		log.debug("unpublished versions: %r" % (unpublished,))
-		return set(unpublished)
+		return unpublished
 
 	@property
 	def xml(self):
-		xml = self.doc.toxml()
-		proc = subprocess.Popen(['xmlformat'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-		stdout, _ = proc.communicate(xml.encode('utf-8'))
-		assert proc.returncode == 0, "xmlformat failed!"
-		return stdout.decode('utf-8')
+		buf = StringIO()
+		self.save(buf)
+		return buf.getvalue().decode('utf-8')
 
 	def save(self, outfile):
-		outfile.write(self.xml)
+		with timing.span('feed.save'):
+			xmlformat.write(self.doc, outfile)
 
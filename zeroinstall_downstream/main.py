@@ -2,21 +2,45 @@
 import os, sys
 import argparse
 import logging
-from zeroinstall_downstream.project import guess_project, SOURCES
-from zeroinstall_downstream.feed import Feed
+import glob
+import json
+import time
+import contextlib
+from multiprocessing.pool import ThreadPool
+from zeroinstall_downstream.project import guess_project, set_base_url, SOURCES, common
+from zeroinstall_downstream.feed import Feed, results as feed_results
+from zeroinstall_downstream import archive, archive_cache, archive_registry, response_cache, session, timing, metrics, watch as watcher
 
 def run():
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--debug', action='store_true')
+	parser.add_argument('--no-cache', action='store_false', dest='cache', help='don\'t use (or populate) the archive and upstream response caches')
+	parser.add_argument('--cache-size', type=int, default=archive_cache.DEFAULT_MAX_SIZE / (1024 * 1024), help='maximum size of the archive cache, in MB (default %(default)s)')
+	parser.add_argument('--revalidate', action='store_true', help='check cached archives are still current before using them')
+	parser.add_argument('--max-age', type=int, default=response_cache.DEFAULT_MAX_AGE, help='use cached upstream responses without revalidating them if they\'re less than this many seconds old (default %(default)s)')
+	parser.add_argument('--response-cache-size', type=int, default=response_cache.DEFAULT_MAX_SIZE / (1024 * 1024), help='maximum size of the upstream response cache, in MB (default %(default)s)')
+	parser.add_argument('--timeout', type=float, default=session.DEFAULT_TIMEOUT, help='network timeout, in seconds (default %(default)s)')
+	parser.add_argument('--connections', type=int, default=session.DEFAULT_CONNECTIONS, help='maximum concurrent connections to each host (default %(default)s)')
+	parser.add_argument('--upstream-base', action='append', default=[], metavar='TYPE[.ATTR]=URL', help='use a different server for an upstream type (e.g. a local stand-in registry)')
+	parser.add_argument('--profile', action='store_true', help='print how long each phase of the run took')
+	parser.add_argument('--profile-json', metavar='FILE', help='write the time taken by each phase of the run to FILE, as a JSON trace')
+	parser.add_argument('--cprofile', metavar='FILE', help='write cProfile statistics for the run to FILE (see the `pstats` module)')
+	parser.add_argument('--metrics', metavar='FILE', help='write metrics to FILE at the end of the run (as JSON if FILE ends with .json, otherwise as a Prometheus textfile)')
+	parser.add_argument('--metrics-interval', type=float, metavar='SECONDS', help='with --metrics, also write them every SECONDS during the run')
+	parser.add_argument('--hash-jobs', type=int, help='number of processes used to hash the files in extracted (non-tar) archives')
 	sub = parser.add_subparsers()
 	parser_new = sub.add_parser('new', help='make a new feed')
 	parser_new.set_defaults(func=new)
 	parser_update = sub.add_parser('update', help='update an existing feed')
 	parser_update.set_defaults(func=update)
+	parser_update_all = sub.add_parser('update-all', help='update many existing feeds')
+	parser_update_all.set_defaults(func=update_all)
 	parser_check = sub.add_parser('check', help='check whether a feed is up to date')
 	parser_check.set_defaults(func=check)
 	parser_list = sub.add_parser('list', help='list project / feed versions')
 	parser_list.set_defaults(func=list)
+	parser_watch = sub.add_parser('watch', help='keep checking feeds for new versions')
+	parser_watch.set_defaults(func=watch)
 
 	parser_new.add_argument('url', help='url of the upstream project\'s page (from one of %s)' % ", ".join(sorted(SOURCES.keys())))
 	parser_new.add_argument('feed', help='local feed file to create (must not exist)')
@@ -25,15 +49,66 @@ def run():
 	parser_update.add_argument('feed', help='local zeroinstall feed file')
 	parser_update.add_argument('--info', action='store_true', dest='just_info', help='update project info only')
 	parser_update.add_argument('--version', help='publish a specific version, not the newest')
-	parser_check.add_argument('feed', help='local or remote zeroinstall feed file')
+	parser_update.add_argument('--all-missing', action='store_true', help='publish every unpublished version')
+	parser_update.add_argument('--since', metavar='VERSION', help='with --all-missing, only publish this version and newer ones')
+	parser_update.add_argument('--jobs', '-j', type=int, default=4, help='with --all-missing, number of versions to download at once (default %(default)s)')
+	parser_update_all.add_argument('feeds', help='directory of feeds, or a file listing one feed path per line')
+	parser_update_all.add_argument('--info', action='store_true', dest='just_info', help='update project info only')
+	parser_update_all.add_argument('--jobs', '-j', type=int, default=8, help='number of feeds to process at once (default %(default)s)')
+	parser_check.add_argument('feeds', nargs='+', metavar='feed', help='local or remote zeroinstall feed files (or glob patterns)')
 	parser_check.add_argument('--all', action='store_true', help='check for any unpublished versions, not just the newest')
+	parser_check.add_argument('--jobs', '-j', type=int, default=8, help='number of feeds to check at once (default %(default)s)')
+	parser_check.add_argument('--json', action='store_true', help='print a JSON report (one line per feed)')
 	parser_list.add_argument('feed', help='local zeroinstall feed file')
+	parser_watch.add_argument('feeds', nargs='+', metavar='feed', help='local or remote zeroinstall feed files (or glob patterns)')
+	parser_watch.add_argument('--update', action='store_true', help='add new versions to (local) feeds, rather than just reporting them')
+	parser_watch.add_argument('--all', action='store_true', help='look for any unpublished versions, not just the newest')
+	parser_watch.add_argument('--jobs', '-j', type=int, default=8, help='number of feeds to check at once (default %(default)s)')
+	parser_watch.add_argument('--json', action='store_true', help='print a JSON report for each check (one per line)')
+	parser_watch.add_argument('--min-interval', type=int, default=watcher.DEFAULT_MIN_INTERVAL, metavar='SECONDS', help='never check a feed more often than this (default %(default)s)')
+	parser_watch.add_argument('--max-interval', type=int, default=watcher.DEFAULT_MAX_INTERVAL, metavar='SECONDS', help='always check a feed at least this often (default %(default)s)')
 
 	args = parser.parse_args()
 	if args.debug:
 		logging.getLogger().setLevel(logging.DEBUG)
 		logging.debug("debug mode enabled")
-	return args.func(args)
+	for spec in args.upstream_base:
+		set_base_url(spec)
+	session.configure(timeout=args.timeout, connections=args.connections)
+	archive.default_hash_jobs = args.hash_jobs
+	if args.hash_jobs > 1:
+		# (before any worker threads exist)
+		archive.start_hash_pool(args.hash_jobs)
+	if args.cache:
+		archive.default_cache = archive_cache.ArchiveCache(max_size=args.cache_size * 1024 * 1024, revalidate=args.revalidate)
+		common.response_cache = response_cache.ResponseCache(max_age=args.max_age, max_size=args.response_cache_size * 1024 * 1024)
+	if args.profile or args.profile_json:
+		timing.enabled = True
+		timing.tracing = bool(args.profile_json)
+		timing.reset()
+	if args.metrics_interval is not None and not args.metrics:
+		print "--metrics-interval can only be used with --metrics"
+		return 1
+	metrics_writer = None
+	if args.metrics:
+		metrics_writer = metrics.Writer(metrics.default_registry, args.metrics, interval=args.metrics_interval)
+	profiler = None
+	if args.cprofile:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
+	try:
+		return args.func(args)
+	finally:
+		if metrics_writer is not None:
+			metrics_writer.close()
+		if profiler is not None:
+			profiler.disable()
+			profiler.dump_stats(args.cprofile)
+		if args.profile:
+			timing.print_summary()
+		if args.profile_json:
+			timing.write_trace(args.profile_json)
 
 def new(opts):
 	project = guess_project(opts.url)
@@ -50,12 +125,118 @@ def new(opts):
 
 def update(opts):
 	assert os.path.exists(opts.feed)
-	with open(opts.feed, 'r+') as file:
+	if opts.all_missing and opts.version:
+		print "--all-missing and --version can't be used together"
+		return 1
+	if opts.since and not opts.all_missing:
+		print "--since can only be used with --all-missing"
+		return 1
+	failed = []
+	added = 0
+	try:
+		with open(opts.feed, 'r+') as file:
+			feed = Feed.from_file(file)
+			if opts.just_info:
+				pass
+			elif opts.all_missing:
+				versions = feed.missing_versions(since=opts.since)
+				with _shared_archives():
+					failed = feed.add_implementations(versions, jobs=opts.jobs)
+				for version, error in failed:
+					print "couldn't add version %s: %s: %s" % (version.pretty(), type(error).__name__, error)
+				added = len(versions) - len(failed)
+				print "added %s of %s missing versions" % (added, len(versions))
+			else:
+				feed.add_implementation(version_string=opts.version)
+				added = 1
+			_rewrite(file, feed)
+	except Exception:
+		feed_results.inc(result='error')
+		raise
+	if added:
+		feed_results.inc(result='updated')
+	else:
+		feed_results.inc(result='error' if failed else 'ok')
+	if failed:
+		return 1
+
+@contextlib.contextmanager
+def _shared_archives():
+	'''Share downloaded archives between the Archives created within this
+	block, for commands which may need the same archive more than once'''
+	with archive_registry.ArchiveRegistry() as registry:
+		archive.default_registry = registry
+		try:
+			yield
+		finally:
+			archive.default_registry = None
+
+def _rewrite(file, feed):
+	file.seek(0)
+	feed.save(file)
+	file.truncate()
+
+def _feed_paths(source):
+	'''Returns the feed paths in `source`, which is either a directory
+	(containing .xml feeds) or a file listing one feed path per line'''
+	if os.path.isdir(source):
+		return sorted(glob.glob(os.path.join(source, '*.xml')))
+	base = os.path.dirname(source)
+	with open(source) as listing:
+		lines = [line.strip() for line in listing]
+	return [os.path.join(base, os.path.expanduser(line)) for line in lines if line and not line.startswith('#')]
+
+_UP_TO_DATE = "up to date"
+
+def _update_feed(path, just_info=False):
+	'''Add the newest version to the feed at `path` (if it's missing),
+	returning a short description of what was done'''
+	with open(path, 'r+') as file:
 		feed = Feed.from_file(file)
-		if not opts.just_info:
-			feed.add_implementation(version_string=opts.version)
-		file.seek(0)
-		feed.save(file)
+		if just_info:
+			result, status = 'ok', "updated project info"
+		elif feed.unpublished_versions(newest_only=True):
+			feed.add_implementation()
+			result, status = 'updated', "added version %s" % (feed.project.latest_version.pretty(),)
+		else:
+			feed_results.inc(result='ok')
+			return _UP_TO_DATE
+		_rewrite(file, feed)
+		feed_results.inc(result=result)
+		return status
+
+def _in_parallel(func, items, jobs):
+	'''Call `func` on each of `items` (using at most `jobs` threads), yielding
+	(item, result, error) tuples in the order that they complete'''
+	def attempt(item):
+		try:
+			return (item, func(item), None)
+		except Exception as e:
+			logging.debug("processing %s failed" % (item,), exc_info=True)
+			return (item, None, e)
+	pool = ThreadPool(max(1, jobs))
+	try:
+		for result in pool.imap_unordered(attempt, items):
+			yield result
+	finally:
+		pool.terminate()
+
+def update_all(opts):
+	paths = _feed_paths(opts.feeds)
+	failed = up_to_date = 0
+	update = lambda path: _update_feed(path, just_info=opts.just_info)
+	with _shared_archives():
+		for path, status, error in _in_parallel(update, paths, opts.jobs):
+			if error is not None:
+				failed += 1
+				feed_results.inc(result='error')
+				status = "FAILED: %s: %s" % (type(error).__name__, error)
+			elif status == _UP_TO_DATE:
+				up_to_date += 1
+			print "%s: %s" % (path, status)
+	print "\n%s updated, %s up to date, %s failed" % (len(paths) - up_to_date - failed, up_to_date, failed)
+	if failed:
+		return 1
 
 def _format_version(version):
 	if version.exact: return version.upstream
@@ -95,27 +276,94 @@ def _list_versions(feed):
 				version.pretty())
 
 
-import contextlib
 def _feed_from_path(path):
 	if os.path.exists(path):
 		ctx = open(path)
 	else:
 		assert '://' in path, "file does not exist (and does not look like a URL): %s" % (path,)
-		ctx = contextlib.closing(urllib.urlopen(path))
+		ctx = contextlib.closing(session.urlopen(path, decode=True))
 	with ctx as file:
 		return Feed.from_file(file)
 
+def _expand_feeds(feeds):
+	paths = []
+	for feed in feeds:
+		if '://' in feed or os.path.exists(feed):
+			paths.append(feed)
+		else:
+			# unmatched patterns are kept, so that they get reported as missing
+			paths.extend(sorted(glob.glob(os.path.expanduser(feed))) or [feed])
+	return paths
+
+def _check_report(path, all_versions):
+	start = time.time()
+	report = {'feed': path}
+	try:
+		feed = _feed_from_path(path)
+		new_versions = feed.unpublished_versions(newest_only = not all_versions)
+		report['status'] = 'outdated' if new_versions else 'ok'
+		report['missing'] = sorted([v.upstream for v in new_versions])
+	except Exception as e:
+		logging.debug("checking %s failed" % (path,), exc_info=True)
+		report['status'] = 'error'
+		report['error'] = "%s: %s" % (type(e).__name__, e)
+	report['seconds'] = round(time.time() - start, 3)
+	feed_results.inc(result=report['status'])
+	return report
+
 def check(opts):
-	feed = _feed_from_path(opts.feed)
-	new_versions = feed.unpublished_versions(newest_only = not opts.all)
+	paths = _expand_feeds(opts.feeds)
+	if len(paths) == 1 and not opts.json:
+		return _check_feed(paths[0], opts.all)
+
+	ok = True
+	check_one = lambda path: _check_report(path, opts.all)
+	for path, report, _ in _in_parallel(check_one, paths, opts.jobs):
+		ok = ok and report['status'] == 'ok'
+		if opts.json:
+			print json.dumps(report, sort_keys=True)
+		elif report['status'] == 'ok':
+			print "feed %s is up to date" % (path,)
+		elif report['status'] == 'outdated':
+			print "feed %s is missing an implementation for version %s" % (path, ", ".join(report['missing']))
+		else:
+			print "feed %s could not be checked: %s" % (path, report['error'])
+		sys.stdout.flush()
+	if not ok:
+		return 1
+
+def _check_feed(path, all_versions):
+	try:
+		feed = _feed_from_path(path)
+		new_versions = feed.unpublished_versions(newest_only = not all_versions)
+	except Exception:
+		feed_results.inc(result='error')
+		raise
+	feed_results.inc(result='outdated' if new_versions else 'ok')
 	if new_versions:
 		_list_versions(feed)
 		print ""
 		new_upstream_versions = ", ".join(sorted([v.upstream for v in new_versions]))
-		print "feed %s\nis missing an implementation for version %s" % (opts.feed, new_upstream_versions)
+		print "feed %s\nis missing an implementation for version %s" % (path, new_upstream_versions)
 		return 1
 	else:
-		print "feed %s is up to date" % (opts.feed,)
+		print "feed %s is up to date" % (path,)
+
+def watch(opts):
+	if opts.min_interval > opts.max_interval:
+		print "--min-interval can't be greater than --max-interval"
+		return 1
+	report = None
+	if opts.json:
+		def report(result):
+			print json.dumps(result, sort_keys=True)
+			sys.stdout.flush()
+	w = watcher.Watcher(_expand_feeds(opts.feeds), update=opts.update, all_versions=opts.all,
+		jobs=opts.jobs, min_interval=opts.min_interval, max_interval=opts.max_interval, report=report)
+	try:
+		w.run()
+	except KeyboardInterrupt:
+		pass
 
 if __name__ == '__main__':
 	sys.exit(run())
@@ -0,0 +1,224 @@
+'''Operational metrics (request latencies, cache hit ratios, bytes
+downloaded, hashing throughput, feed outcomes), for monitoring long
+or repeated runs.
+
+Metrics are registered in `default_registry` when their module is
+imported, and are always collected. They can be written out as a
+Prometheus textfile (for node_exporter's textfile collector) or as
+a JSON snapshot - see `write` and `Writer`.'''
+
+import os
+import json
+import time
+import bisect
+import tempfile
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+PREFIX = 'zeroinstall_downstream_'
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class _Metric(object):
+	def __init__(self, name, help, labels=()):
+		self.name = name
+		self.help = help
+		self.labels = tuple(labels)
+		self._values = {}
+		self._lock = threading.Lock()
+
+	def _key(self, labels):
+		if set(labels) != set(self.labels):
+			raise ValueError("%s has labels %r, got %r" % (self.name, self.labels, sorted(labels)))
+		return tuple([str(labels[label]) for label in self.labels])
+
+	def _label_dict(self, key):
+		return dict(zip(self.labels, key))
+
+class Counter(_Metric):
+	type = 'counter'
+
+	def inc(self, amount=1, **labels):
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def value(self, **labels):
+		with self._lock:
+			return self._values.get(self._key(labels), 0)
+
+	def samples(self):
+		with self._lock:
+			return [(self.name, self._label_dict(key), value) for key, value in sorted(self._values.items())]
+
+	def snapshot(self):
+		with self._lock:
+			return [{'labels': self._label_dict(key), 'value': value} for key, value in sorted(self._values.items())]
+
+class Histogram(_Metric):
+	type = 'histogram'
+
+	def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+		super(Histogram, self).__init__(name, help, labels)
+		self.buckets = tuple(sorted(buckets))
+
+	def observe(self, value, **labels):
+		key = self._key(labels)
+		with self._lock:
+			counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+			counts[bisect.bisect_left(self.buckets, value)] += 1
+			self._values[key] = (counts, total + value)
+
+	def time(self, **labels):
+		'''A context manager which observes the time taken by its block'''
+		return _Timer(self, labels)
+
+	def samples(self):
+		samples = []
+		with self._lock:
+			for key, (counts, total) in sorted(self._values.items()):
+				labels = self._label_dict(key)
+				cumulative = 0
+				for bound, count in zip(self.buckets + ('+Inf',), counts):
+					cumulative += count
+					samples.append((self.name + '_bucket', dict(labels, le=_format_value(bound)), cumulative))
+				samples.append((self.name + '_sum', labels, total))
+				samples.append((self.name + '_count', labels, cumulative))
+		return samples
+
+	def snapshot(self):
+		with self._lock:
+			return [{
+				'labels': self._label_dict(key),
+				'buckets': dict(zip([_format_value(bound) for bound in self.buckets + ('+Inf',)], counts)),
+				'sum': total,
+				'count': sum(counts),
+			} for key, (counts, total) in sorted(self._values.items())]
+
+class _Timer(object):
+	def __init__(self, histogram, labels):
+		self.histogram = histogram
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.time()
+		return self
+
+	def __exit__(self, *a):
+		self.histogram.observe(time.time() - self.start, **self.labels)
+
+class Registry(object):
+	def __init__(self):
+		self._metrics = {}
+		self._lock = threading.Lock()
+
+	def _register(self, cls, name, *a, **k):
+		with self._lock:
+			metric = self._metrics.get(name)
+			if metric is None:
+				metric = self._metrics[name] = cls(name, *a, **k)
+			assert isinstance(metric, cls), "%s is already registered as a %s" % (name, metric.type)
+			return metric
+
+	def counter(self, name, help, labels=()):
+		return self._register(Counter, name, help, labels)
+
+	def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+		return self._register(Histogram, name, help, labels, buckets=buckets)
+
+	def get(self, name):
+		return self._metrics[name]
+
+	def metrics(self):
+		with self._lock:
+			return [metric for name, metric in sorted(self._metrics.items())]
+
+	def snapshot(self):
+		'''Returns the current value of every metric, as a JSON-able dict'''
+		return {
+			'time': time.time(),
+			'metrics': dict([(metric.name, {
+				'type': metric.type,
+				'help': metric.help,
+				'values': metric.snapshot(),
+			}) for metric in self.metrics()]),
+		}
+
+	def prometheus(self):
+		'''Returns every metric in the Prometheus text exposition format'''
+		lines = []
+		for metric in self.metrics():
+			name = PREFIX + metric.name
+			lines.append('# HELP %s %s' % (name, metric.help))
+			lines.append('# TYPE %s %s' % (name, metric.type))
+			for sample_name, labels, value in metric.samples():
+				lines.append('%s%s%s %s' % (PREFIX, sample_name, _format_labels(labels), _format_value(value)))
+		return ''.join([line + '\n' for line in lines])
+
+	def write(self, path):
+		'''Write every metric to `path` - as a JSON snapshot if it ends in
+		".json", otherwise as a Prometheus textfile. The file is replaced
+		atomically, so readers never see a partial write.'''
+		if path.endswith('.json'):
+			contents = json.dumps(self.snapshot(), indent=1, sort_keys=True)
+		else:
+			contents = self.prometheus()
+		fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.metrics-')
+		try:
+			with os.fdopen(fd, 'w') as out:
+				out.write(contents)
+			os.chmod(tmp, 0o644)
+			os.rename(tmp, path)
+		except:
+			os.remove(tmp)
+			raise
+
+def _format_labels(labels):
+	if not labels:
+		return ''
+	escape = lambda value: value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+	return '{%s}' % (','.join(['%s="%s"' % (label, escape(value)) for label, value in sorted(labels.items())]),)
+
+def _format_value(value):
+	if isinstance(value, basestring):
+		return value
+	if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+		return str(int(value))
+	return repr(value)
+
+class Writer(object):
+	'''Writes `registry` to `path` every `interval` seconds (from a
+	background thread) and once more when closed'''
+	def __init__(self, registry, path, interval=None):
+		self.registry = registry
+		self.path = path
+		self._stopped = threading.Event()
+		self._thread = None
+		if interval:
+			self._thread = threading.Thread(target=self._run, args=(interval,), name='metrics writer')
+			self._thread.daemon = True
+			self._thread.start()
+
+	def _run(self, interval):
+		while not self._stopped.wait(interval):
+			try:
+				self.registry.write(self.path)
+			except Exception:
+				log.warn("couldn't write metrics to %s" % (self.path,), exc_info=True)
+
+	def close(self):
+		self._stopped.set()
+		if self._thread is not None:
+			self._thread.join()
+		self.registry.write(self.path)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *a):
+		self.close()
+
+default_registry = Registry()
+counter = default_registry.counter
+histogram = default_registry.histogram
@@ -0,0 +1,89 @@
+'''Processing stages which run concurrently, connected by bounded buffers.
+
+Each Stage consumes an iterable of chunks in a background thread, and can be
+read like a file (or iterated, chunk by chunk) by the next stage. Stages
+block once they're `depth` chunks ahead of their reader, so memory use is
+bounded no matter how much faster one stage is than the next.'''
+
+import sys
+import Queue
+import threading
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_DEPTH = 16
+_END = object()
+
+class Stage(object):
+	def __init__(self, chunks, depth=DEFAULT_DEPTH, name='stage'):
+		self._queue = Queue.Queue(depth)
+		self._error = None
+		self._closed = False
+		self._eof = False
+		self._buf = ''
+		self._pos = 0
+		self._thread = threading.Thread(target=self._run, args=(chunks,), name=name)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self, chunks):
+		try:
+			for chunk in chunks:
+				if not self._put(chunk):
+					return
+		except BaseException:
+			log.debug("%s failed" % (self._thread.name,), exc_info=True)
+			self._error = sys.exc_info()
+		self._put(_END)
+
+	def _put(self, item):
+		# give up if the reader goes away, rather than blocking forever
+		while not self._closed:
+			try:
+				self._queue.put(item, timeout=0.1)
+				return True
+			except Queue.Full:
+				pass
+		return False
+
+	def _next_chunk(self):
+		if self._eof:
+			return None
+		chunk = self._queue.get()
+		if chunk is _END:
+			self._eof = True
+			if self._error is not None:
+				error_type, error, traceback = self._error
+				raise error_type, error, traceback
+			return None
+		return chunk
+
+	def __iter__(self):
+		if self._pos < len(self._buf):
+			yield self._buf[self._pos:]
+		self._buf, self._pos = '', 0
+		while True:
+			chunk = self._next_chunk()
+			if chunk is None:
+				return
+			yield chunk
+
+	def read(self, size=-1):
+		if size < 0:
+			return ''.join(list(self))
+		parts = []
+		while size > 0:
+			if self._pos >= len(self._buf):
+				chunk = self._next_chunk()
+				if chunk is None:
+					break
+				self._buf, self._pos = chunk, 0
+			part = self._buf[self._pos:self._pos + size]
+			self._pos += len(part)
+			size -= len(part)
+			parts.append(part)
+		return ''.join(parts)
+
+	def close(self):
+		self._closed = True
@@ -21,6 +21,22 @@ def make(**k):
 	except KeyError:
 		raise ValueError("no such project type: %s" % (project_type,))
 
+def set_base_url(spec):
+	'''Point a backend at a different server (e.g. a local stand-in
+	registry, for testing). `spec` is "TYPE=URL" to override the
+	backend's API base URL, or "TYPE.ATTRIBUTE=URL" to override
+	another of its URLs (e.g. "rubygems.download_base=...")'''
+	try:
+		name, url = spec.split('=', 1)
+		project_type, _, attr = name.partition('.')
+		cls = SOURCES[project_type]
+	except (ValueError, KeyError):
+		raise ValueError("can't parse base URL override: %s" % (spec,))
+	attr = attr or 'base'
+	if not (attr.endswith('base') and hasattr(cls, attr)):
+		raise ValueError("%s has no URL attribute named %r" % (project_type, attr))
+	setattr(cls, attr, url)
+
 def guess_project(url, **kw):
 	'''return a project from a URL (and optional additional attributes)'''
 	kw = kw.copy()
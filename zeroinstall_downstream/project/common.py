@@ -1,23 +1,43 @@
 from __future__ import absolute_import
-import requests
 import sys
 import json
+import time
+import urlparse
 import logging
-from .. import composite_version
+import threading
+import contextlib
+from multiprocessing.pool import ThreadPool
+from requests.utils import parse_header_links
+from .. import composite_version, session, timing, metrics
+from . import streamjson
+
+_property_locks_lock = threading.Lock()
 
 def cached_property(fn):
-	result = []
+	'''A property which is computed once per object, and then remembered
+	(in `_property_cache`). If several threads ask for it at once, one of
+	them computes it while the others wait.'''
+	name = fn.__name__
 	def get(self):
-		if not hasattr(self, '_property_cache'):
-			self._property_cache = {}
 		try:
-			return self._property_cache[fn.__name__]
-		except KeyError:
-			val = fn(self)
-			self._property_cache[fn.__name__] = val
-			return val
+			return self._property_cache[name]
+		except (AttributeError, KeyError):
+			pass
+		with _property_lock(self, name):
+			cache = self.__dict__.setdefault('_property_cache', {})
+			try:
+				return cache[name]
+			except KeyError:
+				val = fn(self)
+				cache[name] = val
+				return val
 	return property(get)
 
+def _property_lock(obj, name):
+	with _property_locks_lock:
+		locks = obj.__dict__.setdefault('_property_locks', {})
+		return locks.setdefault(name, threading.Lock())
+
 class Implementation(object):
 	extract = None
 	archive_type = None
@@ -32,9 +52,13 @@ class BaseProject(object):
 
 	@cached_property
 	def latest_version(self):
-		if len(self.versions) == 0:
+		if len(self.version_index) == 0:
 			raise RuntimeError("no versions found")
-		return max(self.versions)
+		return self.version_index.latest()
+
+	@cached_property
+	def version_index(self):
+		return composite_version.VersionIndex(self.versions)
 
 	@cached_property
 	def latest_release(self):
@@ -47,7 +71,88 @@ class BaseProject(object):
 				map(composite_version.try_parse,
 					self.version_strings)))
 
-def getjson(*a, **k):
-	response = requests.get(*a, **k)
-	assert response.ok, response.content
-	return json.loads(response.content)
+	def refresh(self):
+		'''Forget everything fetched from upstream, so that it's fetched
+		again next time it's needed (e.g. to look for new releases)'''
+		self.__dict__.pop('_property_cache', None)
+
+	def implementations_for(self, versions):
+		'''Returns the implementation for each of `versions`. Projects can
+		override this if they can look up many versions at once.'''
+		return [self.implementation_for(version) for version in versions]
+
+def parallel_map(func, items, jobs=10):
+	'''map(func, items), with up to `jobs` calls in progress at once'''
+	if len(items) <= 1:
+		return map(func, items)
+	pool = ThreadPool(max(1, min(jobs, len(items))))
+	try:
+		return pool.map(func, items)
+	finally:
+		pool.close()
+
+# a response_cache.ResponseCache used by getjson, if set
+response_cache = None
+
+_request_seconds = metrics.histogram('upstream_request_seconds', 'Time taken by upstream API requests (including cached ones), by backend', ['backend'])
+_request_failures = metrics.counter('upstream_request_failures_total', 'Failed upstream API requests, by backend', ['backend'])
+
+def _backend(url):
+	'''Returns the upstream type whose API serves `url` (or
+	its host, for URLs which aren't from a known API)'''
+	# (imported here, because every project type imports this module)
+	from . import SOURCES
+	for upstream_type, cls in SOURCES.items():
+		base = getattr(cls, 'base', None)
+		if isinstance(base, basestring) and url.startswith(base):
+			return upstream_type
+	return urlparse.urlparse(url).netloc
+
+@contextlib.contextmanager
+def _upstream_request(url):
+	backend = _backend(url)
+	start = time.time()
+	try:
+		with timing.span('upstream'):
+			yield
+	except Exception:
+		_request_failures.inc(backend=backend)
+		raise
+	finally:
+		_request_seconds.observe(time.time() - start, backend=backend)
+
+def _fetch(url, **k):
+	with _upstream_request(url):
+		if response_cache is not None:
+			return response_cache.get(url, **k)
+		response = session.get(url, **k)
+		assert response.ok, response.content
+		return response.content, response.headers
+
+def getjson(url, **k):
+	content, _ = _fetch(url, **k)
+	return json.loads(content)
+
+def _open(url, **k):
+	if response_cache is not None:
+		stream, _ = response_cache.open(url, **k)
+		return stream
+	return session.urlopen(url, decode=True, **k)
+
+def getjson_subset(url, paths, **k):
+	'''Like getjson, but parses the response incrementally and keeps
+	only the values at `paths` (see `streamjson.select`)'''
+	with _upstream_request(url):
+		with contextlib.closing(_open(url, **k)) as stream:
+			return streamjson.select(stream, paths)
+
+def getjson_pages(url, **k):
+	'''Yields the JSON content of each page of a paginated resource,
+	following `next` links in the Link header'''
+	while url is not None:
+		content, headers = _fetch(url, **k)
+		yield json.loads(content)
+		# the `next` URL already includes any query parameters
+		k.pop('params', None)
+		links = parse_header_links(headers.get('link') or '')
+		url = ([link['url'] for link in links if link.get('rel') == 'next'] or [None])[0]
@@ -3,7 +3,7 @@ import re
 
 import logging
 
-from .common import cached_property, Implementation, BaseProject, getjson
+from .common import cached_property, Implementation, BaseProject, getjson, getjson_pages, parallel_map
 from .. import composite_version
 
 
@@ -57,9 +57,10 @@ class Tag(object):
 
 class Github(BaseProject):
 	upstream_type = 'github'
+	base = 'https://api.github.com/'
 
 	@cached_property
-	def base(self): return 'https://api.github.com/repos/' + self.id
+	def api_url(self): return self.base + 'repos/' + self.id
 	
 	@classmethod
 	def parse_uri(cls, uri):
@@ -79,7 +80,10 @@ class Github(BaseProject):
 	
 	@cached_property
 	def tags(self):
-		return map(Tag, getjson(self.base + '/' + 'tags'))
+		tags = []
+		for page in getjson_pages(self.api_url + '/' + 'tags', params={'per_page': 100}):
+			tags.extend(map(Tag, page))
+		return tags
 	
 	@cached_property
 	def version_tags(self):
@@ -95,10 +99,16 @@ class Github(BaseProject):
 
 	def implementation_for(self, version):
 		return self.version_tags[version].implementation
+
+	def implementations_for(self, versions):
+		# each release date needs its own commit lookup, so do them concurrently
+		tags = [self.version_tags[version] for version in versions]
+		parallel_map(lambda tag: tag.commit_info, tags)
+		return [tag.implementation for tag in tags]
 	
 	@cached_property
 	def repo_info(self):
-		return getjson(self.base)
+		return getjson(self.api_url)
 
 	@cached_property
 	def homepage(self): return self.repo_info['html_url']
@@ -4,16 +4,26 @@ import operator
 import json
 import logging
 
-from .common import cached_property, Implementation, BaseProject, getjson
+from .common import cached_property, Implementation, BaseProject, getjson_subset
 from .. import composite_version
 
+# the "abbreviated" metadata document only includes what's needed to
+# install each version (it omits readmes, descriptions, etc), which
+# makes it a fraction of the size of the full document. Some registries
+# include release times in it, but registry.npmjs.org doesn't.
+ABBREVIATED_DOCUMENT = 'application/vnd.npm.install-v1+json'
+
 class Release(object):
 	def __init__(self, project, version_info):
+		self.project = project
 		self.info = version_info
 		self.version = composite_version.try_parse(version_info['version'])
 		self.url = version_info['dist']['tarball']
-		self.released = project._project_info['time'][self.version.upstream][:10]
-	
+
+	@cached_property
+	def released(self):
+		return self.project._release_times[self.version.upstream][:10]
+
 	@property
 	def implementation(self):
 		return Implementation(version=self.version, url=self.url, released=self.released)
@@ -27,20 +37,40 @@ class Npm(BaseProject):
 		return 'https://npmjs.org/package/' + self.id
 	
 	@cached_property
-	def _project_info(self):
-		return getjson(self.base + '/' + self.id)
+	def _abbreviated_info(self):
+		return getjson_subset(self.base + self.id, [
+				('versions', '*', 'version'),
+				('versions', '*', 'dist', 'tarball'),
+				('time',),
+			], headers={'Accept': ABBREVIATED_DOCUMENT})
 
 	@cached_property
 	def _version_info(self):
-		return self._project_info['versions']
+		return self._abbreviated_info['versions']
+
+	@cached_property
+	def _full_info(self):
+		# only fetched for what the abbreviated document lacks, and we
+		# don't need to keep (or decode) anything else from it
+		return getjson_subset(self.base + self.id, [
+			('description',),
+			('time',),
+		])
+
+	@cached_property
+	def _release_times(self):
+		times = self._abbreviated_info.get('time')
+		if times is None:
+			times = self._full_info['time']
+		return times
 
 	@cached_property
 	def summary(self):
-		return self._project_info['name'] + " npm package"
+		return self.id + " npm package"
 
 	@cached_property
 	def description(self):
-		return self._project_info['description']
+		return self._full_info.get('description')
 
 	@cached_property
 	def homepage(self):
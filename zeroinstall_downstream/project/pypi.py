@@ -1,19 +1,18 @@
 import re
 import logging
-import xmlrpclib
-import datetime
-from .common import cached_property, Implementation, BaseProject
+from .common import cached_property, Implementation, BaseProject, getjson
 
 class Pypi(BaseProject):
 	upstream_type = 'pypi'
+	base = 'http://pypi.python.org/pypi/'
+
 	def __init__(self, id):
 		self.id = id
 		self.upstream_id = id
-		self.client = xmlrpclib.ServerProxy('http://pypi.python.org/pypi')
 
 	@property
 	def url(self):
-		return "http://pypi.python.org/pypi/" + self.id
+		return self.base + self.id
 	
 	@classmethod
 	def parse_uri(cls, uri):
@@ -27,13 +26,30 @@ class Pypi(BaseProject):
 			logging.debug(e, exc_info=True)
 			raise ValueError("can't parse pypi project from %s" % (uri,))
 
+	@cached_property
+	def _project_info(self):
+		# a single request returns the metadata, files and upload times for every release
+		return getjson(self.base + self.id + '/json')
+
+	@cached_property
+	def _sdists(self):
+		# only versions with a (current) source release can be published, and
+		# the old XML-RPC API didn't list releases without any files either
+		sdists = {}
+		for version, files in self._project_info['releases'].items():
+			files = [info for info in files if info['packagetype'] == 'sdist' and not info.get('yanked')]
+			if files:
+				sdists[version] = files[0]
+		return sdists
+
 	@cached_property
 	def version_strings(self):
-		return self.client.package_releases(self.id)
+		return self._sdists.keys()
 
 	@cached_property
 	def _release_data(self):
-		return self.client.release_data(self.id, self.latest_version.upstream)
+		# this is the metadata of the newest release
+		return self._project_info['info']
 
 	@cached_property
 	def homepage(self): return self._release_data['home_page']
@@ -42,13 +58,7 @@ class Pypi(BaseProject):
 	@cached_property
 	def description(self): return self._release_data['description']
 	def implementation_for(self, version):
-		info = self.client.release_urls(self.id, version.upstream)
-		info = filter(lambda x: x['packagetype'] == 'sdist', info)
-		if len(info) == 0:
+		info = self._sdists.get(version.upstream)
+		if info is None:
 			raise ValueError("no `sdist` downloads found")
-		info = info[0]
-		released = datetime.datetime(*info['upload_time'].timetuple()[:6])
-		return Implementation(version=version, url=info['url'], released=released.strftime("%Y-%m-%d"))
-
-
-
+		return Implementation(version=version, url=info['url'], released=info['upload_time'][:10])
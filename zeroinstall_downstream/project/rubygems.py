@@ -12,7 +12,7 @@ class Release(object):
 	def __init__(self, project, version_info):
 		self.info = version_info
 		self.version = composite_version.try_parse(version_info['number'])
-		self.url = 'http://rubygems.org/gems/%s-%s.gem' % (project.id, self.version.upstream)
+		self.url = '%s%s-%s.gem' % (project.download_base, project.id, self.version.upstream)
 		self.released = version_info['built_at'][:10]
 	
 	@property
@@ -22,6 +22,7 @@ class Release(object):
 class Rubygems(BaseProject):
 	upstream_type = 'rubygems'
 	base = 'https://rubygems.org/api/v1/'
+	download_base = 'http://rubygems.org/gems/'
 
 	def __init__(self, id):
 		self.id = id
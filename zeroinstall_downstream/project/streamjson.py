@@ -0,0 +1,186 @@
+'''Incremental parsing of large JSON documents, keeping only selected parts.
+
+Paths are tuples of object keys, where '*' matches any key (or any array
+index). e.g ('versions', '*', 'dist', 'tarball') keeps just the tarball URL
+of each version. Anything not on a selected path is skipped over without
+being decoded, so memory use is bounded by the size of the selected values
+rather than the size of the document.'''
+
+import re
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+_structure = re.compile(r'["\[\]{}]')
+_string_body = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_scalar = re.compile(r'[^,\]}\s]*')
+
+SKIP, DESCEND, KEEP = range(3)
+
+def select(stream, paths):
+	'''Parse the JSON document in the file-like `stream`,
+	keeping only the values at `paths`.'''
+	return _Parser(stream, [tuple(path) for path in paths]).parse()
+
+class _Parser(object):
+	def __init__(self, stream, paths):
+		self.stream = stream
+		self.paths = paths
+		self.buf = ''
+		self.pos = 0
+		self.eof = False
+
+	def _more(self):
+		if self.eof:
+			raise ValueError("unexpected end of JSON document")
+		chunk = self.stream.read(CHUNK_SIZE)
+		if not chunk:
+			self.eof = True
+			return
+		# drop everything that's already been consumed
+		self.buf = self.buf[self.pos:] + chunk
+		self.pos = 0
+
+	def _peek(self):
+		while True:
+			self.pos = _whitespace.match(self.buf, self.pos).end()
+			if self.pos < len(self.buf):
+				return self.buf[self.pos]
+			self._more()
+
+	def _expect(self, char):
+		if self._peek() != char:
+			raise ValueError("expected %r at %r" % (char, self.buf[self.pos:self.pos+20]))
+		self.pos += 1
+
+	def _action(self, path):
+		action = SKIP
+		for selected in self.paths:
+			if len(selected) < len(path):
+				continue
+			if all([want == '*' or want == key for want, key in zip(selected, path)]):
+				if len(selected) == len(path):
+					return KEEP
+				action = DESCEND
+		return action
+
+	def parse(self):
+		value = self._value((), DESCEND)
+		if self._peek_end():
+			return value
+		raise ValueError("unexpected data after JSON document")
+
+	def _peek_end(self):
+		try:
+			self._peek()
+		except ValueError:
+			return True
+		return False
+
+	def _value(self, path, action):
+		if action == KEEP:
+			return self._decode()
+		char = self._peek()
+		if action == DESCEND and char == '{':
+			return self._object(path)
+		if action == DESCEND and char == '[':
+			return self._array(path)
+		self._skip()
+		return None
+
+	def _decode(self):
+		if self._peek() not in '"[{':
+			# make sure we have the whole of a scalar (e.g a number), not just its start
+			self._scalar_end()
+		while True:
+			try:
+				value, self.pos = _decoder.raw_decode(self.buf, self.pos)
+				return value
+			except ValueError:
+				# (probably) incomplete - try again with more data
+				self._more()
+
+	def _scalar_end(self):
+		while True:
+			end = _scalar.match(self.buf, self.pos).end()
+			if end < len(self.buf) or self.eof:
+				return end
+			self._more()
+
+	def _object(self, path):
+		result = {}
+		self._expect('{')
+		if self._peek() == '}':
+			self.pos += 1
+			return result
+		while True:
+			if self._peek() != '"':
+				raise ValueError("expected object key at %r" % (self.buf[self.pos:self.pos+20],))
+			key = self._decode()
+			self._expect(':')
+			action = self._action(path + (key,))
+			value = self._value(path + (key,), action)
+			if action != SKIP:
+				result[key] = value
+			char = self._peek()
+			self.pos += 1
+			if char == '}':
+				return result
+			if char != ',':
+				raise ValueError("expected ',' or '}' in object")
+
+	def _array(self, path):
+		result = []
+		self._expect('[')
+		if self._peek() == ']':
+			self.pos += 1
+			return result
+		while True:
+			result.append(self._value(path + ('*',), self._action(path + ('*',))))
+			char = self._peek()
+			self.pos += 1
+			if char == ']':
+				return result
+			if char != ',':
+				raise ValueError("expected ',' or ']' in array")
+
+	def _skip(self):
+		char = self._peek()
+		if char == '"':
+			self.pos += 1
+			self._skip_string()
+			return
+		if char not in '[{':
+			self.pos = self._scalar_end()
+			return
+		depth = 0
+		while True:
+			match = _structure.search(self.buf, self.pos)
+			if match is None:
+				self.pos = len(self.buf)
+				self._more()
+				continue
+			char = match.group()
+			self.pos = match.end()
+			if char == '"':
+				self._skip_string()
+			elif char in '[{':
+				depth += 1
+			else:
+				depth -= 1
+				if depth == 0:
+					return
+
+	def _skip_string(self):
+		# self.pos is just after the opening quote
+		while True:
+			end = _string_body.match(self.buf, self.pos).end()
+			if end < len(self.buf) and self.buf[end] == '"':
+				self.pos = end + 1
+				return
+			# discard what we've seen so far (except for a trailing backslash,
+			# which escapes the first character of the next chunk)
+			self.pos = end
+			self._more()
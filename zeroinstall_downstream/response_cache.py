@@ -0,0 +1,137 @@
+import os
+import time
+import hashlib
+import urllib
+import threading
+import contextlib
+
+from . import session, metrics
+from .cache import default_path, ensure_dir, load_json, save_json, save_chunks
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 0
+DEFAULT_MAX_SIZE = 100 * 1024 * 1024
+SAVED_HEADERS = ('link',)
+CHUNK_SIZE = 64 * 1024
+
+_requests = metrics.counter('response_cache_requests_total', 'Upstream responses requested through the cache, by result (fresh, revalidated or miss)', ['result'])
+
+class ResponseCache(object):
+	"""A persistent cache of HTTP response bodies.
+
+	Responses younger than `max_age` seconds are used without contacting
+	the server. Older responses are revalidated with a conditional request
+	(using the ETag / Last-Modified of the cached response), and the cached
+	body is reused if the server replies 304 Not Modified.
+
+	Once the cached bodies take up more than `max_size` bytes, the least
+	recently used responses are removed."""
+	def __init__(self, path=None, max_age=DEFAULT_MAX_AGE, max_size=DEFAULT_MAX_SIZE):
+		if path is None:
+			path = default_path('responses')
+		self.path = ensure_dir(path)
+		self.max_age = max_age
+		self.max_size = max_size
+		self._lock = threading.Lock()
+		self._size = None
+
+	def _path(self, url, params, headers):
+		key = url
+		if params:
+			key += '?' + urllib.urlencode(sorted(params.items()))
+		if headers:
+			# e.g. different `Accept` headers may return different documents
+			key += '\n' + repr(sorted(headers.items()))
+		return os.path.join(self.path, hashlib.sha1(key).hexdigest())
+
+	def get(self, url, **kw):
+		"""Returns the (body, headers) of `url`, from the cache if possible.
+		Only the headers in `SAVED_HEADERS` are kept for cached responses."""
+		stream, headers = self.open(url, **kw)
+		with contextlib.closing(stream):
+			return stream.read(), headers
+
+	def open(self, url, params=None, headers=None, **kw):
+		"""Like `get`, but returns a file-like object for the body"""
+		path = self._path(url, params, headers)
+		info = load_json(path + '.json')
+		if info is not None and not os.path.exists(path):
+			info = None
+		now = time.time()
+		headers = dict(headers or {})
+		if info is not None:
+			if now - info['fetched'] < self.max_age:
+				log.debug("using cached response for %s" % (url,))
+				_requests.inc(result='fresh')
+				return self._open(path), info.get('headers', {})
+			if info.get('etag'):
+				headers['If-None-Match'] = info['etag']
+			if info.get('last_modified'):
+				headers['If-Modified-Since'] = info['last_modified']
+
+		response = session.get(url, params=params, headers=headers, stream=True, **kw)
+		if info is not None and response.status_code == 304:
+			log.debug("cached response for %s is still current" % (url,))
+			_requests.inc(result='revalidated')
+			response.close()
+			info['fetched'] = now
+			save_json(path + '.json', info)
+			return self._open(path), info.get('headers', {})
+
+		_requests.inc(result='miss')
+		assert response.ok, response.content
+		saved_headers = dict([(name, response.headers.get(name)) for name in SAVED_HEADERS])
+		info = {
+			'url': url,
+			'etag': response.headers.get('etag'),
+			'last_modified': response.headers.get('last-modified'),
+			'headers': saved_headers,
+			'fetched': now,
+		}
+		if not (info['etag'] or info['last_modified'] or self.max_age):
+			# there's no way to reuse this response, so don't bother storing it
+			return session.Stream(response, decode=True, url=url), saved_headers
+		self._store(path, session.counted(url, response.iter_content(CHUNK_SIZE)), info)
+		return self._open(path), saved_headers
+
+	def _open(self, path):
+		os.utime(path, None)
+		return open(path, 'rb')
+
+	def _store(self, path, chunks, info):
+		with self._lock:
+			if self._size is None:
+				self._size = sum([size for _, _, size in self._entries()])
+			if os.path.exists(path):
+				self._size -= os.stat(path).st_size
+		size = save_chunks(path, chunks)
+		save_json(path + '.json', info)
+		with self._lock:
+			self._size += size
+			if self._size > self.max_size:
+				self._evict()
+
+	def _entries(self):
+		for filename in os.listdir(self.path):
+			if filename.startswith('.') or filename.endswith('.json'):
+				continue
+			path = os.path.join(self.path, filename)
+			try:
+				info = os.stat(path)
+			except OSError:
+				continue
+			yield (info.st_mtime, path, info.st_size)
+
+	def _evict(self):
+		# body files are touched whenever they're used, so
+		# their mtime records when they were last used
+		for _, path, size in sorted(self._entries()):
+			if self._size <= self.max_size:
+				break
+			log.debug("evicting cached response %s" % (path,))
+			for filename in (path, path + '.json'):
+				if os.path.exists(filename):
+					os.remove(filename)
+			self._size -= size
@@ -0,0 +1,107 @@
+import threading
+import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from . import timing, metrics
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_CONNECTIONS = 10
+
+# shared settings, see `configure`
+settings = {
+	'timeout': DEFAULT_TIMEOUT,
+	'connections': DEFAULT_CONNECTIONS,
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+_requests = metrics.counter('http_requests_total', 'HTTP requests made, by host', ['host'])
+_bytes = metrics.counter('http_response_bytes_total', 'HTTP response body bytes, by host', ['host'])
+
+def configure(timeout=None, connections=None):
+	'''Change the settings used by all subsequent requests.
+	`timeout` is in seconds, `connections` is the maximum number
+	of concurrent connections to any one host.'''
+	global _session
+	if timeout is not None:
+		settings['timeout'] = timeout
+	if connections is not None:
+		settings['connections'] = connections
+	with _session_lock:
+		_session = None
+
+def get_session():
+	'''Returns the requests.Session shared by everything in this process.
+	Connections are kept alive and reused for subsequent requests to
+	the same host.'''
+	global _session
+	with _session_lock:
+		if _session is None:
+			connections = settings['connections']
+			log.debug("creating HTTP session (%s connections per host)" % (connections,))
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections, pool_block=True)
+			session.mount('http://', adapter)
+			session.mount('https://', adapter)
+			_session = session
+		return _session
+
+def get(url, **kw):
+	kw.setdefault('timeout', settings['timeout'])
+	response = get_session().get(url, **kw)
+	host = urlparse.urlparse(url).netloc
+	_requests.inc(host=host)
+	timing.count('requests', host)
+	if not kw.get('stream'):
+		# (streamed bodies are counted as they're read - see `counted`)
+		_count_bytes(host, len(response.content))
+	return response
+
+def _count_bytes(host, size):
+	_bytes.inc(size, host=host)
+	timing.count('bytes', host, size)
+
+def counted(url, chunks):
+	'''Yields each of `chunks` (read from a streamed response from `url`),
+	counting their size as bytes received from its host'''
+	host = urlparse.urlparse(url).netloc
+	for chunk in chunks:
+		_count_bytes(host, len(chunk))
+		yield chunk
+
+def urlopen(url, headers=None, params=None, decode=False):
+	'''Like urllib2.urlopen, but using the shared session. Unless `decode`
+	is set, the body is returned exactly as it was sent (so compressed
+	archives are returned as-is, even if the server claims that
+	they're gzip-encoded), and the server is asked not to compress it
+	any further - so its content-length is the size of the file.'''
+	if not decode:
+		headers = dict(headers or {})
+		headers.setdefault('Accept-Encoding', 'identity')
+	response = get(url, headers=headers, params=params, stream=True)
+	response.raise_for_status()
+	return Stream(response, decode=decode, url=url)
+
+class Stream(object):
+	def __init__(self, response, decode=False, url=None):
+		self.response = response
+		self.status_code = response.status_code
+		self.decode = decode
+		# (bytes are counted against the host that was requested, even if it redirected)
+		self._host = urlparse.urlparse(url or response.url).netloc
+
+	def read(self, size=-1):
+		data = self.response.raw.read(None if size < 0 else size, decode_content=self.decode)
+		# (content-length is missing for chunked responses, so count what's read)
+		_count_bytes(self._host, len(data))
+		return data
+
+	def info(self):
+		return self.response.headers
+
+	def close(self):
+		self.response.close()
@@ -0,0 +1,125 @@
+'''Timing of the phases of a run (upstream requests, downloading,
+unpacking, hashing, feed parsing / saving), for --profile.
+
+Nothing is recorded unless `enabled` is set. Phases from different
+threads overlap, so their totals can add up to more than the wall time.'''
+
+import sys
+import json
+import time
+import threading
+import contextlib
+import collections
+
+# whether spans and counters are recorded (see main's --profile)
+enabled = False
+# whether each span is also kept, for `write_trace` (see main's --profile-json)
+tracing = False
+# the number of spans kept - once there are more, the oldest are dropped
+MAX_EVENTS = 100000
+
+_lock = threading.Lock()
+_start = time.time()
+_phases = {}
+_counters = {}
+_events = collections.deque(maxlen=MAX_EVENTS)
+
+def reset():
+	global _start, _events
+	with _lock:
+		_start = time.time()
+		_phases.clear()
+		_counters.clear()
+		_events = collections.deque(maxlen=MAX_EVENTS)
+
+@contextlib.contextmanager
+def span(name):
+	'''Record the time taken by the enclosed block as a `name` phase'''
+	if not enabled:
+		yield
+		return
+	start = time.time()
+	try:
+		yield
+	finally:
+		add(name, time.time() - start, start)
+
+def timed(name):
+	'''Decorator version of `span`'''
+	def decorator(fn):
+		def wrapper(*a, **k):
+			with span(name):
+				return fn(*a, **k)
+		wrapper.__name__ = fn.__name__
+		wrapper.__doc__ = fn.__doc__
+		return wrapper
+	return decorator
+
+def add(name, seconds, start=None):
+	'''Record `seconds` spent on the `name` phase. This is for time which
+	is accumulated piecemeal (e.g. reading a stream chunk by chunk),
+	where `span` would be too fine-grained.'''
+	if not enabled:
+		return
+	with _lock:
+		phase = _phases.get(name)
+		if phase is None:
+			phase = _phases[name] = {'calls': 0, 'total': 0.0, 'max': 0.0}
+		phase['calls'] += 1
+		phase['total'] += seconds
+		phase['max'] = max(phase['max'], seconds)
+		if tracing:
+			if start is None:
+				start = time.time() - seconds
+			_events.append((name, threading.current_thread().name, start, seconds))
+
+def count(name, key, amount=1):
+	'''Add `amount` to the `name` counter for `key` (e.g. the
+	number of HTTP requests to each host)'''
+	if not enabled:
+		return
+	with _lock:
+		counts = _counters.setdefault(name, {})
+		counts[key] = counts.get(key, 0) + amount
+
+def summary():
+	'''Returns a snapshot of everything recorded so far'''
+	with _lock:
+		return {
+			'wall': time.time() - _start,
+			'phases': dict([(name, dict(phase)) for name, phase in _phases.items()]),
+			'counters': dict([(name, dict(counts)) for name, counts in _counters.items()]),
+		}
+
+def print_summary(out=None):
+	out = out or sys.stderr
+	info = summary()
+	print >> out, "%-24s %8s %10s %10s %10s" % ('phase', 'calls', 'total', 'mean', 'max')
+	for name, phase in sorted(info['phases'].items(), key=lambda item: -item[1]['total']):
+		print >> out, "%-24s %8d %9.3fs %9.3fs %9.3fs" % (name, phase['calls'], phase['total'], phase['total'] / phase['calls'], phase['max'])
+	print >> out, "(wall time %.3fs - concurrent phases can add up to more than this)" % (info['wall'],)
+	counters = info['counters']
+	hosts = sorted(set(sum([counts.keys() for counts in counters.values()], [])))
+	if hosts:
+		print >> out
+		print >> out, "%-32s %10s %14s" % ('host', 'requests', 'bytes')
+		for host in hosts:
+			print >> out, "%-32s %10d %14d" % (host, counters.get('requests', {}).get(host, 0), counters.get('bytes', {}).get(host, 0))
+
+def write_trace(path):
+	'''Write everything recorded so far as JSON, including a `traceEvents`
+	list (which chrome://tracing can display) of the last MAX_EVENTS
+	spans, if `tracing` is set'''
+	info = summary()
+	with _lock:
+		threads = {}
+		events = []
+		for name, thread, start, seconds in _events:
+			tid = threads.setdefault(thread, len(threads))
+			events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': tid,
+				'ts': int((start - _start) * 1000000), 'dur': int(seconds * 1000000)})
+		for thread, tid in threads.items():
+			events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': tid, 'args': {'name': thread}})
+	info['traceEvents'] = events
+	with open(path, 'w') as out:
+		json.dump(info, out, indent=1, sort_keys=True)
@@ -0,0 +1,226 @@
+'''Repeatedly checks feeds for new upstream versions, from one long-running
+process (see `0downstream watch`).
+
+Feeds and their projects stay loaded between checks (along with the shared
+HTTP session's connections), and each feed is checked on its own schedule:
+
+ - a project which releases often is checked often: the interval is a
+   fraction of the typical gap between its recent releases, clamped to
+   [min_interval, max_interval]
+ - once a new version turns up, the next check comes after min_interval
+   (since releases tend to come in bursts, e.g. a quick bugfix release)
+ - failed checks are retried with exponential backoff'''
+
+import os
+import sys
+import time
+import random
+import calendar
+import contextlib
+import Queue
+from multiprocessing.pool import ThreadPool
+
+from .feed import Feed, results as feed_results
+from . import session, archive_registry
+
+import logging
+log = logging.getLogger(__name__)
+
+DEFAULT_MIN_INTERVAL = 15 * 60
+DEFAULT_MAX_INTERVAL = 24 * 60 * 60
+# for projects without enough releases to go on
+DEFAULT_INTERVAL = 6 * 60 * 60
+# the check interval is this fraction of the typical gap between releases
+RELEASE_GAP_FRACTION = 0.1
+# how many recent releases are used to estimate the typical gap
+RECENT_RELEASES = 10
+MAX_BACKOFF = 24 * 60 * 60
+# checks are spread out by up to this fraction of their interval, so that
+# feeds loaded at the same time don't all hit the network at once
+JITTER = 0.1
+# the longest we'll sleep at once, so that the process stays responsive
+MAX_SLEEP = 60
+
+def release_interval(release_dates, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL):
+	'''Returns how often (in seconds) to check a project which published
+	releases on `release_dates` (YYYY-MM-DD strings, oldest first)'''
+	timestamps = [_timestamp(date) for date in release_dates[-(RECENT_RELEASES + 1):]]
+	gaps = sorted([b - a for a, b in zip(timestamps, timestamps[1:])])
+	if not gaps:
+		interval = DEFAULT_INTERVAL
+	else:
+		interval = gaps[len(gaps) // 2] * RELEASE_GAP_FRACTION
+	return max(min_interval, min(max_interval, interval))
+
+def _timestamp(date):
+	return calendar.timegm(time.strptime(date[:10], '%Y-%m-%d'))
+
+class WatchedFeed(object):
+	def __init__(self, path):
+		self.path = path
+		self.feed = None
+		self.mtime = None
+		self.next_check = 0
+		self.interval = None
+		self.failures = 0
+		# versions which were missing from the feed at the last check
+		self.missing = set()
+
+	@property
+	def is_local(self):
+		return '://' not in self.path
+
+	def load(self):
+		'''(Re)load the feed, if it's not loaded or has changed on disk'''
+		if not self.is_local:
+			if self.feed is None:
+				with contextlib.closing(session.urlopen(self.path, decode=True)) as stream:
+					self.feed = Feed.from_file(stream)
+			return self.feed
+		mtime = os.stat(self.path).st_mtime
+		if self.feed is None or mtime != self.mtime:
+			log.debug("loading %s" % (self.path,))
+			with open(self.path) as file:
+				self.feed = Feed.from_file(file)
+			self.mtime = mtime
+		return self.feed
+
+	def save(self):
+		with open(self.path, 'r+') as file:
+			self.feed.save(file)
+			file.truncate()
+		self.mtime = os.stat(self.path).st_mtime
+
+class Watcher(object):
+	def __init__(self, paths, update=False, all_versions=False, jobs=8,
+			min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+			report=None, clock=time.time, sleep=time.sleep, jitter=JITTER):
+		self.feeds = [WatchedFeed(path) for path in paths]
+		self.update = update
+		self.all_versions = all_versions
+		self.jobs = jobs
+		self.min_interval = min_interval
+		self.max_interval = max_interval
+		self.report = report or _print_report
+		self.clock = clock
+		self.sleep = sleep
+		self.jitter = jitter
+		self._random = random.Random()
+
+	def due(self):
+		now = self.clock()
+		return [watched for watched in self.feeds if watched.next_check <= now]
+
+	def run(self, iterations=None):
+		'''Check feeds as they become due, forever (or for `iterations`
+		rounds, where a round is the feeds which were due at the same time).
+		A feed which becomes due is checked even while others are still in
+		progress, and each check is reported as soon as it finishes.'''
+		pool = ThreadPool(max(1, self.jobs))
+		done = Queue.Queue()
+		# WatchedFeed -> the _Round it was checked in
+		in_progress = {}
+		try:
+			while iterations is None or iterations > 0 or in_progress:
+				starting = iterations is None or iterations > 0
+				if starting:
+					due = [watched for watched in self.due() if watched not in in_progress]
+					if due:
+						checks = _Round(len(due))
+						for watched in due:
+							in_progress[watched] = checks
+							pool.apply_async(self._check_in_background, (watched, checks.registry, done))
+						if iterations is not None:
+							iterations -= 1
+							starting = iterations > 0
+				wait = MAX_SLEEP
+				waiting = [watched.next_check for watched in self.feeds if watched not in in_progress]
+				if starting and waiting:
+					wait = max(0, min(min(waiting) - self.clock(), MAX_SLEEP))
+				if not in_progress:
+					self.sleep(wait)
+					continue
+				# (unlike waiting on the pool's results, this can be interrupted)
+				try:
+					watched, report = done.get(timeout=wait)
+				except Queue.Empty:
+					continue
+				in_progress.pop(watched).finished()
+				self.report(report)
+		finally:
+			pool.terminate()
+			for checks in set(in_progress.values()):
+				checks.registry.close()
+
+	def _check_in_background(self, watched, registry, done):
+		done.put((watched, self.check(watched, registry)))
+
+	def check(self, watched, registry=None):
+		'''Check one feed (updating it if requested), and schedule its next
+		check. Returns a report dict, like `0downstream check --json`.
+		New versions' archives are shared via `registry`, if given.'''
+		start = self.clock()
+		report = {'feed': watched.path}
+		try:
+			feed = watched.load()
+			# look for new releases, rather than reusing what we found last time
+			feed.project.refresh()
+			new_versions = feed.unpublished_versions(newest_only = not self.all_versions)
+			report['missing'] = sorted([v.upstream for v in new_versions])
+			if not new_versions:
+				report['status'] = 'ok'
+			elif self.update and watched.is_local:
+				failed = feed.add_implementations(new_versions, registry=registry)
+				if len(failed) < len(new_versions):
+					watched.save()
+				if failed:
+					raise failed[0][1]
+				report['status'] = 'updated'
+			else:
+				report['status'] = 'outdated'
+			watched.failures = 0
+			newly_missing = set(report['missing']).difference(watched.missing)
+			watched.missing = set(report['missing']) if report['status'] == 'outdated' else set()
+			if newly_missing:
+				interval = self.min_interval
+			else:
+				interval = release_interval(feed.release_dates, self.min_interval, self.max_interval)
+		except Exception as e:
+			log.debug("checking %s failed" % (watched.path,), exc_info=True)
+			report['status'] = 'error'
+			report['error'] = "%s: %s" % (type(e).__name__, e)
+			watched.failures += 1
+			interval = min(MAX_BACKOFF, self.min_interval * 2 ** (watched.failures - 1))
+		feed_results.inc(result=report['status'])
+		if self.jitter:
+			interval *= self._random.uniform(1 - self.jitter, 1 + self.jitter)
+		watched.interval = interval
+		watched.next_check = start + interval
+		report['seconds'] = round(self.clock() - start, 3)
+		report['next_check'] = int(watched.next_check)
+		return report
+
+class _Round(object):
+	'''Feeds which are checked together, and share downloaded archives'''
+	def __init__(self, checks):
+		self.pending = checks
+		self.registry = archive_registry.ArchiveRegistry()
+
+	def finished(self):
+		self.pending -= 1
+		if self.pending == 0:
+			self.registry.close()
+
+def _print_report(report):
+	if report['status'] == 'ok':
+		message = "is up to date"
+	elif report['status'] == 'outdated':
+		message = "is missing an implementation for version %s" % (", ".join(report['missing']),)
+	elif report['status'] == 'updated':
+		message = "was updated with version %s" % (", ".join(report['missing']),)
+	else:
+		message = "could not be checked: %s" % (report['error'],)
+	print "%s: feed %s %s (next check at %s)" % (
+		time.strftime('%Y-%m-%d %H:%M:%S'), report['feed'], message,
+		time.strftime('%H:%M:%S', time.localtime(report['next_check'])))
+	sys.stdout.flush()
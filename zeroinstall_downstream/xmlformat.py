@@ -0,0 +1,61 @@
+'''Pretty-printing of feed documents, in the same layout as the
+`xmlformat` tool: one element per line, indented with tabs and with
+namespace declarations first, followed by all other attributes sorted
+by name. Elements containing only text are kept on a single line.'''
+
+from .document import Comment, ProcessingInstruction, is_namespace
+
+INDENT = '\t'
+
+def write(doc, out):
+	'''Write the document.Document `doc` to the file-like `out` (as UTF-8).
+	Each element is written as soon as it's formatted, rather than
+	building the whole output in memory.'''
+	out.write('<?xml version="1.0"?>\n')
+	for node in doc.nodes:
+		_write_node(node, out, 0)
+
+def _write(out, text):
+	out.write(text.encode('utf-8'))
+
+def _is_blank(text):
+	return text is None or not text.strip()
+
+def _write_node(node, out, depth):
+	prefix = INDENT * depth
+	if node.tag is Comment:
+		_write(out, '%s<!--%s-->\n' % (prefix, node.text))
+	elif node.tag is ProcessingInstruction:
+		_write(out, '%s<?%s?>\n' % (prefix, node.text))
+	else:
+		_write(out, prefix + '<' + node.tag + _attributes(node))
+		children = list(node)
+		if not children:
+			if _is_blank(node.text):
+				_write(out, '/>\n')
+			else:
+				_write(out, '>%s</%s>\n' % (_escape(node.text), node.tag))
+			return
+		_write(out, '>\n')
+		# text alongside other elements gets its own line
+		_write_text(node.text, out, depth + 1)
+		for child in children:
+			_write_node(child, out, depth + 1)
+			_write_text(child.tail, out, depth + 1)
+		_write(out, '%s</%s>\n' % (prefix, node.tag))
+
+def _write_text(text, out, depth):
+	if not _is_blank(text):
+		_write(out, INDENT * depth + _escape(text.strip()) + '\n')
+
+def _attributes(node):
+	attrs = node.attrib.items()
+	namespaces = sorted([(name, value) for name, value in attrs if is_namespace(name)])
+	others = sorted([(name, value) for name, value in attrs if not is_namespace(name)])
+	return ''.join([' %s="%s"' % (name, _escape(value, quote=True)) for name, value in namespaces + others])
+
+def _escape(text, quote=False):
+	text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+	if quote:
+		text = text.replace('"', '&quot;')
+	return text